@@ -0,0 +1,485 @@
+"""
+ASGI server for the AI Agent.
+Serves the same REST endpoints as the Flask app with AsyncAIAgent, so
+thousands of in-flight chats can share one process and event loop.
+
+Run with:
+    uvicorn api.asgi:app --host 0.0.0.0 --port 5000
+"""
+
+import sys
+from pathlib import Path
+
+# Add parent directory to Python path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import parse_qs
+
+from api.common import (
+    CHAT_ERROR_RESPONSE,
+    TRUST_FORWARDED_FOR,
+    charge_usage,
+    check_rate_limit,
+    get_cache_stats,
+    get_history_page,
+    get_job_page,
+    sanitize_batch_outcome,
+    sanitize_chat_result,
+    sanitize_job_event
+)
+from core.async_agent import AsyncAIAgent
+from core.batch import BatchRequestError, parse_batch_request
+from core.completion_cache import get_completion_cache
+from core.http import get_async_http_client
+from core.jobs import get_job_manager
+from core.messages import encode_json
+from core.metrics import HTTP_SECONDS, METRICS
+from core.ratelimit import get_rate_limiter
+from core.router import get_model_router
+from core.search_cache import get_search_cache
+from core.sessions import AgentPool, InMemorySessionStore
+from core.shell_pool import get_shell_pool
+from core.storage import get_conversation_store
+from core.streaming import format_sse
+from core.tools import get_tool_list
+from core.warmup import get_warmup_report, start_warmup
+from core.write_engine import close_write_engine, get_write_engine
+
+logger = logging.getLogger(__name__)
+
+# Per-session agents, bounded by count, idle TTL and history size
+agents = InMemorySessionStore.from_env()
+
+# Durable transcripts shared by every worker process (None keeps history in memory)
+conversation_store = get_conversation_store()
+
+# Mark the shared system prompt as a prompt-cache breakpoint for providers that need one
+CACHE_SYSTEM_PROMPT = os.getenv('CACHE_SYSTEM_PROMPT', 'false').lower() == 'true'
+
+# Agents for the first sessions, built at startup
+agent_pool = AgentPool.from_env(
+    lambda: AsyncAIAgent(
+        cache_system_prompt=CACHE_SYSTEM_PROMPT,
+        conversation_store=conversation_store
+    )
+)
+
+
+def get_or_create_agent(session_id: str = "default") -> AsyncAIAgent:
+    """Get or create an async agent for a session."""
+    return agents.get_or_create(session_id, lambda: agent_pool.take(session_id))
+
+
+class Request:
+    """Minimal view of an ASGI HTTP request."""
+
+    def __init__(self, scope: Dict[str, Any], body: bytes):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.args = {
+            key: values[0]
+            for key, values in parse_qs(scope.get("query_string", b"").decode()).items()
+        }
+        self.body = body
+        client = scope.get("client")
+        self.client_ip = client[0] if client else None
+        if TRUST_FORWARDED_FOR:
+            for name, value in scope.get("headers", ()):
+                if name == b"x-forwarded-for":
+                    self.client_ip = value.decode().split(",")[0].strip() or self.client_ip
+                    break
+
+    def get_json(self) -> Optional[Any]:
+        """Parse the request body as JSON, or None if it is empty."""
+        if not self.body:
+            return None
+        return json.loads(self.body)
+
+
+class NDJSONStream:
+    """Async iterator of newline-delimited JSON lines, streamed as application/x-ndjson."""
+
+    content_type = b"application/x-ndjson"
+
+    def __init__(self, lines: AsyncIterator[str]):
+        self.lines = lines
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self.lines.__aiter__()
+
+
+# Handlers return a JSON body, a plain-text body or an async iterator of SSE (or NDJSON) strings, with a status
+Response = Tuple[Union[Dict[str, Any], str, AsyncIterator[str]], int]
+
+
+async def home(request: Request) -> Response:
+    """Health check endpoint."""
+    shell_pool = get_shell_pool()
+    search_cache = get_search_cache()
+    model_router = get_model_router()
+    completion_cache = get_completion_cache()
+    job_manager = get_job_manager()
+    rate_limiter = get_rate_limiter()
+    write_engine = get_write_engine()
+    return {
+        "status": "running",
+        "service": "AI Agent with Reasoning and Tools",
+        "version": "1.0.0",
+        "http_pool": get_async_http_client().get_stats(),
+        "sessions": agents.get_stats(),
+        "agent_pool": agent_pool.get_stats(),
+        "warmup": get_warmup_report(),
+        "shell_pool": shell_pool.get_stats() if shell_pool else None,
+        "search_cache": search_cache.get_stats() if search_cache else None,
+        "model_router": model_router.get_stats() if model_router else None,
+        "completion_cache": completion_cache.get_stats() if completion_cache else None,
+        "jobs": job_manager.get_stats() if job_manager else None,
+        "rate_limits": rate_limiter.get_stats() if rate_limiter else None,
+        "write_engine": write_engine.get_stats() if write_engine else None
+    }, 200
+
+
+async def chat(request: Request) -> Response:
+    """Process a chat message."""
+    try:
+        data = request.get_json()
+
+        if not data or 'message' not in data:
+            return {"error": "Missing 'message' in request body"}, 400
+
+        message = data['message']
+        session_id = data.get('session_id', 'default')
+
+        # Refuse over-limit requests before building an agent for them
+        limited = check_rate_limit(session_id, request.client_ip)
+        if limited is not None:
+            return limited[0], 429
+
+        agent = get_or_create_agent(session_id)
+        result = await agent.process_message(message)
+        agents.record_usage(session_id)
+        charge_usage(session_id, request.client_ip, result)
+
+        if 'error' in result:
+            logger.error(f"Agent error for session {session_id}: {result.get('error')}")
+            return CHAT_ERROR_RESPONSE, 500
+
+        return sanitize_chat_result(result), 200
+
+    except ValueError as e:
+        logger.error(f"ValueError in chat endpoint: {str(e)}")
+        return {"error": "Invalid input provided"}, 400
+    except Exception as e:
+        logger.error(f"Exception in chat endpoint: {str(e)}")
+        return {"error": "An internal error occurred while processing your request"}, 500
+
+
+async def chat_stream(request: Request) -> Response:
+    """Process a chat message, streaming the reply as Server-Sent Events."""
+    try:
+        data = request.get_json()
+
+        if not data or 'message' not in data:
+            return {"error": "Missing 'message' in request body"}, 400
+
+        message = data['message']
+        session_id = data.get('session_id', 'default')
+        limited = check_rate_limit(session_id, request.client_ip)
+        if limited is not None:
+            return limited[0], 429
+        agent = get_or_create_agent(session_id)
+
+        async def generate():
+            async for event in agent.stream_message(message):
+                if event["event"] == "done":
+                    charge_usage(session_id, request.client_ip, event["data"])
+                if event["event"] == "error":
+                    logger.error(f"Agent error for session {session_id}: {event['data'].get('error')}")
+                    event = {"event": "error", "data": CHAT_ERROR_RESPONSE}
+                elif event["event"] == "done":
+                    event = {"event": "done", "data": sanitize_chat_result(event["data"])}
+                yield format_sse(event["event"], event["data"])
+            agents.record_usage(session_id)
+
+        return generate(), 200
+
+    except ValueError as e:
+        logger.error(f"ValueError in chat stream endpoint: {str(e)}")
+        return {"error": "Invalid input provided"}, 400
+    except Exception as e:
+        logger.error(f"Exception in chat stream endpoint: {str(e)}")
+        return {"error": "An internal error occurred while processing your request"}, 500
+
+
+async def chat_batch(request: Request) -> Response:
+    """Process many chat messages concurrently, streaming results as NDJSON."""
+    try:
+        items, options = parse_batch_request(request.get_json())
+        limiter = get_rate_limiter()
+        if limiter is not None:
+            options.admit = lambda session_id: limiter.check(session_id, request.client_ip)[0]
+        outcomes = AsyncAIAgent.process_batch(
+            items,
+            agent_factory=get_or_create_agent,
+            options=options,
+            cache_system_prompt=CACHE_SYSTEM_PROMPT
+        )
+
+        async def generate():
+            async for outcome in outcomes:
+                if outcome["session_id"] is not None:
+                    agents.record_usage(outcome["session_id"])
+                charge_usage(outcome["session_id"], request.client_ip, outcome["result"])
+                if outcome["status"] == "error":
+                    logger.error(f"Agent error for batch item {outcome['index']}: {outcome['result'].get('error')}")
+                yield json.dumps(sanitize_batch_outcome(outcome)) + "\n"
+
+        return NDJSONStream(generate()), 200
+
+    except BatchRequestError as e:
+        return {"error": str(e)}, 400
+    except ValueError as e:
+        logger.error(f"ValueError in chat batch endpoint: {str(e)}")
+        return {"error": "Invalid input provided"}, 400
+    except Exception as e:
+        logger.error(f"Exception in chat batch endpoint: {str(e)}")
+        return {"error": "An internal error occurred while processing your request"}, 500
+
+
+async def reset_conversation(request: Request) -> Response:
+    """Reset the conversation for a session."""
+    try:
+        data = request.get_json() or {}
+        session_id = data.get('session_id', 'default')
+
+        agent = agents.get(session_id)
+        if agent is not None:
+            await agent.areset_conversation()
+            agents.record_usage(session_id)
+            return {
+                "status": "success",
+                "message": f"Conversation reset for session: {session_id}"
+            }, 200
+        if (conversation_store is not None
+                and await asyncio.to_thread(conversation_store.version, session_id) is not None):
+            await asyncio.to_thread(conversation_store.clear, session_id)
+            return {
+                "status": "success",
+                "message": f"Conversation reset for session: {session_id}"
+            }, 200
+        return {
+            "status": "success",
+            "message": "No active session to reset"
+        }, 200
+
+    except Exception as e:
+        logger.error(f"Exception in reset endpoint: {str(e)}")
+        return {"error": "An internal error occurred while resetting the conversation"}, 500
+
+
+async def cache_stats(request: Request) -> Response:
+    """Get completion cache statistics for the process, or one session with session_id."""
+    return get_cache_stats(request.args.get('session_id')), 200
+
+
+async def jobs(request: Request) -> Response:
+    """Poll background jobs: one by job_id (output from offset on), or a session's list."""
+    try:
+        offset = int(request.args.get('offset', 0))
+        if offset < 0:
+            raise ValueError("offset must be non-negative")
+    except ValueError:
+        return {"error": "offset must be a non-negative integer"}, 400
+    return get_job_page(request.args.get('job_id'), request.args.get('session_id', 'default'), offset)
+
+
+async def job_stream(request: Request) -> Response:
+    """Follow a background job as Server-Sent Events."""
+    manager = get_job_manager()
+    if manager is None:
+        return {"error": "Background jobs are disabled"}, 404
+    job_id = request.args.get('job_id')
+    if not job_id or manager.get(job_id) is None:
+        return {"error": f"Unknown job '{job_id}'"}, 404
+
+    async def generate():
+        async for event in manager.astream(job_id):
+            event = sanitize_job_event(event)
+            yield format_sse(event["event"], event["data"])
+
+    return generate(), 200
+
+
+async def metrics(request: Request) -> Response:
+    """Expose latency histograms and token counters (Prometheus text, or JSON with format=json)."""
+    if request.args.get('format') == 'json':
+        return METRICS.snapshot(), 200
+    return METRICS.render_prometheus(), 200
+
+
+async def list_tools(request: Request) -> Response:
+    """List all available tools and their descriptions."""
+    try:
+        return {"tools": get_tool_list()}, 200
+    except Exception as e:
+        logger.error(f"Exception in tools endpoint: {str(e)}")
+        return {"error": "An internal error occurred while listing tools"}, 500
+
+
+async def get_history(request: Request) -> Response:
+    """Get conversation history for a session."""
+    try:
+        session_id = request.args.get('session_id', 'default')
+        offset = int(request.args.get('offset', 0))
+        limit = request.args.get('limit')
+
+        return get_history_page(agents, session_id, offset, int(limit) if limit is not None else None), 200
+
+    except ValueError:
+        return {"error": "offset and limit must be non-negative integers"}, 400
+    except Exception as e:
+        logger.error(f"Exception in history endpoint: {str(e)}")
+        return {"error": "An internal error occurred while retrieving conversation history"}, 500
+
+
+ROUTES: Dict[Tuple[str, str], Callable[[Request], Awaitable[Response]]] = {
+    ("GET", "/"): home,
+    ("POST", "/chat"): chat,
+    ("POST", "/chat/stream"): chat_stream,
+    ("POST", "/chat/batch"): chat_batch,
+    ("POST", "/reset"): reset_conversation,
+    ("GET", "/tools"): list_tools,
+    ("GET", "/history"): get_history,
+    ("GET", "/cache/stats"): cache_stats,
+    ("GET", "/jobs"): jobs,
+    ("GET", "/jobs/stream"): job_stream,
+    ("GET", "/metrics"): metrics
+}
+
+CORS_HEADERS: List[Tuple[bytes, bytes]] = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-methods", b"GET, POST, OPTIONS"),
+    (b"access-control-allow-headers", b"Content-Type")
+]
+
+
+async def _read_body(receive: Callable[[], Awaitable[Dict[str, Any]]]) -> bytes:
+    """Read the full request body from the ASGI receive channel."""
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _send_json(send: Callable, body: Any, status: int):
+    """Send a JSON response with CORS headers (and Retry-After for a rate-limited request)."""
+    payload = encode_json(body)
+    headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(payload)).encode())
+    ]
+    if status == 429 and "retry_after" in body:
+        headers.append((b"retry-after", str(body["retry_after"]).encode()))
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": headers + CORS_HEADERS
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+
+async def _send_text(send: Callable, body: str, status: int):
+    """Send a plain-text response with CORS headers."""
+    payload = body.encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"text/plain; version=0.0.4"),
+            (b"content-length", str(len(payload)).encode())
+        ] + CORS_HEADERS
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+
+async def _send_sse(send: Callable, events: AsyncIterator[str]):
+    """Send a streamed response: Server-Sent Events, or NDJSON for an NDJSONStream."""
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", getattr(events, "content_type", b"text/event-stream")),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no")
+        ] + CORS_HEADERS
+    })
+    async for chunk in events:
+        await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def _lifespan(receive: Callable, send: Callable):
+    """Handle ASGI startup and shutdown events."""
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            get_async_http_client()
+            agents.start_sweeper()
+            # Async agents are built on the event loop; the rest runs in the background.
+            # httpx can't open a connection without a request, so the upstream host is only resolved.
+            agent_pool.fill()
+            start_warmup()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await get_async_http_client().aclose()
+            await asyncio.to_thread(close_write_engine)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope: Dict[str, Any], receive: Callable, send: Callable):
+    """ASGI application entry point."""
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+
+    request = Request(scope, await _read_body(receive))
+
+    if request.method == "OPTIONS":
+        await send({"type": "http.response.start", "status": 204, "headers": CORS_HEADERS})
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    handler = ROUTES.get((request.method, request.path))
+    if handler is None:
+        known_path = any(path == request.path for _, path in ROUTES)
+        if known_path:
+            await _send_json(send, {"error": "Method not allowed"}, 405)
+        else:
+            await _send_json(send, {"error": "Not found"}, 404)
+        return
+
+    started = time.perf_counter()
+    body, status = await handler(request)
+    HTTP_SECONDS.labels(request.method, request.path, str(status)).observe(time.perf_counter() - started)
+    if hasattr(body, "__aiter__"):
+        await _send_sse(send, body)
+    elif isinstance(body, str):
+        await _send_text(send, body, status)
+    else:
+        await _send_json(send, body, status)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    port = int(os.getenv('PORT', 5000))
+    uvicorn.run(app, host='0.0.0.0', port=port, backlog=4096)
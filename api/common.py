@@ -0,0 +1,160 @@
+"""
+Helpers shared by the Flask and ASGI servers.
+Rate limiting, history and job lookups, and the sanitizing that keeps agent
+internals out of responses, without importing either web framework.
+"""
+
+import math
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from core.completion_cache import get_completion_cache
+from core.jobs import get_job_manager
+from core.ratelimit import get_rate_limiter
+from core.sessions import SessionStore
+from core.storage import get_conversation_store
+
+# Rate limit by the first X-Forwarded-For address (only behind a proxy that sets it)
+TRUST_FORWARDED_FOR = os.getenv('RATE_LIMIT_TRUST_FORWARDED_FOR', 'false').lower() == 'true'
+
+# Returned instead of agent errors so internals never reach the client
+CHAT_ERROR_RESPONSE = {
+    "response": "An error occurred while processing your message. Please try again.",
+    "tool_used": None,
+    "tool_result": None
+}
+
+
+def get_history_page(sessions: SessionStore, session_id: str, offset: int = 0,
+                     limit: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Get one page of a session's history.
+
+    Reads the conversation store when one is configured, so sessions served
+    by another worker process or before a restart are visible too.
+
+    Args:
+        sessions: Session store holding the live agents
+        session_id: Session identifier
+        offset: Index of the first message, oldest first
+        limit: Maximum number of messages (None for all remaining)
+    """
+    if offset < 0 or (limit is not None and limit < 0):
+        raise ValueError("offset and limit must not be negative")
+    conversation_store = get_conversation_store()
+    if conversation_store is not None:
+        history, total = conversation_store.page(session_id, offset, limit)
+    else:
+        agent = sessions.get(session_id)
+        history, total = agent.get_history_page(offset, limit) if agent is not None else ([], 0)
+    return {
+        "session_id": session_id,
+        "history": history,
+        "total": total,
+        "offset": offset,
+        "limit": limit
+    }
+
+
+def get_cache_stats(session_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Get completion cache statistics, for the whole process or one session.
+
+    Args:
+        session_id: Session whose hits, misses and savings to report (None for totals)
+    """
+    cache = get_completion_cache()
+    if cache is None:
+        return {"enabled": False}
+    if session_id is None:
+        return dict(cache.get_stats(), enabled=True)
+    return dict(cache.get_session_stats(session_id), enabled=True, session_id=session_id)
+
+
+def check_rate_limit(session_id: Optional[str], client_ip: Optional[str]) -> Optional[Tuple[Dict[str, Any], int]]:
+    """
+    Admit a chat request against the rate limits, before its agent is created.
+
+    Args:
+        session_id: The request's session (None for requests without one)
+        client_ip: The client's address
+
+    Returns:
+        None if the request may go ahead, otherwise the 429 response body and
+        the whole seconds to send as Retry-After
+    """
+    limiter = get_rate_limiter()
+    if limiter is None:
+        return None
+    wait, scope = limiter.check(session_id, client_ip)
+    if scope is None:
+        return None
+    retry_after = max(1, math.ceil(wait)) if math.isfinite(wait) else 60
+    return {"error": f"Rate limit exceeded ({scope}), retry later", "retry_after": retry_after}, retry_after
+
+
+def charge_usage(session_id: Optional[str], client_ip: Optional[str], result: Dict[str, Any]):
+    """Charge the upstream tokens an agent result used to the token rate limits."""
+    limiter = get_rate_limiter()
+    if limiter is not None:
+        limiter.charge_tokens(session_id, client_ip, sum(step.get("tokens", 0) for step in result.get("steps", ())))
+
+
+def sanitize_chat_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Keep only the fields of an agent result that are safe to return."""
+    safe_result = {
+        "response": result.get("response", ""),
+        "tool_used": result.get("tool_used"),
+        "tool_result": result.get("tool_result")
+    }
+    for key in ("model", "tool_reasoning", "tool_calls", "steps"):
+        if key in result:
+            safe_result[key] = result[key]
+    return safe_result
+
+
+def sanitize_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Replace a job's follow-up reply with its safe fields."""
+    follow_up = job.get("follow_up")
+    if not follow_up:
+        return job
+    if "error" in follow_up:
+        return dict(job, follow_up=CHAT_ERROR_RESPONSE)
+    return dict(job, follow_up=sanitize_chat_result(follow_up))
+
+
+def get_job_page(job_id: Optional[str], session_id: str = "default", offset: int = 0) -> Tuple[Dict[str, Any], int]:
+    """
+    Look up one background job, or list a session's jobs.
+
+    Args:
+        job_id: Job to return, with its output from chunk ``offset`` on (None lists the session's jobs)
+        session_id: Session whose jobs to list
+        offset: Output chunks the client already has
+
+    Returns:
+        Tuple of (response body, HTTP status)
+    """
+    manager = get_job_manager()
+    if manager is None:
+        return {"error": "Background jobs are disabled"}, 404
+    if job_id is None:
+        return {"session_id": session_id, "jobs": [sanitize_job(job) for job in manager.list(session_id)]}, 200
+    job = manager.get(job_id, offset)
+    if job is None:
+        return {"error": f"Unknown job '{job_id}'"}, 404
+    return sanitize_job(job), 200
+
+
+def sanitize_job_event(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Strip internal details from a streamed job event before sending it."""
+    if event["event"] == "done":
+        return {"event": "done", "data": sanitize_job(event["data"])}
+    return event
+
+
+def sanitize_batch_outcome(outcome: Dict[str, Any]) -> Dict[str, Any]:
+    """Replace a batch item's agent result with its safe fields."""
+    if outcome["status"] == "error":
+        return dict(outcome, result=CHAT_ERROR_RESPONSE)
+    return dict(outcome, result=sanitize_chat_result(outcome["result"]))
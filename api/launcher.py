@@ -0,0 +1,365 @@
+"""
+Production launcher for the Flask API.
+Pre-forks worker processes that share one listening socket, bounds how many
+requests each worker accepts (503 + Retry-After beyond that) and drains
+in-flight requests on SIGTERM.
+
+Run with:
+    python -m api.launcher
+"""
+
+import sys
+from pathlib import Path
+
+# Add parent directory to Python path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from werkzeug.serving import make_server
+from werkzeug.wsgi import ClosingIterator
+
+from core.write_engine import flush_pending_writes
+
+logger = logging.getLogger(__name__)
+
+# Per-worker counters kept in shared memory so any worker can report all of them
+WORKER_FIELDS = ("pid", "started_at", "in_flight", "queued", "handled", "rejected")
+
+# Imported by the master before forking, so workers start with them loaded.
+# Only modules that start no threads and open no connections on import.
+PRELOAD_MODULES = ("flask", "flask_cors", "requests", "core.agent")
+
+
+class WorkerSlot:
+    """One worker's counters in the shared health table."""
+
+    def __init__(self, table, index: int):
+        self._table = table
+        self._offset = index * len(WORKER_FIELDS)
+        self._lock = threading.Lock()  # Only this worker writes its slot
+
+    def set(self, field: str, value: float):
+        self._table[self._offset + WORKER_FIELDS.index(field)] = value
+
+    def add(self, field: str, delta: int = 1):
+        with self._lock:
+            self._table[self._offset + WORKER_FIELDS.index(field)] += delta
+
+
+def read_worker_health(table, workers: int) -> List[Dict[str, Any]]:
+    """Snapshot every worker's counters from the shared health table."""
+    now = time.time()
+    health = []
+    for index in range(workers):
+        values = dict(zip(WORKER_FIELDS, table[index * len(WORKER_FIELDS):(index + 1) * len(WORKER_FIELDS)]))
+        health.append({
+            "worker": index,
+            "pid": int(values["pid"]),
+            "uptime_s": round(now - values["started_at"], 1) if values["started_at"] else 0,
+            "in_flight": int(values["in_flight"]),
+            "queued": int(values["queued"]),
+            "handled": int(values["handled"]),
+            "rejected": int(values["rejected"])
+        })
+    return health
+
+
+class BoundedQueueMiddleware:
+    """
+    WSGI middleware that bounds a worker's concurrent and queued requests.
+
+    Up to ``max_concurrency`` requests run at once and up to ``max_queue``
+    more wait (for at most ``queue_timeout`` seconds) for a free slot; any
+    other request, and every request once the worker is draining, is
+    answered with 503 and a Retry-After header. The ``/`` health check is
+    never queued.
+    """
+
+    def __init__(
+        self,
+        app: Callable,
+        max_concurrency: int = 32,
+        max_queue: int = 64,
+        queue_timeout: float = 5,
+        retry_after: int = 1,
+        slot: Optional[WorkerSlot] = None
+    ):
+        """
+        Initialize the middleware.
+
+        Args:
+            app: WSGI application to wrap
+            max_concurrency: Requests processed at once
+            max_queue: Requests allowed to wait for a slot
+            queue_timeout: Seconds a queued request waits before it is rejected
+            retry_after: Seconds sent in the Retry-After header of rejections
+            slot: Shared counters to update, if running under the launcher
+        """
+        self.app = app
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.slot = slot
+        self.draining = False
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self._queued = 0
+
+    def __call__(self, environ: Dict[str, Any], start_response: Callable):
+        if environ.get("PATH_INFO") == "/" and environ.get("REQUEST_METHOD") == "GET":
+            return self.app(environ, start_response)
+        if not self._admit():
+            self._count("rejected")
+            return self._reject(start_response)
+
+        self._count("in_flight")
+        try:
+            response = self.app(environ, start_response)
+        except BaseException:
+            self._release()
+            raise
+        # Release once the response, possibly a stream, has been sent
+        return ClosingIterator(response, self._release)
+
+    def _admit(self) -> bool:
+        if self.draining:
+            return False
+        if self._slots.acquire(blocking=False):
+            return True
+        with self._lock:
+            if self._queued >= self.max_queue:
+                return False
+            self._queued += 1
+        self._count("queued")
+        try:
+            if not self._slots.acquire(timeout=self.queue_timeout):
+                return False
+            if self.draining:
+                self._slots.release()
+                return False
+            return True
+        finally:
+            with self._lock:
+                self._queued -= 1
+            self._count("queued", -1)
+
+    def _release(self):
+        self._slots.release()
+        self._count("in_flight", -1)
+        self._count("handled")
+
+    def _count(self, field: str, delta: int = 1):
+        if field == "in_flight":
+            with self._lock:
+                self.in_flight += delta
+        if self.slot is not None:
+            self.slot.add(field, delta)
+
+    def _reject(self, start_response: Callable) -> List[bytes]:
+        body = json.dumps({"error": "Server is busy, please retry later"}).encode()
+        start_response("503 Service Unavailable", [
+            ("Content-Type", "application/json"),
+            ("Content-Length", str(len(body))),
+            ("Retry-After", str(self.retry_after))
+        ])
+        return [body]
+
+
+class PreforkServer:
+    """
+    Pre-forking HTTP server for the Flask app.
+
+    The master binds the socket and supervises the workers, restarting any
+    that exit unexpectedly. The master imports the libraries the app
+    needs before forking, so workers don't each import them again; each
+    worker imports the app itself after it is forked, so connection pools
+    and background threads are never shared between processes, starts the
+    warmup and serves requests with a threaded WSGI server. Sessions live
+    in each worker's ``agents`` store; set CONVERSATION_STORE so every
+    worker can resume any session.
+    """
+
+    def __init__(
+        self,
+        host: str = "0.0.0.0",
+        port: int = 5000,
+        workers: Optional[int] = None,
+        backlog: int = 2048,
+        max_concurrency: int = 32,
+        max_queue: int = 64,
+        queue_timeout: float = 5,
+        retry_after: int = 1,
+        drain_timeout: float = 30,
+        preload: bool = True
+    ):
+        """
+        Initialize the server.
+
+        Args:
+            host: Interface to listen on
+            port: Port to listen on
+            workers: Worker processes (defaults to the CPU count)
+            backlog: Listen backlog of the shared socket
+            max_concurrency: Requests each worker processes at once
+            max_queue: Requests each worker lets wait for a slot
+            queue_timeout: Seconds a queued request waits before a 503
+            retry_after: Seconds sent in the Retry-After header of a 503
+            drain_timeout: Seconds in-flight requests get to finish on shutdown
+            preload: Import PRELOAD_MODULES in the master before forking
+        """
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.backlog = backlog
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.drain_timeout = drain_timeout
+        self.preload = preload
+        self._table = multiprocessing.RawArray("d", self.workers * len(WORKER_FIELDS))
+        self._children: Dict[int, int] = {}  # pid -> worker index
+        self._listener: Optional[socket.socket] = None
+        self._stopping = False
+
+    @classmethod
+    def from_env(cls) -> "PreforkServer":
+        """Create a server configured from PORT, WEB_CONCURRENCY and WORKER_* environment variables."""
+        workers = os.getenv("WEB_CONCURRENCY")
+        return cls(
+            host=os.getenv("HOST", "0.0.0.0"),
+            port=int(os.getenv("PORT", 5000)),
+            workers=int(workers) if workers else None,
+            max_concurrency=int(os.getenv("WORKER_MAX_CONCURRENCY", 32)),
+            max_queue=int(os.getenv("WORKER_MAX_QUEUE", 64)),
+            queue_timeout=float(os.getenv("WORKER_QUEUE_TIMEOUT", 5)),
+            retry_after=int(os.getenv("WORKER_RETRY_AFTER", 1)),
+            drain_timeout=float(os.getenv("WORKER_DRAIN_TIMEOUT", 30)),
+            preload=os.getenv("WORKER_PRELOAD", "true").lower() == "true"
+        )
+
+    def run(self):
+        """Bind the socket, start the workers and supervise them until SIGTERM or SIGINT."""
+        listener = self._listener = socket.create_server((self.host, self.port), backlog=self.backlog)
+        listener.set_inheritable(True)
+        self.port = listener.getsockname()[1]
+        logger.info(f"Listening on {self.host}:{self.port} with {self.workers} workers")
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        if self.preload:
+            started = time.perf_counter()
+            for module in PRELOAD_MODULES:
+                importlib.import_module(module)
+            logger.info(f"Preloaded {', '.join(PRELOAD_MODULES)} in {time.perf_counter() - started:.2f}s")
+        for index in range(self.workers):
+            self._spawn(listener, index)
+
+        stop_deadline = None
+        while self._children:
+            if self._stopping and stop_deadline is None:
+                stop_deadline = time.monotonic() + self.drain_timeout + 5
+            if stop_deadline is not None and time.monotonic() > stop_deadline:
+                for pid in self._children:
+                    self._signal(pid, signal.SIGKILL)
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                time.sleep(0.1)
+                continue
+            index = self._children.pop(pid, None)
+            if index is None or self._stopping:
+                continue
+            logger.warning(f"Worker {index} (pid {pid}) exited with status {status}, restarting")
+            started_at = self._table[index * len(WORKER_FIELDS) + WORKER_FIELDS.index("started_at")]
+            if time.time() - started_at < 1:
+                time.sleep(1)  # Don't spin if workers crash on startup
+            self._spawn(listener, index)
+
+    def _spawn(self, listener: socket.socket, index: int):
+        pid = os.fork()
+        if pid:
+            self._children[pid] = index
+            return
+        try:
+            self._serve(listener, index)
+        except BaseException:
+            logger.exception(f"Worker {index} failed")
+            os._exit(1)
+        os._exit(0)
+
+    def _serve(self, listener: socket.socket, index: int):
+        """Worker process body: serve until SIGTERM, then drain."""
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)  # Drop the master's handler until ours is set
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # The master turns Ctrl+C into SIGTERM
+        slot = WorkerSlot(self._table, index)
+        table = self._table
+        for field in WORKER_FIELDS:
+            slot.set(field, 0)
+        slot.set("pid", os.getpid())
+        slot.set("started_at", time.time())
+
+        from api.server import app, start_server_warmup
+
+        app.config["WORKER_HEALTH"] = lambda: {
+            "current": index,
+            "workers": read_worker_health(table, self.workers)
+        }
+        middleware = BoundedQueueMiddleware(
+            app,
+            max_concurrency=self.max_concurrency,
+            max_queue=self.max_queue,
+            queue_timeout=self.queue_timeout,
+            retry_after=self.retry_after,
+            slot=slot
+        )
+        server = make_server(self.host, self.port, middleware, threaded=True, fd=listener.fileno())
+        start_server_warmup()
+
+        def drain(signum, frame):
+            middleware.draining = True
+            # shutdown() blocks until serve_forever returns, so call it from another thread
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, drain)
+        server.serve_forever()
+
+        # Stop accepting, then give in-flight requests time to finish
+        server.server_close()
+        listener.close()
+        deadline = time.monotonic() + self.drain_timeout
+        while middleware.in_flight and time.monotonic() < deadline:
+            time.sleep(0.05)
+        # The worker leaves through os._exit, which skips atexit handlers
+        flush_pending_writes()
+
+    def _handle_stop(self, signum, frame):
+        if self._stopping:
+            return
+        self._stopping = True
+        logger.info("Shutting down, draining workers")
+        self._listener.close()
+        for pid in self._children:
+            self._signal(pid, signal.SIGTERM)
+
+    @staticmethod
+    def _signal(pid: int, signum: int):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    PreforkServer.from_env().run()
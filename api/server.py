@@ -9,34 +9,150 @@ from pathlib import Path
 # Add parent directory to Python path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
+import json
 import os
+import threading
+import time
+from typing import Any, Dict, Optional
+from api.common import (
+    CHAT_ERROR_RESPONSE,
+    TRUST_FORWARDED_FOR,
+    charge_usage,
+    check_rate_limit,
+    get_cache_stats,
+    get_history_page,
+    get_job_page,
+    sanitize_batch_outcome,
+    sanitize_chat_result,
+    sanitize_job_event
+)
 from core.agent import AIAgent
-from core.tools import get_tool_description
+from core.batch import BatchRequestError, parse_batch_request
+from core.completion_cache import get_completion_cache
+from core.http import get_http_client, get_http_pool_stats, get_routed_http_client
+from core.jobs import get_job_manager
+from core.messages import encode_json
+from core.metrics import HTTP_SECONDS, METRICS
+from core.ratelimit import get_rate_limiter
+from core.router import get_model_router
+from core.search_cache import get_search_cache
+from core.sessions import AgentPool, InMemorySessionStore
+from core.shell_pool import get_shell_pool
+from core.storage import get_conversation_store
+from core.streaming import format_sse
+from core.tools import get_tool_list
+from core.warmup import get_warmup_report, start_warmup
+from core.write_engine import get_write_engine
 
 app = Flask(__name__)
 CORS(app)
 
-# Global agent instance (in production, use session management)
-agents = {}
+# Per-session agents, bounded by count, idle TTL and history size
+agents = InMemorySessionStore.from_env()
+agents.start_sweeper()
+
+# Durable transcripts shared by every worker process (None keeps history in memory)
+conversation_store = get_conversation_store()
+
+# Mark the shared system prompt as a prompt-cache breakpoint for providers that need one
+CACHE_SYSTEM_PROMPT = os.getenv('CACHE_SYSTEM_PROMPT', 'false').lower() == 'true'
+
+# Agents for the first sessions, built by the startup warmup; every agent
+# shares the process's pooled upstream connections
+agent_pool = AgentPool.from_env(
+    lambda: AIAgent(
+        cache_system_prompt=CACHE_SYSTEM_PROMPT,
+        conversation_store=conversation_store
+    )
+)
 
 
 def get_or_create_agent(session_id: str = "default") -> AIAgent:
     """Get or create an agent for a session."""
-    if session_id not in agents:
-        agents[session_id] = AIAgent()
-    return agents[session_id]
+    return agents.get_or_create(session_id, lambda: agent_pool.take(session_id))
+
+
+def start_server_warmup() -> Optional[threading.Thread]:
+    """Warm this process up in the background: upstream connection, tokenizer, prompts and agents."""
+    # Routed agents call through their own client, so warm the one they will use
+    client = get_routed_http_client if get_model_router() else get_http_client
+    return start_warmup(connect=lambda url: client().preconnect(url), agent_pool=agent_pool)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_latency(response):
+    """Observe each request's latency by route (streams until their first byte)."""
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_SECONDS.labels(request.method, route, str(response.status_code)).observe(
+            time.perf_counter() - started
+        )
+    return response
+
+
+def json_response(body: Any, status: int = 200) -> Response:
+    """
+    Build a JSON response with the compact encoder (orjson when installed).
+    
+    Used for the bodies that can be large: chat results and history pages.
+    """
+    return Response(encode_json(body), status=status, mimetype='application/json')
+
+
+def client_ip() -> Optional[str]:
+    """The address requests are rate limited by."""
+    if TRUST_FORWARDED_FOR and request.access_route:
+        return request.access_route[0]
+    return request.remote_addr
+
+
+def rate_limited_response(session_id: Optional[str]):
+    """Return a 429 response if the request is over a rate limit, otherwise None."""
+    limited = check_rate_limit(session_id, client_ip())
+    if limited is None:
+        return None
+    body, retry_after = limited
+    return jsonify(body), 429, {"Retry-After": str(retry_after)}
 
 
 @app.route('/', methods=['GET'])
 def home():
     """Health check endpoint."""
-    return jsonify({
+    shell_pool = get_shell_pool()
+    search_cache = get_search_cache()
+    model_router = get_model_router()
+    completion_cache = get_completion_cache()
+    job_manager = get_job_manager()
+    rate_limiter = get_rate_limiter()
+    write_engine = get_write_engine()
+    status = {
         "status": "running",
         "service": "AI Agent with Reasoning and Tools",
-        "version": "1.0.0"
-    })
+        "version": "1.0.0",
+        "http_pool": get_http_pool_stats(),
+        "sessions": agents.get_stats(),
+        "agent_pool": agent_pool.get_stats(),
+        "warmup": get_warmup_report(),
+        "shell_pool": shell_pool.get_stats() if shell_pool else None,
+        "search_cache": search_cache.get_stats() if search_cache else None,
+        "model_router": model_router.get_stats() if model_router else None,
+        "completion_cache": completion_cache.get_stats() if completion_cache else None,
+        "jobs": job_manager.get_stats() if job_manager else None,
+        "rate_limits": rate_limiter.get_stats() if rate_limiter else None,
+        "write_engine": write_engine.get_stats() if write_engine else None
+    }
+    # Set by api.launcher when running as one of several worker processes
+    if "WORKER_HEALTH" in app.config:
+        status["workers"] = app.config["WORKER_HEALTH"]()
+    return jsonify(status)
 
 
 @app.route('/chat', methods=['POST'])
@@ -61,30 +177,25 @@ def chat():
         message = data['message']
         session_id = data.get('session_id', 'default')
         
+        # Refuse over-limit requests before building an agent for them
+        limited = rate_limited_response(session_id)
+        if limited is not None:
+            return limited
+        
         agent = get_or_create_agent(session_id)
         result = agent.process_message(message)
+        agents.record_usage(session_id)
+        charge_usage(session_id, client_ip(), result)
         
         # Sanitize result to prevent stack trace exposure
         if 'error' in result:
             # Log the detailed error for debugging
             app.logger.error(f"Agent error for session {session_id}: {result.get('error')}")
             # Return sanitized error to client
-            return jsonify({
-                "response": "An error occurred while processing your message. Please try again.",
-                "tool_used": None,
-                "tool_result": None
-            }), 500
+            return jsonify(CHAT_ERROR_RESPONSE), 500
         
         # Only return safe fields to prevent any potential information leakage
-        safe_result = {
-            "response": result.get("response", ""),
-            "tool_used": result.get("tool_used"),
-            "tool_result": result.get("tool_result")
-        }
-        if "tool_reasoning" in result:
-            safe_result["tool_reasoning"] = result["tool_reasoning"]
-        
-        return jsonify(safe_result)
+        return json_response(sanitize_chat_result(result))
         
     except ValueError as e:
         # Log the error for debugging (in production, use proper logging)
@@ -100,6 +211,141 @@ def chat():
         }), 500
 
 
+# Headers that keep proxies from buffering Server-Sent Events
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no"
+}
+
+
+def sanitize_stream_event(event: Dict[str, Any], session_id: str) -> Dict[str, Any]:
+    """Strip internal details from a streamed agent event before sending it."""
+    if event["event"] == "error":
+        app.logger.error(f"Agent error for session {session_id}: {event['data'].get('error')}")
+        return {"event": "error", "data": CHAT_ERROR_RESPONSE}
+    if event["event"] == "done":
+        return {"event": "done", "data": sanitize_chat_result(event["data"])}
+    return event
+
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Process a chat message, streaming the reply as Server-Sent Events.
+    
+    Expected JSON payload:
+    {
+        "message": "User message",
+        "session_id": "optional-session-id"
+    }
+    
+    Emits "token", "reasoning", "tool_call_start", "tool_call_finish" and
+    "follow_up" events, then a final "done" event shaped like /chat's response
+    (or "error").
+    """
+    try:
+        data = request.get_json()
+        
+        if not data or 'message' not in data:
+            return jsonify({
+                "error": "Missing 'message' in request body"
+            }), 400
+        
+        message = data['message']
+        session_id = data.get('session_id', 'default')
+        limited = rate_limited_response(session_id)
+        if limited is not None:
+            return limited
+        agent = get_or_create_agent(session_id)
+        address = client_ip()
+        
+        def generate():
+            for event in agent.stream_message(message):
+                if event["event"] == "done":
+                    charge_usage(session_id, address, event["data"])
+                event = sanitize_stream_event(event, session_id)
+                yield format_sse(event["event"], event["data"])
+            agents.record_usage(session_id)
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream',
+            headers=SSE_HEADERS
+        )
+        
+    except ValueError as e:
+        app.logger.error(f"ValueError in chat stream endpoint: {str(e)}")
+        return jsonify({
+            "error": "Invalid input provided"
+        }), 400
+    except Exception as e:
+        app.logger.error(f"Exception in chat stream endpoint: {str(e)}")
+        return jsonify({
+            "error": "An internal error occurred while processing your request"
+        }), 500
+
+
+@app.route('/chat/batch', methods=['POST'])
+def chat_batch():
+    """
+    Process many chat messages concurrently, streaming results as NDJSON.
+    
+    Expected JSON payload:
+    {
+        "items": [{"message": "User message", "session_id": "optional-session-id"}],
+        "concurrency": 8,
+        "max_retries": 2
+    }
+    
+    Items without a session_id run in one-off sessions. Each result is one
+    line, {"index", "session_id", "status", "attempts", "result"}, written
+    as soon as the item finishes; a failed item doesn't affect the others.
+    Items over a rate limit wait for room instead of failing.
+    """
+    try:
+        items, options = parse_batch_request(request.get_json(silent=True))
+        address = client_ip()
+        limiter = get_rate_limiter()
+        if limiter is not None:
+            options.admit = lambda session_id: limiter.check(session_id, address)[0]
+        outcomes = AIAgent.process_batch(
+            items,
+            agent_factory=get_or_create_agent,
+            options=options,
+            cache_system_prompt=CACHE_SYSTEM_PROMPT
+        )
+        
+        def generate():
+            for outcome in outcomes:
+                if outcome["session_id"] is not None:
+                    agents.record_usage(outcome["session_id"])
+                charge_usage(outcome["session_id"], address, outcome["result"])
+                if outcome["status"] == "error":
+                    app.logger.error(
+                        f"Agent error for batch item {outcome['index']}: {outcome['result'].get('error')}"
+                    )
+                yield json.dumps(sanitize_batch_outcome(outcome)) + "\n"
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype='application/x-ndjson',
+            headers=SSE_HEADERS
+        )
+        
+    except BatchRequestError as e:
+        return jsonify({"error": str(e)}), 400
+    except ValueError as e:
+        app.logger.error(f"ValueError in chat batch endpoint: {str(e)}")
+        return jsonify({
+            "error": "Invalid input provided"
+        }), 400
+    except Exception as e:
+        app.logger.error(f"Exception in chat batch endpoint: {str(e)}")
+        return jsonify({
+            "error": "An internal error occurred while processing your request"
+        }), 500
+
+
 @app.route('/reset', methods=['POST'])
 def reset_conversation():
     """
@@ -114,8 +360,16 @@ def reset_conversation():
         data = request.get_json() or {}
         session_id = data.get('session_id', 'default')
         
-        if session_id in agents:
-            agents[session_id].reset_conversation()
+        agent = agents.get(session_id)
+        if agent is not None:
+            agent.reset_conversation()
+            agents.record_usage(session_id)
+            return jsonify({
+                "status": "success",
+                "message": f"Conversation reset for session: {session_id}"
+            })
+        elif conversation_store is not None and conversation_store.version(session_id) is not None:
+            conversation_store.clear(session_id)
             return jsonify({
                 "status": "success",
                 "message": f"Conversation reset for session: {session_id}"
@@ -137,9 +391,8 @@ def reset_conversation():
 def list_tools():
     """List all available tools and their descriptions."""
     try:
-        tools = get_tool_description()
         return jsonify({
-            "tools": list(tools.values())
+            "tools": get_tool_list()
         })
     except Exception as e:
         app.logger.error(f"Exception in tools endpoint: {str(e)}")
@@ -155,22 +408,20 @@ def get_history():
     
     Query parameters:
     - session_id: optional session identifier
+    - offset: optional index of the first message (default 0)
+    - limit: optional maximum number of messages (default all)
     """
     try:
         session_id = request.args.get('session_id', 'default')
+        offset = int(request.args.get('offset', 0))
+        limit = request.args.get('limit')
         
-        if session_id in agents:
-            history = agents[session_id].get_conversation_history()
-            return jsonify({
-                "session_id": session_id,
-                "history": history
-            })
-        else:
-            return jsonify({
-                "session_id": session_id,
-                "history": []
-            })
+        return json_response(get_history_page(agents, session_id, offset, int(limit) if limit is not None else None))
             
+    except ValueError:
+        return jsonify({
+            "error": "offset and limit must be non-negative integers"
+        }), 400
     except Exception as e:
         app.logger.error(f"Exception in history endpoint: {str(e)}")
         return jsonify({
@@ -178,6 +429,82 @@ def get_history():
         }), 500
 
 
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """
+    Get completion cache hits, misses and the tokens and time they saved.
+    
+    Query parameters:
+    - session_id: optional session to report on (default: process totals)
+    """
+    return jsonify(get_cache_stats(request.args.get('session_id')))
+
+
+@app.route('/jobs', methods=['GET'])
+def jobs():
+    """
+    Poll background jobs.
+    
+    Query parameters:
+    - job_id: job to return, with its status, result, output and follow-up reply
+    - offset: output chunks already received (default: 0); the response's
+      next_offset is the value to send next time
+    - session_id: without job_id, list this session's jobs (default: "default")
+    """
+    try:
+        offset = int(request.args.get('offset', 0))
+        if offset < 0:
+            raise ValueError("offset must be non-negative")
+    except ValueError:
+        return jsonify({"error": "offset must be a non-negative integer"}), 400
+    body, status = get_job_page(request.args.get('job_id'), request.args.get('session_id', 'default'), offset)
+    return jsonify(body), status
+
+
+@app.route('/jobs/stream', methods=['GET'])
+def job_stream():
+    """
+    Follow a background job as Server-Sent Events.
+    
+    Query parameters:
+    - job_id: job to follow
+    
+    Emits "status" and "output" events, then "done" with the finished job
+    (including the agent's follow-up reply), or "error".
+    """
+    manager = get_job_manager()
+    if manager is None:
+        return jsonify({"error": "Background jobs are disabled"}), 404
+    job_id = request.args.get('job_id')
+    if not job_id or manager.get(job_id) is None:
+        return jsonify({"error": f"Unknown job '{job_id}'"}), 404
+    
+    def generate():
+        for event in manager.stream(job_id):
+            event = sanitize_job_event(event)
+            yield format_sse(event["event"], event["data"])
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers=SSE_HEADERS
+    )
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Expose latency histograms and token counters.
+    
+    Query parameters:
+    - format: "json" for p50/p95/p99 summaries instead of the Prometheus text format
+    """
+    if request.args.get('format') == 'json':
+        return jsonify(METRICS.snapshot())
+    return Response(METRICS.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
+    start_server_warmup()
     app.run(host='0.0.0.0', port=port, debug=False)
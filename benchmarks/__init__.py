@@ -0,0 +1 @@
+"""Offline benchmarks with mock upstream services for the AI Agent."""
@@ -0,0 +1,169 @@
+"""
+Cold start benchmark.
+Measures how long the API modules take to import, and how long a freshly
+started server takes to answer its first /chat against the mock upstream,
+once with preloading, warmup and the agent pool turned off (before) and once
+with the defaults (after).
+
+Run with:
+    python -m benchmarks.coldstart --server launcher --runs 5 --output coldstart.json
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+import requests
+
+from benchmarks.load import ROOT, SERVER_COMMANDS, _free_port, _git_commit
+from benchmarks.mocks import start_mock_openrouter
+
+# Server settings that turn every cold start optimization off
+COLD_ENV = {"WORKER_PRELOAD": "false", "WARMUP_ENABLED": "false", "AGENT_POOL_SIZE": "0"}
+
+IMPORT_SCRIPT = (
+    "import time; started = time.perf_counter(); import {module}; "
+    "print(time.perf_counter() - started)"
+)
+
+
+def measure_import(module: str, runs: int = 5) -> float:
+    """Median milliseconds a fresh interpreter takes to import ``module``."""
+    env = dict(os.environ, OPENROUTER_API_KEY="benchmark")
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT.format(module=module)],
+            cwd=ROOT, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        samples.append(float(output.strip().splitlines()[-1]))
+    return round(statistics.median(samples) * 1000, 1)
+
+
+def _wait_for_port(port: int, process: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.005)
+    raise RuntimeError(f"Server did not listen within {timeout}s")
+
+
+def measure_first_response(server: str, env: Dict[str, str], timeout: float = 30) -> Dict[str, float]:
+    """
+    Start a server and time its first and second /chat, each for a new session.
+
+    Returns:
+        Milliseconds from the start of the process until it listens
+        ("listening_ms") and until the first /chat is answered
+        ("first_response_ms"), and the latency of the first and second
+        /chat ("first_chat_ms", "second_chat_ms")
+    """
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        SERVER_COMMANDS[server], cwd=ROOT, env=dict(os.environ, **env, PORT=str(port)),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        _wait_for_port(port, process, timeout)
+        listening = time.perf_counter()
+        latencies = []
+        for index in range(2):
+            sent = time.perf_counter()
+            response = requests.post(
+                url + "/chat", json={"message": "Hello", "session_id": f"cold-{index}"}, timeout=timeout
+            )
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - sent)
+            if index == 0:
+                answered = time.perf_counter()
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+    return {
+        "listening_ms": round((listening - started) * 1000, 1),
+        "first_response_ms": round((answered - started) * 1000, 1),
+        "first_chat_ms": round(latencies[0] * 1000, 1),
+        "second_chat_ms": round(latencies[1] * 1000, 1)
+    }
+
+
+def _median_runs(results: List[Dict[str, float]]) -> Dict[str, float]:
+    return {field: round(statistics.median(result[field] for result in results), 1) for field in results[0]}
+
+
+def run_coldstart_benchmark(server: str = "launcher", runs: int = 5, workers: int = 2,
+                            llm_latency: float = 0.05, token_rate: float = 5000) -> Dict[str, Any]:
+    """
+    Measure import times and time to first response, before and after.
+
+    Args:
+        server: "flask", "launcher" or "asgi"
+        runs: Server starts per setting (medians are reported)
+        workers: Launcher worker processes
+        llm_latency: Mock LLM seconds before the first token
+        token_rate: Mock LLM completion tokens per second
+
+    Returns:
+        Report with "imports" and "first_response" sections, the latter with
+        "before" and "after" results
+    """
+    openrouter = start_mock_openrouter(latency=llm_latency, token_rate=token_rate, tool_call_rate=0)
+    env = {
+        "OPENROUTER_API_KEY": "benchmark",
+        "OPENROUTER_BASE_URL": f"{openrouter.url}/api/v1/chat/completions"
+    }
+    if server == "launcher":
+        env["WEB_CONCURRENCY"] = str(workers)  # uvicorn reads it too, and refuses workers for an app object
+    try:
+        first_response = {
+            "before": _median_runs([measure_first_response(server, dict(env, **COLD_ENV)) for _ in range(runs)]),
+            "after": _median_runs([measure_first_response(server, env) for _ in range(runs)])
+        }
+    finally:
+        openrouter.shutdown()
+    return {
+        "config": {
+            "server": server, "runs": runs, "workers": workers, "llm_latency": llm_latency, "token_rate": token_rate
+        },
+        "commit": _git_commit(),
+        "imports": {module: measure_import(module, runs) for module in ("core.agent", "api.server", "api.asgi")},
+        "first_response": first_response
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark import time and time to first response")
+    parser.add_argument("--server", choices=sorted(SERVER_COMMANDS), default="launcher")
+    parser.add_argument("--runs", type=int, default=5, help="Server starts per setting")
+    parser.add_argument("--workers", type=int, default=2, help="Launcher worker processes")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Mock LLM seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=5000, help="Mock LLM completion tokens per second")
+    parser.add_argument("--output", help="Write the report to this JSON file")
+    args = parser.parse_args()
+
+    report = run_coldstart_benchmark(args.server, args.runs, args.workers, args.llm_latency, args.token_rate)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Memory and serialization benchmark for conversation histories.
+Builds many long sessions the old way (message dicts, pretty-printed tool
+results) and the compact way (Message objects, compact tool results), then
+reports resident memory per session, the bytes a history holds, and how long
+reading and serializing a history page takes.
+
+Run with:
+    python -m benchmarks.history --sessions 1000 --turns 25 --output history.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+from benchmarks.load import rss_mb
+from core.messages import HistoryView, Message, compact_json, encode_json
+
+REPRESENTATIONS = ("dict", "compact")
+
+
+def _tool_result(turn: int) -> Dict[str, Any]:
+    """A search result shaped like run_web_search's."""
+    return {
+        "success": True,
+        "query": f"question {turn}",
+        "abstract": "A short abstract of the topic. " * 4,
+        "results": [
+            {"title": f"Result {i}", "url": f"https://example.com/{turn}/{i}", "snippet": "Snippet text. " * 3}
+            for i in range(5)
+        ]
+    }
+
+
+def build_history(turns: int, representation: str) -> List[Any]:
+    """
+    Build one session's history as it looks after being resumed from the store.
+
+    Every message goes through a JSON round trip, as messages loaded from the
+    conversation store do, so baseline roles are separate string objects.
+    """
+    encode = (lambda value: json.dumps(value, indent=2)) if representation == "dict" else compact_json
+    history = []
+    for turn in range(turns):
+        tool_call = {"reasoning": "Need to search", "tool": "run_web_search", "parameters": {"query": f"q{turn}"}}
+        for role, content in (
+            ("user", f"Tell me about topic {turn}"),
+            ("assistant", json.dumps(tool_call)),
+            ("user", f"Tool 'run_web_search' executed. Result: {encode(_tool_result(turn))}"),
+            ("assistant", f"Here is what I found about topic {turn}. " * 3)
+        ):
+            message = json.loads(json.dumps({"role": role, "content": content}))
+            history.append(message if representation == "dict" else Message.from_dict(message))
+    return history
+
+
+def _time_ms(func: Callable[[], Any], repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) * 1000 / repeat
+
+
+def measure_memory(representation: str, sessions: int, turns: int) -> Dict[str, float]:
+    """Build ``sessions`` histories in this process and report the memory they hold."""
+    rss_before = rss_mb(os.getpid())
+    histories = [build_history(turns, representation) for _ in range(sessions)]
+    rss_after = rss_mb(os.getpid())
+    content_bytes = sum(len(message["content"]) for message in histories[0])
+    return {
+        "rss_kb_per_session": round((rss_after - rss_before) * 1024 / sessions, 1),
+        "content_bytes_per_session": content_bytes
+    }
+
+
+def measure_serialization(representation: str, turns: int, repeat: int = 200) -> Dict[str, float]:
+    """Time reading a session's history and serializing it as a /history page."""
+    history = build_history(turns, representation)
+    if representation == "dict":
+        read = history.copy
+        serialize = lambda: json.dumps({"session_id": "s", "messages": history.copy()}).encode("utf-8")
+    else:
+        read = lambda: HistoryView(history)
+        serialize = lambda: encode_json({"session_id": "s", "messages": history})
+    return {
+        "read_history_us": round(_time_ms(read, repeat * 10) * 1000, 2),
+        "serialize_ms": round(_time_ms(serialize, repeat), 3),
+        "serialized_bytes": len(serialize())
+    }
+
+
+def run_history_benchmark(sessions: int = 1000, turns: int = 25) -> Dict[str, Any]:
+    """
+    Measure both representations, each in a fresh interpreter for clean RSS numbers.
+
+    Returns:
+        Report with "dict" (before) and "compact" (after) sections
+    """
+    report: Dict[str, Any] = {"sessions": sessions, "turns": turns, "messages_per_session": turns * 4}
+    for representation in REPRESENTATIONS:
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.history", "--child", representation,
+             "--sessions", str(sessions), "--turns", str(turns)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        report[representation] = dict(json.loads(output), **measure_serialization(representation, turns))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark history memory and serialization")
+    parser.add_argument("--sessions", type=int, default=1000, help="Sessions held in memory")
+    parser.add_argument("--turns", type=int, default=25, help="Tool-using turns per session (4 messages each)")
+    parser.add_argument("--output", help="Write the report to this JSON file")
+    parser.add_argument("--child", choices=REPRESENTATIONS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure_memory(args.child, args.sessions, args.turns)))
+        return
+
+    report = run_history_benchmark(args.sessions, args.turns)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
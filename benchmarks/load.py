@@ -0,0 +1,340 @@
+"""
+Fixed-rate load generator for the AI Agent API.
+Starts the mock upstreams, launches the API server against them and drives
+/chat at a constant request rate across many sessions, then reports
+throughput, latency percentiles, memory growth and errors as JSON.
+
+Run with:
+    python -m benchmarks.load --rps 20 --duration 30 --output results.json
+    python -m benchmarks.load --rps 20 --duration 30 --compare results.json
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import requests
+
+from benchmarks.mocks import start_mock_openrouter, start_mock_search
+
+ROOT = Path(__file__).parent.parent
+
+# How each server kind is started; every one reads PORT
+SERVER_COMMANDS = {
+    "flask": [sys.executable, "api/server.py"],
+    "launcher": [sys.executable, "-m", "api.launcher"],
+    "asgi": [sys.executable, "api/asgi.py"]
+}
+
+# Report fields compared by --compare, and whether a higher value is better
+COMPARED_FIELDS = {
+    "throughput_rps": True,
+    "latency_p50_ms": False,
+    "latency_p95_ms": False,
+    "latency_p99_ms": False,
+    "error_rate": False,
+    "rss_growth_mb": False
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def _process_rss_kb(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        pass
+    return 0
+
+
+def _children(pid: int) -> List[int]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except (FileNotFoundError, PermissionError):
+        return []
+
+
+def rss_mb(pid: int) -> float:
+    """Resident memory of a process and its children in MB (0 where /proc is unavailable)."""
+    total = _process_rss_kb(pid) + sum(_process_rss_kb(child) for child in _children(pid))
+    return round(total / 1024, 1)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class ServerProcess:
+    """The API server under test, running as a subprocess against the mocks."""
+
+    def __init__(self, kind: str, env: Dict[str, str], startup_timeout: float = 30):
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.process = subprocess.Popen(
+            SERVER_COMMANDS[kind], cwd=ROOT, env=dict(os.environ, **env, PORT=str(self.port)),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        deadline = time.monotonic() + startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{kind} server exited with status {self.process.returncode}")
+            try:
+                requests.get(self.url + "/", timeout=1)
+                return
+            except requests.RequestException:
+                time.sleep(0.1)
+        self.stop()
+        raise RuntimeError(f"{kind} server did not start within {startup_timeout}s")
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+class LoadGenerator:
+    """
+    Open-loop load generator.
+
+    Requests are scheduled at a fixed rate whether or not earlier ones have
+    finished, and each latency is measured from its scheduled start, so a
+    server that falls behind shows up as growing latency instead of a
+    silently lower request rate.
+    """
+
+    def __init__(self, url: str, rps: float, duration: float, sessions: int = 100,
+                 timeout: float = 60, max_workers: int = 256):
+        """
+        Initialize the generator.
+
+        Args:
+            url: Base URL of the API server
+            rps: Requests started per second
+            duration: Seconds to generate load for
+            sessions: Distinct session IDs to spread requests across
+            timeout: Seconds before a request counts as an error
+            max_workers: Requests allowed in flight at once
+        """
+        self.url = url
+        self.rps = rps
+        self.duration = duration
+        self.sessions = sessions
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.latencies: List[float] = []
+        self.errors: Dict[str, int] = {}
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _send(self, index: int, scheduled: float):
+        payload = {"message": f"Benchmark question {index}", "session_id": f"session-{index % self.sessions}"}
+        error = None
+        try:
+            response = self._session().post(self.url + "/chat", json=payload, timeout=self.timeout)
+            if response.status_code != 200:
+                error = f"http_{response.status_code}"
+        except requests.Timeout:
+            error = "timeout"
+        except requests.RequestException as e:
+            error = type(e).__name__
+        latency = time.perf_counter() - scheduled
+        with self._lock:
+            if error is None:
+                self.latencies.append(latency)
+            else:
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+    def run(self) -> float:
+        """Generate the load. Returns the elapsed seconds until the last response."""
+        interval = 1 / self.rps
+        total = max(1, int(self.rps * self.duration))
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for index in range(total):
+                scheduled = started + index * interval
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self._send, index, scheduled)
+        return time.perf_counter() - started
+
+
+def run_benchmark(
+    server: str = "flask",
+    rps: float = 10,
+    duration: float = 10,
+    sessions: int = 100,
+    llm_latency: float = 0.2,
+    token_rate: float = 200,
+    reply_tokens: int = 60,
+    tool_call_rate: float = 0.3,
+    search_latency: float = 0.05,
+    server_env: Optional[Dict[str, str]] = None
+) -> Dict[str, Any]:
+    """
+    Run one benchmark against a freshly started server.
+
+    Args:
+        server: "flask", "launcher" or "asgi"
+        rps: Requests started per second
+        duration: Seconds to generate load for
+        sessions: Distinct session IDs to spread requests across
+        llm_latency: Mock LLM seconds before the first token
+        token_rate: Mock LLM completion tokens per second
+        reply_tokens: Tokens in a mock text reply
+        tool_call_rate: Probability that a mock reply is a web search tool call
+        search_latency: Mock search seconds per query
+        server_env: Extra environment variables for the server
+
+    Returns:
+        The report
+    """
+    openrouter = start_mock_openrouter(
+        latency=llm_latency, token_rate=token_rate, reply_tokens=reply_tokens, tool_call_rate=tool_call_rate
+    )
+    search = start_mock_search(latency=search_latency)
+    env = {
+        "OPENROUTER_API_KEY": "benchmark",
+        "OPENROUTER_BASE_URL": f"{openrouter.url}/api/v1/chat/completions",
+        "SEARCH_URL": f"{search.url}/",
+        **(server_env or {})
+    }
+    process = ServerProcess(server, env)
+    try:
+        rss_start = rss_mb(process.process.pid)
+        rss_peak = rss_start
+        generator = LoadGenerator(process.url, rps, duration, sessions)
+        done = threading.Event()
+
+        def sample_rss():
+            nonlocal rss_peak
+            while not done.wait(0.5):
+                rss_peak = max(rss_peak, rss_mb(process.process.pid))
+
+        sampler = threading.Thread(target=sample_rss, daemon=True)
+        sampler.start()
+        elapsed = generator.run()
+        done.set()
+        sampler.join()
+        rss_end = rss_mb(process.process.pid)
+    finally:
+        process.stop()
+        openrouter.shutdown()
+        search.shutdown()
+
+    latencies = sorted(generator.latencies)
+    errors = sum(generator.errors.values())
+    requests_sent = len(latencies) + errors
+
+    def ms(value: Optional[float]) -> Optional[float]:
+        return round(value * 1000, 1) if value is not None else None
+
+    return {
+        "config": {
+            "server": server, "rps": rps, "duration": duration, "sessions": sessions,
+            "llm_latency": llm_latency, "token_rate": token_rate, "reply_tokens": reply_tokens,
+            "tool_call_rate": tool_call_rate, "search_latency": search_latency
+        },
+        "commit": _git_commit(),
+        "timestamp": time.time(),
+        "requests": requests_sent,
+        "ok": len(latencies),
+        "errors": errors,
+        "error_rate": round(errors / requests_sent, 4) if requests_sent else 0,
+        "error_kinds": generator.errors,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0,
+        "latency_p50_ms": ms(_percentile(latencies, 0.5)),
+        "latency_p95_ms": ms(_percentile(latencies, 0.95)),
+        "latency_p99_ms": ms(_percentile(latencies, 0.99)),
+        "latency_max_ms": ms(latencies[-1] if latencies else None),
+        "latency_mean_ms": ms(sum(latencies) / len(latencies) if latencies else None),
+        "rss_start_mb": rss_start,
+        "rss_end_mb": rss_end,
+        "rss_peak_mb": rss_peak,
+        "rss_growth_mb": round(rss_end - rss_start, 1)
+    }
+
+
+def compare_reports(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    """Describe how each compared field changed from a baseline report."""
+    lines = [f"Compared with {baseline.get('commit') or 'baseline'}:"]
+    for field, higher_is_better in COMPARED_FIELDS.items():
+        before, after = baseline.get(field), current.get(field)
+        if before is None or after is None:
+            continue
+        change = f" ({(after - before) / before:+.1%})" if before else ""
+        better = after > before if higher_is_better else after < before
+        verdict = "better" if better else "worse" if after != before else "same"
+        lines.append(f"  {field}: {before} -> {after}{change} {verdict}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API against mock upstreams")
+    parser.add_argument("--server", choices=sorted(SERVER_COMMANDS), default="flask")
+    parser.add_argument("--rps", type=float, default=10, help="Requests started per second")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to generate load for")
+    parser.add_argument("--sessions", type=int, default=100, help="Distinct session IDs")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Mock LLM seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=200, help="Mock LLM completion tokens per second")
+    parser.add_argument("--reply-tokens", type=int, default=60, help="Tokens in a mock text reply")
+    parser.add_argument("--tool-call-rate", type=float, default=0.3, help="Probability of a mock tool call")
+    parser.add_argument("--search-latency", type=float, default=0.05, help="Mock search seconds per query")
+    parser.add_argument("--output", help="Write the report to this JSON file")
+    parser.add_argument("--compare", help="Baseline report to compare against")
+    args = parser.parse_args()
+
+    report = run_benchmark(
+        server=args.server, rps=args.rps, duration=args.duration, sessions=args.sessions,
+        llm_latency=args.llm_latency, token_rate=args.token_rate, reply_tokens=args.reply_tokens,
+        tool_call_rate=args.tool_call_rate, search_latency=args.search_latency
+    )
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            print("\n".join(compare_reports(json.load(f), report)))
+
+
+if __name__ == '__main__':
+    main()
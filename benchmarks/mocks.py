@@ -0,0 +1,216 @@
+"""
+Mock upstream services for benchmarks.
+An OpenRouter-compatible chat completions endpoint with configurable latency,
+token rate and tool-call frequency, and a DuckDuckGo Instant Answer stand-in.
+
+Run standalone with:
+    python -m benchmarks.mocks --openrouter-port 8001 --search-port 8002
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+from urllib.parse import parse_qs, urlparse
+
+# Characters per token used to size replies and usage counts
+CHARS_PER_TOKEN = 4
+
+
+class MockServer(ThreadingHTTPServer):
+    """Threaded HTTP server that carries the mock's settings for its handler."""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address: Tuple[str, int], handler, **settings):
+        super().__init__(address, handler)
+        self.settings = settings
+        self.random = random.Random(settings.get("seed", 0))
+        self.random_lock = threading.Lock()
+        self.requests = 0
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def chance(self, probability: float) -> bool:
+        with self.random_lock:
+            self.requests += 1
+            return self.random.random() < probability
+
+
+class MockOpenRouterHandler(BaseHTTPRequestHandler):
+    """
+    Answers chat completions like OpenRouter.
+
+    With probability ``tool_call_rate`` a reply to a user message is a
+    run_web_search tool call; replies to tool results are always text. Each
+    reply waits ``latency`` seconds, then produces ``reply_tokens`` tokens at
+    ``token_rate`` tokens per second (streamed as SSE when requested).
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length))
+        settings = self.server.settings
+        messages = payload.get("messages", [])
+        content = self._reply(messages)
+        usage = {
+            "prompt_tokens": sum(len(str(m.get("content", ""))) for m in messages) // CHARS_PER_TOKEN,
+            "completion_tokens": max(1, len(content) // CHARS_PER_TOKEN)
+        }
+
+        time.sleep(settings["latency"])
+        if payload.get("stream"):
+            self._stream(content, usage)
+            return
+        time.sleep(usage["completion_tokens"] / settings["token_rate"])
+        self._send_json({
+            "id": "mock",
+            "model": payload.get("model"),
+            "choices": [{"message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage
+        })
+
+    def _reply(self, messages: List[Dict[str, Any]]) -> str:
+        last = str(messages[-1].get("content", "")) if messages else ""
+        if not last.startswith("Tool '") and self.server.chance(self.server.settings["tool_call_rate"]):
+            return json.dumps({
+                "reasoning": "The user needs current information, so I will search the web.",
+                "tool": "run_web_search",
+                "parameters": {"query": last[:80] or "benchmark", "num_results": 3}
+            })
+        words = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit"]
+        target = self.server.settings["reply_tokens"] * CHARS_PER_TOKEN
+        text = []
+        while sum(len(word) + 1 for word in text) < target:
+            text.append(words[len(text) % len(words)])
+        return " ".join(text)
+
+    def _stream(self, content: str, usage: Dict[str, int]):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        delay = 1 / self.server.settings["token_rate"]
+        for i in range(0, len(content), CHARS_PER_TOKEN):
+            chunk = {"choices": [{"delta": {"content": content[i:i + CHARS_PER_TOKEN]}}]}
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+            time.sleep(delay)
+        self._write_chunk(f"data: {json.dumps({'choices': [{'delta': {}}], 'usage': usage})}\n\n")
+        self._write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, text: str):
+        data = text.encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+    def _send_json(self, body: Dict[str, Any]):
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockSearchHandler(BaseHTTPRequestHandler):
+    """Answers DuckDuckGo Instant Answer queries after ``latency`` seconds."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query).get("q", [""])[0]
+        time.sleep(self.server.settings["latency"])
+        data = json.dumps({
+            "Heading": query,
+            "Abstract": f"Mock abstract about {query}.",
+            "AbstractURL": "https://example.com/abstract",
+            "RelatedTopics": [
+                {"Text": f"Topic {i} - Mock result {i} about {query}", "FirstURL": f"https://example.com/{i}"}
+                for i in range(5)
+            ]
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_openrouter(
+    port: int = 0,
+    latency: float = 0.2,
+    token_rate: float = 200,
+    reply_tokens: int = 60,
+    tool_call_rate: float = 0.3,
+    seed: int = 0
+) -> MockServer:
+    """
+    Start the mock OpenRouter server in a background thread.
+
+    Args:
+        port: Port to listen on (0 picks a free one)
+        latency: Seconds before the first token
+        token_rate: Completion tokens generated per second
+        reply_tokens: Approximate tokens in a text reply
+        tool_call_rate: Probability that a reply to a user message is a tool call
+        seed: Seed for the tool-call decisions
+
+    Returns:
+        The running server; its ``url`` plus "/api/v1/chat/completions" is the endpoint
+    """
+    server = MockServer(
+        ("127.0.0.1", port), MockOpenRouterHandler,
+        latency=latency, token_rate=token_rate, reply_tokens=reply_tokens,
+        tool_call_rate=tool_call_rate, seed=seed
+    )
+    threading.Thread(target=server.serve_forever, name="mock-openrouter", daemon=True).start()
+    return server
+
+
+def start_mock_search(port: int = 0, latency: float = 0.05) -> MockServer:
+    """Start the mock DuckDuckGo server in a background thread."""
+    server = MockServer(("127.0.0.1", port), MockSearchHandler, latency=latency)
+    threading.Thread(target=server.serve_forever, name="mock-search", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the mock OpenRouter and DuckDuckGo servers")
+    parser.add_argument("--openrouter-port", type=int, default=8001)
+    parser.add_argument("--search-port", type=int, default=8002)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=200, help="Completion tokens per second")
+    parser.add_argument("--reply-tokens", type=int, default=60, help="Tokens in a text reply")
+    parser.add_argument("--tool-call-rate", type=float, default=0.3, help="Probability of a tool call")
+    parser.add_argument("--search-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    openrouter = start_mock_openrouter(
+        args.openrouter_port, args.latency, args.token_rate, args.reply_tokens, args.tool_call_rate
+    )
+    search = start_mock_search(args.search_port, args.search_latency)
+    print(f"OPENROUTER_BASE_URL={openrouter.url}/api/v1/chat/completions")
+    print(f"SEARCH_URL={search.url}/")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
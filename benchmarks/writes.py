@@ -0,0 +1,106 @@
+"""
+Throughput benchmark for write_to_file.
+Appends many small lines to a handful of files, and rewrites small files
+whole, once through the direct write path and once through the write
+engine, and reports operations per second for each.
+
+Run with:
+    python -m benchmarks.writes --files 10 --appends 20000 --output writes.json
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import Any, Callable, Dict
+
+from core.tools import write_to_file
+from core.write_engine import WriteEngine, get_write_engine
+
+LINE = "2024-01-01T00:00:00Z step finished, 42 items processed\n"
+
+
+def _direct(filepath: str, content: str, mode: str) -> Dict[str, Any]:
+    return write_to_file(filepath, content, mode)
+
+
+def _timed(operations: int, run: Callable[[], None]) -> Dict[str, float]:
+    started = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - started
+    return {"seconds": round(seconds, 3), "ops_per_s": round(operations / seconds)}
+
+
+def measure_appends(write: Callable[[str, str, str], Dict[str, Any]], directory: str,
+                    files: int, appends: int, finish: Callable[[], None] = lambda: None) -> Dict[str, float]:
+    """Append ``appends`` lines spread over ``files`` files in nested directories, then check the files."""
+    paths = [os.path.join(directory, "logs", f"run{i}", "events.log") for i in range(files)]
+
+    def run():
+        for i in range(appends):
+            write(paths[i % files], LINE, "a")
+        finish()
+
+    report = _timed(appends, run)
+    written = sum(os.path.getsize(path) for path in paths)
+    assert written == appends * len(LINE.encode()), f"Expected {appends * len(LINE)} bytes, found {written}"
+    return report
+
+
+def measure_full_writes(write: Callable[[str, str, str], Dict[str, Any]], directory: str,
+                        files: int, writes: int) -> Dict[str, float]:
+    """Rewrite ``files`` small files whole, ``writes`` times in total."""
+    paths = [os.path.join(directory, "state", f"file{i}.json") for i in range(files)]
+    content = json.dumps({"step": 1, "items": list(range(50))})
+    return _timed(writes, lambda: [write(paths[i % files], content, "w") for i in range(writes)])
+
+
+def run_write_benchmark(files: int = 10, appends: int = 20000, writes: int = 2000,
+                        flush_interval: float = 1.0) -> Dict[str, Any]:
+    """
+    Measure the direct write path against the write engine.
+
+    Returns:
+        Report with "appends" and "full_writes" sections, each with "direct"
+        (before) and "engine" (after) results and the speedup
+    """
+    if get_write_engine() is not None:
+        raise RuntimeError("Unset WRITE_ENGINE_ENABLED so the direct path can be measured")
+    engine = WriteEngine(flush_interval=flush_interval)
+    report: Dict[str, Any] = {"files": files, "appends": {}, "full_writes": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        report["appends"]["direct"] = measure_appends(_direct, os.path.join(directory, "direct"), files, appends)
+        report["appends"]["engine"] = measure_appends(
+            engine.write, os.path.join(directory, "engine"), files, appends, engine.flush
+        )
+        report["full_writes"]["direct"] = measure_full_writes(_direct, os.path.join(directory, "direct"), files, writes)
+        report["full_writes"]["engine"] = measure_full_writes(
+            engine.write, os.path.join(directory, "engine"), files, writes
+        )
+    engine.close()
+    for section in ("appends", "full_writes"):
+        results = report[section]
+        results["speedup"] = round(results["engine"]["ops_per_s"] / results["direct"]["ops_per_s"], 2)
+    report["engine_stats"] = engine.get_stats()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark write_to_file with and without the write engine")
+    parser.add_argument("--files", type=int, default=10, help="Files the writes are spread over")
+    parser.add_argument("--appends", type=int, default=20000, help="Small appends to make")
+    parser.add_argument("--writes", type=int, default=2000, help="Whole-file writes to make")
+    parser.add_argument("--flush-interval", type=float, default=1.0, help="Write engine flush interval (seconds)")
+    parser.add_argument("--output", help="Write the report to this JSON file")
+    args = parser.parse_args()
+
+    report = run_write_benchmark(args.files, args.appends, args.writes, args.flush_interval)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
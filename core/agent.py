@@ -4,180 +4,950 @@ Integrates with OpenRouter API for language model access.
 """
 
 import os
+import inspect
 import json
-from typing import Dict, List, Any, Optional
-import requests
-from core.tools import TOOLS, get_tool_description
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Any, Optional, Sequence, Tuple
+from core.batch import BatchItem, BatchOptions, run_batch
+from core.completion_cache import CompletionCache, get_completion_cache
+from core.context import SUMMARY_PROMPT, ContextManager, count_message_tokens, count_tokens, format_transcript
+from core.function_calling import (
+    ToolCallAccumulator,
+    extract_tool_calls,
+    get_tool_schemas,
+    parse_native_tool_calls,
+    validate_parameters
+)
+from core.http import PooledHTTPClient, get_http_client, get_routed_http_client
+from core.jobs import JobManager, get_job_manager
+from core.messages import HistoryView, Message, compact_json, encode_json
+from core.metrics import AGENT_ERRORS, LLM_SECONDS, PHASE_SECONDS, TOOL_SECONDS, record_usage, span
+from core.ratelimit import FairLock
+from core.router import ModelEndpoint, ModelRouter, get_model_router
+from core.shell_pool import get_shell_pool
+from core.speculation import Speculation, predict_tool_calls
+from core.storage import ConversationStore
+from core.streaming import StreamingReplyParser, parse_sse_delta
+from core.tools import TOOLS, TOOL_DESCRIPTIONS, LazyTool, ensure_plugins, tool_session
+
+
+SYSTEM_PROMPT_TEMPLATE = """You are an AI agent with reasoning capabilities and access to tools.
+
+Available Tools:
+{tools_text}
+
+When you need to use a tool, respond with a JSON object in this format:
+{{
+    "reasoning": "Your reasoning about why you need to use this tool",
+    "tool": "tool_name",
+    "parameters": {{
+        "param1": "value1",
+        "param2": "value2"
+    }}
+}}
+
+To use several independent tools at once, respond with a JSON array of such objects.
+They run in parallel and you receive every result before deciding on next steps.
+
+When you want to respond normally, just provide your response as text.
+
+You can chain multiple tool uses by first analyzing the results and then deciding on next steps.
+Always explain your reasoning before using a tool."""
+
+# (registry version, prompt, system message with a cache breakpoint)
+_system_prompt_cache: Tuple[int, str, Dict[str, Any]] = (0, "", {})
+
+
+def _compile_system_prompt() -> Tuple[int, str, Dict[str, Any]]:
+    """Render the system prompt for the current tool registry."""
+    global _system_prompt_cache
+    ensure_plugins()
+    version = TOOLS.version
+    tools_text = "\n".join([
+        f"- {tool['name']}: {tool['description']} (Parameters: {tool['parameters']})"
+        for tool in TOOL_DESCRIPTIONS.values()
+    ])
+    prompt = SYSTEM_PROMPT_TEMPLATE.format(tools_text=tools_text)
+    cached_message = {
+        "role": "system",
+        "content": [{"type": "text", "text": prompt, "cache_control": {"type": "ephemeral"}}]
+    }
+    _system_prompt_cache = (version, prompt, cached_message)
+    return _system_prompt_cache
+
+
+_tool_executor: Optional[ThreadPoolExecutor] = None
+_tool_executor_lock = threading.Lock()
+
+
+def get_tool_executor() -> ThreadPoolExecutor:
+    """
+    Get the shared thread pool that runs independent tool calls concurrently.
+    
+    Its size comes from the TOOL_MAX_WORKERS environment variable (default 8).
+    """
+    global _tool_executor
+    if _tool_executor is None:
+        with _tool_executor_lock:
+            if _tool_executor is None:
+                _tool_executor = ThreadPoolExecutor(
+                    max_workers=int(os.getenv("TOOL_MAX_WORKERS", 8)),
+                    thread_name_prefix="agent-tool"
+                )
+    return _tool_executor
+
+
+def get_system_prompt() -> str:
+    """
+    Get the system prompt, compiled once per tool registry version.
+    
+    Every agent in the process shares the same string, so all sessions send
+    an identical prompt prefix.
+    """
+    cache = _system_prompt_cache
+    if cache[0] != TOOLS.version:
+        cache = _compile_system_prompt()
+    return cache[1]
+
+
+def get_cached_system_message() -> Dict[str, Any]:
+    """Get the shared system message marked as a prompt-cache breakpoint."""
+    cache = _system_prompt_cache
+    if cache[0] != TOOLS.version:
+        cache = _compile_system_prompt()
+    return cache[2]
 
 
 class AIAgent:
     """AI Agent with reasoning and tool-using capabilities."""
     
-    def __init__(self, api_key: Optional[str] = None, model: str = "openai/gpt-3.5-turbo"):
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        model: str = "openai/gpt-3.5-turbo",
+        http_client: Optional[PooledHTTPClient] = None,
+        cache_system_prompt: bool = False,
+        context_manager: Optional[ContextManager] = None,
+        max_steps: Optional[int] = None,
+        session_id: Optional[str] = None,
+        conversation_store: Optional[ConversationStore] = None,
+        history_window: Optional[int] = None,
+        router: Optional[ModelRouter] = None,
+        completion_cache: Optional[CompletionCache] = None,
+        temperature: Optional[float] = None,
+        tool_calling: Optional[str] = None,
+        job_manager: Optional[JobManager] = None,
+        speculate: Optional[bool] = None,
+        prefetch: Optional[Callable[[str], List[Dict[str, Any]]]] = None
+    ):
         """
         Initialize the AI Agent.
         
         Args:
             api_key: OpenRouter API key (defaults to OPENROUTER_API_KEY env var)
             model: Model identifier to use for reasoning
+            http_client: Pooled HTTP client (defaults to the process-wide shared client,
+                or with a router to the shared one that leaves 429/5xx to the router)
+            cache_system_prompt: Mark the shared system prompt as a cache breakpoint
+                for providers that support prompt-prefix caching
+            context_manager: Keeps each request's history within a token budget
+                (defaults to one configured from CONTEXT_* environment variables)
+            max_steps: Maximum tool steps per message (defaults to the AGENT_MAX_STEPS
+                environment variable, or 5)
+            session_id: Session the agent serves; keys its persistent shell worker
+                (defaults to a random ID)
+            conversation_store: Durable store the session's transcript is appended to
+                and resumed from (defaults to keeping history in memory only)
+            history_window: Latest messages loaded when resuming from the store
+                (defaults to the CONVERSATION_HISTORY_WINDOW environment variable, or 100)
+            router: Spreads calls over a pool of models with hedging and fallback
+                (defaults to the pool configured by MODEL_POOL, if any; without one
+                every call goes to ``model``)
+            completion_cache: Answers repeated requests without a round trip
+                (defaults to the cache enabled by COMPLETION_CACHE_ENABLED, if any)
+            temperature: Sampling temperature sent with each request (defaults to
+                the AGENT_TEMPERATURE environment variable, or the provider's default);
+                responses are only cached at a temperature of 0
+            tool_calling: "text" to have the model write tool calls as JSON in its
+                reply, or "native" to also offer the tools as function schemas and
+                read the reply's ``tool_calls`` (defaults to the TOOL_CALLING
+                environment variable, or "text")
+            job_manager: Runs tool calls asking for a long timeout in the background
+                and resumes the conversation when they finish (defaults to the
+                manager enabled by JOBS_ENABLED, if any)
+            speculate: Start read-only tool calls (such as web searches) as soon as
+                a streamed reply has written them, before the reply ends (defaults
+                to the SPECULATION_ENABLED environment variable, or true)
+            prefetch: Guesses read-only tool calls from a user message, started
+                while the first completion is in flight and discarded if the
+                model asks for something else (defaults to predict_tool_calls when
+                SPECULATIVE_PREFETCH is true, otherwise no prefetching)
         """
         self.api_key = api_key or os.getenv("OPENROUTER_API_KEY")
         if not self.api_key:
             raise ValueError("OPENROUTER_API_KEY must be provided or set in environment")
         
         self.model = model
-        self.base_url = "https://openrouter.ai/api/v1/chat/completions"
-        self.conversation_history: List[Dict[str, str]] = []
+        self.base_url = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1/chat/completions")
+        self.conversation_history: List[Message] = []
         self.tools = TOOLS
+        self._http_client = http_client
+        self.cache_system_prompt = cache_system_prompt
+        self.context_manager = context_manager or ContextManager.from_env(model)
+        self.max_steps = max_steps if max_steps is not None else int(os.getenv("AGENT_MAX_STEPS", 5))
+        self.session_id = session_id or uuid.uuid4().hex
+        self.conversation_store = conversation_store
+        self.history_window = (
+            history_window if history_window is not None
+            else int(os.getenv("CONVERSATION_HISTORY_WINDOW", 100))
+        )
+        self._store_version: Any = None
+        self.router = router if router is not None else get_model_router()
+        self.served_model = model
+        self.completion_cache = completion_cache if completion_cache is not None else get_completion_cache()
+        if temperature is None and os.getenv("AGENT_TEMPERATURE"):
+            temperature = float(os.getenv("AGENT_TEMPERATURE"))
+        self.temperature = temperature
+        self.tool_calling = tool_calling or os.getenv("TOOL_CALLING", "text").lower()
+        if self.tool_calling not in ("text", "native"):
+            raise ValueError(f"Unknown tool calling mode '{self.tool_calling}', expected 'text' or 'native'")
+        self.job_manager = job_manager if job_manager is not None else get_job_manager()
+        self.speculate = (
+            speculate if speculate is not None
+            else os.getenv("SPECULATION_ENABLED", "true").lower() == "true"
+        )
+        if prefetch is None and os.getenv("SPECULATIVE_PREFETCH", "false").lower() == "true":
+            prefetch = predict_tool_calls
+        self.prefetch = prefetch
+        # Serializes turns in arrival order: concurrent requests for the session
+        # and resumed background jobs queue instead of interleaving
+        self._turn_lock = FairLock()
+        # Upstream tokens (prompt plus completion) this agent's calls have used
+        self.tokens_used = 0
+        self._usage_lock = threading.Lock()
         
-    def _make_api_call(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+    @property
+    def http_client(self) -> PooledHTTPClient:
+        """The agent's HTTP client; the shared one is only created once a call needs it."""
+        if self._http_client is None:
+            self._http_client = get_http_client() if self.router is None else get_routed_http_client()
+        return self._http_client
+    
+    def _build_headers(self) -> Dict[str, str]:
+        """Build the HTTP headers for an OpenRouter request."""
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "HTTP-Referer": "https://github.com/wasalstor-web",
+            "X-Title": "AI Agent with Reasoning"
+        }
+    
+    def _build_payload(self, messages: List[Dict[str, str]], stream: bool = False,
+                       model: Optional[str] = None, tools: bool = False) -> Dict[str, Any]:
+        """Build the JSON payload for an OpenRouter request."""
+        payload = {
+            "model": model or self.model,
+            "messages": messages
+        }
+        if tools and self.tool_calling == "native":
+            payload["tools"] = get_tool_schemas()
+        if self.temperature is not None:
+            payload["temperature"] = self.temperature
+        if stream:
+            payload["stream"] = True
+        return payload
+    
+    def _route(self, send, **options) -> Any:
+        """
+        Run ``send(endpoint)`` against the agent's model, or through the router
+        when there is one, and remember which model answered.
+        """
+        if self.router is None:
+            endpoint = ModelEndpoint(self.model, self.base_url)
+            result = send(endpoint)
+        else:
+            result, endpoint = self.router.call(send, **options)
+        self.served_model = endpoint.model
+        return result
+    
+    def _lookup_completion(self, messages: List[Dict[str, Any]],
+                           tools: bool = False) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        Look a request up in the completion cache.
+        
+        Requests offering native tools are keyed apart from ones that don't.
+        
+        Returns:
+            Tuple of (cached response or None, key to store the response under,
+            or None when the request must not be cached)
+        """
+        cache = self.completion_cache
+        if cache is None:
+            return None, None
+        if not cache.cacheable(messages, self.temperature):
+            cache.record_skip(self.session_id)
+            return None, None
+        model = self._cache_model(tools)
+        key = cache.key_for(model, messages)
+        entry = cache.lookup(model, messages, self.session_id, key)
+        if entry is None:
+            return None, key
+        self.served_model = entry.model
+        return entry.data, key
+    
+    def _store_completion(self, messages: List[Dict[str, Any]], data: Dict[str, Any],
+                          key: Optional[str], started: float, tools: bool = False):
+        """Cache a fresh response under the key from _lookup_completion."""
+        if key is not None:
+            self.completion_cache.store(
+                self._cache_model(tools), messages, data, self.served_model, time.perf_counter() - started, key
+            )
+    
+    def _cache_model(self, tools: bool) -> str:
+        """Model name a request is cached under; requests offering function schemas get their own."""
+        return f"{self.model}#tools" if tools and self.tool_calling == "native" else self.model
+    
+    def _make_api_call(self, messages: List[Dict[str, str]], tools: bool = False) -> Dict[str, Any]:
         """
         Make an API call to OpenRouter.
         
         Args:
             messages: List of message dictionaries
+            tools: Offer the tools as function schemas (native tool calling only)
             
         Returns:
             API response data
         """
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "https://github.com/wasalstor-web",
-            "X-Title": "AI Agent with Reasoning"
-        }
+        def send(endpoint: ModelEndpoint) -> Dict[str, Any]:
+            response = self.http_client.post(
+                endpoint.base_url,
+                headers=self._build_headers(),
+                data=encode_json(self._build_payload(messages, model=endpoint.model, tools=tools))
+            )
+            response.raise_for_status()
+            data = response.json()
+            record_usage(endpoint.model, data.get("usage"))
+            self._count_tokens(data.get("usage"))
+            return data
         
-        payload = {
-            "model": self.model,
-            "messages": messages
-        }
+        cached, key = self._lookup_completion(messages, tools)
+        if cached is not None:
+            return cached
+        started = time.perf_counter()
+        data = self._route(send)
+        self._store_completion(messages, data, key, started, tools)
+        return data
+    
+    def _stream_api_call(self, messages: List[Dict[str, str]],
+                         tool_calls: Optional[ToolCallAccumulator] = None) -> Iterator[str]:
+        """
+        Make a streaming API call to OpenRouter.
+        
+        Streams are never hedged, but fall back to the next model in the
+        router's pool if the request fails before the first byte.
         
-        response = requests.post(self.base_url, headers=headers, json=payload)
-        response.raise_for_status()
-        return response.json()
+        Args:
+            messages: List of message dictionaries
+            tool_calls: Collects native tool call fragments; passing one offers
+                the tools as function schemas (native tool calling only)
+            
+        Yields:
+            Content deltas as they arrive
+        """
+        def send(endpoint: ModelEndpoint):
+            response = self.http_client.post(
+                endpoint.base_url,
+                headers=self._build_headers(),
+                data=encode_json(self._build_payload(
+                    messages, stream=True, model=endpoint.model, tools=tool_calls is not None
+                )),
+                stream=True
+            )
+            try:
+                response.raise_for_status()
+            except Exception:
+                response.close()
+                raise
+            return response
+        
+        response = self._route(send, hedge=False, record_latency=False)
+        received: List[str] = []
+        try:
+            for line in response.iter_lines(chunk_size=None):
+                done, delta = parse_sse_delta(line.decode("utf-8"))
+                if done:
+                    return
+                if tool_calls is not None and delta.get("tool_calls"):
+                    tool_calls.feed(delta["tool_calls"])
+                    received.extend(call.get("function", {}).get("arguments") or "" for call in delta["tool_calls"])
+                if delta.get("content"):
+                    received.append(delta["content"])
+                    yield delta["content"]
+        finally:
+            response.close()
+            self._count_tokens(self._estimate_usage(messages, received))
+    
+    def _count_tokens(self, usage: Optional[Dict[str, Any]]):
+        """Add an upstream call's prompt and completion tokens to ``tokens_used``."""
+        if not usage:
+            return
+        tokens = usage.get("total_tokens") or (usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0)
+        with self._usage_lock:
+            self.tokens_used += tokens
+    
+    @staticmethod
+    def _estimate_usage(messages: List[Dict[str, Any]], received: List[str]) -> Dict[str, int]:
+        """Estimate a streamed call's usage, which streams don't report."""
+        return {
+            "prompt_tokens": sum(count_message_tokens(message) for message in messages),
+            "completion_tokens": count_tokens("".join(received))
+        }
     
     def _build_system_prompt(self) -> str:
         """Build the system prompt with tool descriptions."""
-        tool_descriptions = get_tool_description()
-        tools_text = "\n".join([
-            f"- {tool['name']}: {tool['description']} (Parameters: {tool['parameters']})"
-            for tool in tool_descriptions.values()
-        ])
+        return get_system_prompt()
+    
+    def _build_messages(self) -> List[Dict[str, Any]]:
+        """Build the message list for the next API call."""
+        self._compact_history()
+        with span(PHASE_SECONDS.labels("build_messages", self.model)):
+            system_prompt = self._build_system_prompt()
+            history = self.context_manager.fit(self.conversation_history, system_prompt)
+            if self.cache_system_prompt:
+                return [get_cached_system_message()] + history
+            return [
+                {"role": "system", "content": system_prompt}
+            ] + history
+    
+    def _summary_request(self, messages: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """Build the API messages asking the model to summarize older turns."""
+        return [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": format_transcript(messages)}
+        ]
+    
+    def _compact_history(self):
+        """Fold old turns into a summary when the summarize strategy needs it."""
+        count = self.context_manager.summary_candidates(
+            self.conversation_history, self._build_system_prompt()
+        )
+        if count:
+            response = self._make_api_call(self._summary_request(self.conversation_history[:count]))
+            summary = response["choices"][0]["message"]["content"]
+            self.context_manager.apply_summary(self.conversation_history, count, summary)
+    
+    def _parse_tool_calls(self, assistant_message: str,
+                          native_calls: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        """
+        Parse tool calls from an assistant reply.
         
-        return f"""You are an AI agent with reasoning capabilities and access to tools.
-
-Available Tools:
-{tools_text}
-
-When you need to use a tool, respond with a JSON object in this format:
-{{
-    "reasoning": "Your reasoning about why you need to use this tool",
-    "tool": "tool_name",
-    "parameters": {{
-        "param1": "value1",
-        "param2": "value2"
-    }}
-}}
-
-When you want to respond normally, just provide your response as text.
-
-You can chain multiple tool uses by first analyzing the results and then deciding on next steps.
-Always explain your reasoning before using a tool."""
+        Native ``tool_calls`` take precedence; otherwise JSON tool calls are
+        picked out of the text, even when wrapped in prose or code fences.
+        
+        Args:
+            assistant_message: Raw assistant reply text
+            native_calls: The reply's ``tool_calls``, if any
+            
+        Returns:
+            The tool calls in order, or an empty list if the reply is normal text
+        """
+        if native_calls:
+            return parse_native_tool_calls(native_calls, assistant_message)
+        if "{" not in assistant_message:
+            return []
+        return extract_tool_calls(assistant_message, self.tools)
+    
+    def _add_assistant_message(self, content: str, tool_calls: List[Dict[str, Any]]):
+        """Record an assistant reply, with its native ``tool_calls`` when it made any."""
+        native = [
+            {"id": call["id"], "type": "function", "function": {
+                "name": call["tool"], "arguments": json.dumps(call["parameters"])
+            }}
+            for call in tool_calls if call.get("id")
+        ]
+        if native:
+            self._add_message("assistant", content, tool_calls=native)
+        else:
+            self._add_message("assistant", content)
+    
+    def _run_tool(self, tool_call: Dict[str, Any], speculation: Optional[Speculation] = None) -> Dict[str, Any]:
+        """
+        Execute a single tool call.
+        
+        Args:
+            tool_call: Parsed tool call with "tool" and "parameters"
+            speculation: The turn's speculative calls; a matching one that
+                already started is waited on instead of calling the tool again
+            
+        Returns:
+            Dict with the tool name, parameters, reasoning, result and duration
+        """
+        started = time.perf_counter()
+        error = self._invalid_tool_call(tool_call)
+        if error is not None:
+            result = {"success": False, "error": error}
+        else:
+            try:
+                if self.job_manager is not None and self.job_manager.should_background(tool_call["parameters"]):
+                    result = self._submit_job(tool_call, self.resume_job)
+                else:
+                    future = speculation.take(tool_call) if speculation is not None else None
+                    if future is not None and not future.cancel():
+                        result = future.result()  # Started early, wait for the rest of it
+                    else:
+                        result = self._call_tool(tool_call["tool"], tool_call["parameters"])
+            except Exception as e:
+                result = {"success": False, "error": str(e)}
+        duration = time.perf_counter() - started
+        TOOL_SECONDS.labels(self._tool_label(tool_call)).observe(duration)
+        return self._tool_call_result(tool_call, result, duration)
+    
+    def _call_tool(self, tool_name: str, parameters: Dict[str, Any],
+                   on_output: Optional[Callable[[str, str], None]] = None) -> Any:
+        """Call a blocking tool for this session, passing ``on_output`` to tools that accept it."""
+        func = self.tools[tool_name]
+        if isinstance(func, LazyTool):
+            func = func.load()
+        if on_output is not None and "on_output" in inspect.signature(func).parameters:
+            parameters = dict(parameters, on_output=on_output)
+        session = tool_session.set(self.session_id)
+        try:
+            return func(**parameters)
+        finally:
+            tool_session.reset(session)
+    
+    def _submit_job(self, tool_call: Dict[str, Any], on_complete: Callable[[Dict[str, Any]], Any]) -> Dict[str, Any]:
+        """Queue a tool call as a background job and describe it to the model."""
+        tool_name, parameters = tool_call["tool"], tool_call["parameters"]
+        job = self.job_manager.submit(
+            self.session_id, tool_name, parameters,
+            lambda on_output: self._call_tool(tool_name, parameters, on_output),
+            on_complete
+        )
+        return {
+            "success": True,
+            "job_id": job["id"],
+            "status": job["status"],
+            "message": f"Running in the background as job {job['id']}; its result will follow when it finishes."
+        }
+    
+    @staticmethod
+    def _job_result(job: Dict[str, Any]) -> Dict[str, Any]:
+        """The tool result sent to the model once a background job finishes."""
+        return {"job_id": job["id"], "status": job["status"], "result": job["result"]}
+    
+    def _invalid_tool_call(self, tool_call: Dict[str, Any], tools: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """Describe why a tool call can't be dispatched to ``tools`` (default: self.tools), or None if it can."""
+        if tool_call["tool"] not in (self.tools if tools is None else tools):
+            return f"Unknown tool '{tool_call['tool']}'"
+        problem = validate_parameters(tool_call["tool"], tool_call["parameters"])
+        if problem is not None:
+            return f"Invalid parameters for '{tool_call['tool']}': {problem}"
+        return None
+    
+    def _tool_label(self, tool_call: Dict[str, Any], tools: Optional[Dict[str, Any]] = None) -> str:
+        """Metric label for a tool call: its name, or "unknown" for names not in ``tools`` (default: self.tools)."""
+        name = tool_call["tool"]
+        return name if isinstance(name, str) and name in (self.tools if tools is None else tools) else "unknown"
+    
+    @staticmethod
+    def _tool_call_result(tool_call: Dict[str, Any], result: Any, duration: float) -> Dict[str, Any]:
+        """Build the record of one executed tool call."""
+        executed = {
+            "tool": tool_call["tool"],
+            "parameters": tool_call["parameters"],
+            "reasoning": tool_call.get("reasoning", ""),
+            "result": result,
+            "duration_ms": duration * 1000
+        }
+        if tool_call.get("id"):
+            executed["id"] = tool_call["id"]
+        return executed
+    
+    def _execute_tool_calls(self, tool_calls: List[Dict[str, Any]],
+                            speculation: Optional[Speculation] = None) -> List[Dict[str, Any]]:
+        """Execute the tool calls of one step concurrently, keeping their order."""
+        if len(tool_calls) == 1:
+            return [self._run_tool(tool_calls[0], speculation)]
+        return list(get_tool_executor().map(lambda tool_call: self._run_tool(tool_call, speculation), tool_calls))
+    
+    def _begin_speculation(self, user_message: Optional[str] = None) -> Optional[Speculation]:
+        """Set up a turn's speculative tool calls, starting any prefetch guessed from ``user_message``."""
+        if not (self.speculate or self.prefetch):
+            return None
+        speculation = Speculation(self._launch_tool)
+        if self.prefetch is not None and user_message:
+            for tool_call in self.prefetch(user_message):
+                self._speculate(speculation, tool_call)
+        return speculation
+    
+    def _launch_tool(self, tool_call: Dict[str, Any]) -> Future:
+        """Start a speculative tool call on the shared tool executor."""
+        return get_tool_executor().submit(self._call_tool, tool_call["tool"], tool_call["parameters"])
+    
+    def _speculate(self, speculation: Speculation, tool_call: Dict[str, Any], tools: Optional[Dict[str, Any]] = None):
+        """Start a tool call early, unless it is invalid or would run as a background job."""
+        if self._invalid_tool_call(tool_call, tools) is not None:
+            return
+        if self.job_manager is not None and self.job_manager.should_background(tool_call["parameters"]):
+            return
+        speculation.start(tool_call)
+    
+    def _on_call_ready(self, speculation: Optional[Speculation],
+                       allow_tools: bool) -> Optional[Callable[[Dict[str, Any]], None]]:
+        """Callback that speculates on tool calls as a streamed reply finishes writing them, if enabled."""
+        if speculation is None or not self.speculate or not allow_tools:
+            return None
+        return lambda tool_call: self._speculate(speculation, tool_call)
+    
+    def _add_message(self, role: str, content: str, **fields: Any):
+        """Append a message, with any extra protocol fields, to the history and the conversation store."""
+        message = Message(role, content, fields)
+        self.conversation_history.append(message)
+        if self.conversation_store is not None:
+            self._store_version = self.conversation_store.append(self.session_id, message)
+    
+    def _end_batch_attempt(self, start: int, store: Optional[ConversationStore], result: Optional[Dict[str, Any]]):
+        """
+        Finish a batch message's attempt, run with the conversation store held back.
+        
+        Args:
+            start: Length of the history before the attempt
+            store: The agent's conversation store, restored here
+            result: The attempt's result (None if it raised)
+        """
+        self.conversation_store = store
+        if result is None or "error" in result:
+            del self.conversation_history[start:]
+        elif store is not None:
+            for message in self.conversation_history[start:]:
+                self._store_version = store.append(self.session_id, message)
+    
+    def _sync_history(self):
+        """
+        Reload the latest history window if the stored transcript changed.
+        
+        Another worker process may have served this session since our last
+        turn; the version check costs a single lookup when nothing changed.
+        """
+        if self.conversation_store is None:
+            return
+        version = self.conversation_store.version(self.session_id)
+        if version != self._store_version:
+            self.conversation_history = self.conversation_store.load(self.session_id, limit=self.history_window)
+            self._store_version = version
+    
+    def _record_tool_result(self, tool_name: str, tool_result: Any, tool_call_id: Optional[str] = None):
+        """Add a tool result to the conversation history, as a ``tool`` message for native calls."""
+        with span(PHASE_SECONDS.labels("serialize_tool_result", self.model)):
+            if tool_call_id:
+                result_message = compact_json(tool_result)
+            else:
+                result_message = f"Tool '{tool_name}' executed. Result: {compact_json(tool_result)}"
+        if tool_call_id:
+            self._add_message("tool", result_message, tool_call_id=tool_call_id)
+        else:
+            self._add_message("user", result_message)
+    
+    def _build_result(self, response: str, executed: List[Dict[str, Any]],
+                      steps: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Build the dict returned for a processed message.
+        
+        ``tool_used``, ``tool_reasoning`` and ``tool_result`` describe the last
+        executed tool; ``tool_calls`` lists every executed call in order.
+        ``model`` is the model that wrote the final reply.
+        """
+        for step in steps:
+            LLM_SECONDS.labels(step["model"], str(step["step"])).observe(step["llm_ms"] / 1000)
+        if not executed:
+            return {
+                "response": response,
+                "model": steps[-1]["model"],
+                "tool_used": None,
+                "tool_result": None,
+                "steps": steps
+            }
+        last = executed[-1]
+        return {
+            "response": response,
+            "model": steps[-1]["model"],
+            "tool_used": last["tool"],
+            "tool_reasoning": last["reasoning"],
+            "tool_result": last["result"],
+            "tool_calls": executed,
+            "steps": steps
+        }
     
     def process_message(self, user_message: str) -> Dict[str, Any]:
         """
         Process a user message and potentially execute tools.
         
+        The agent keeps calling tools until the model replies with text or
+        ``max_steps`` tool steps have run.
+        
         Args:
             user_message: The user's input message
             
         Returns:
-            Dict containing the agent's response and any tool execution results
+            Dict containing the agent's response, any tool execution results
+            and per-step timing
+        """
+        with self._turn_lock:
+            # Add user message to history
+            self._sync_history()
+            self._add_message("user", user_message)
+            return self._run_turn(self._begin_speculation(user_message))
+    
+    def resume_job(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Continue the conversation with a finished background job's result.
+        
+        Args:
+            job: The finished job record
+            
+        Returns:
+            The same dict as process_message, for the model's follow-up reply
+        """
+        with self._turn_lock:
+            self._sync_history()
+            self._record_tool_result(job["tool"], self._job_result(job))
+            return self._run_turn()
+    
+    @classmethod
+    def process_batch(
+        cls,
+        items: Sequence[BatchItem],
+        agent_factory: Optional[Callable[[str], "AIAgent"]] = None,
+        options: Optional[BatchOptions] = None,
+        **agent_options: Any
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Process many messages concurrently, yielding each result as it finishes.
+        
+        Messages for the same session run in order on that session's agent;
+        messages without a session each get a one-off agent. A failed message
+        is rewound from its agent's history before being retried, and never
+        affects the other items. A message's turn is only written to the
+        conversation store once it succeeds.
+        
+        Args:
+            items: (session_id, message) pairs; session_id may be None
+            agent_factory: Returns the agent for a session ID (defaults to a
+                new agent built from ``agent_options``)
+            options: Concurrency, rate and retry settings (defaults to the
+                BATCH_* environment variables)
+            **agent_options: Options for the agents this batch creates
+        
+        Yields:
+            Dicts with the item's "index", "session_id", "status", "attempts"
+            and "result" (the same dict as process_message)
         """
-        # Add user message to history
-        self.conversation_history.append({
-            "role": "user",
-            "content": user_message
-        })
+        def process(session_id: Optional[str], message: str) -> Dict[str, Any]:
+            if session_id is None:
+                agent = cls(**agent_options)
+            elif agent_factory is not None:
+                agent = agent_factory(session_id)
+            else:
+                agent = cls(session_id=session_id, **agent_options)
+            with agent._turn_lock:
+                agent._sync_history()
+                start, store = len(agent.conversation_history), agent.conversation_store
+                agent.conversation_store = None  # Held back until the message succeeds
+                result = None
+                try:
+                    result = agent.process_message(message)
+                finally:
+                    agent._end_batch_attempt(start, store, result)
+                return result
         
-        # Prepare messages for API call
-        messages = [
-            {"role": "system", "content": self._build_system_prompt()}
-        ] + self.conversation_history
+        return run_batch(items, process, options)
+    
+    def _run_turn(self, speculation: Optional[Speculation] = None) -> Dict[str, Any]:
+        """
+        Call the model, and the tools it asks for, until it replies with text.
         
+        Args:
+            speculation: Tool calls started early for this turn; whatever the
+                model doesn't ask for is discarded when the turn ends
+        """
         try:
-            # Get response from LLM
-            response = self._make_api_call(messages)
-            assistant_message = response["choices"][0]["message"]["content"]
-            
-            # Add to conversation history
-            self.conversation_history.append({
-                "role": "assistant",
-                "content": assistant_message
-            })
+            executed: List[Dict[str, Any]] = []
+            steps: List[Dict[str, Any]] = []
+            while True:
+                # Get response from LLM
+                tokens = self.tokens_used
+                messages = self._build_messages()
+                allow_tools = len(steps) < self.max_steps
+                started = time.perf_counter()
+                response = self._make_api_call(messages, tools=allow_tools)
+                reply = response["choices"][0]["message"]
+                assistant_message = reply.get("content") or ""
+                step = {
+                    "step": len(steps) + 1,
+                    "model": self.served_model,
+                    "llm_ms": (time.perf_counter() - started) * 1000,
+                    "tokens": self.tokens_used - tokens
+                }
+                
+                # Check if the response asks for tools, then add it to the history
+                tool_calls = self._parse_tool_calls(assistant_message, reply.get("tool_calls")) if allow_tools else []
+                self._add_assistant_message(assistant_message, tool_calls)
+                steps.append(step)
+                if not tool_calls:
+                    return self._build_result(assistant_message, executed, steps)
+                
+                # Execute the tools and feed the results back
+                started = time.perf_counter()
+                results = self._execute_tool_calls(tool_calls, speculation)
+                step["tool_calls"] = [result["tool"] for result in results]
+                step["tools_ms"] = (time.perf_counter() - started) * 1000
+                for result in results:
+                    self._record_tool_result(result["tool"], result["result"], result.get("id"))
+                executed.extend(results)
             
-            # Check if the response is a tool call
-            tool_result = None
-            if assistant_message.strip().startswith("{"):
-                try:
-                    tool_call = json.loads(assistant_message)
-                    if "tool" in tool_call and "parameters" in tool_call:
-                        tool_name = tool_call["tool"]
-                        parameters = tool_call["parameters"]
-                        reasoning = tool_call.get("reasoning", "")
-                        
-                        # Execute the tool
-                        if tool_name in self.tools:
-                            tool_result = self.tools[tool_name](**parameters)
-                            
-                            # Add tool result to conversation
-                            result_message = f"Tool '{tool_name}' executed. Result: {json.dumps(tool_result, indent=2)}"
-                            self.conversation_history.append({
-                                "role": "user",
-                                "content": result_message
-                            })
-                            
-                            # Get follow-up response
-                            messages = [
-                                {"role": "system", "content": self._build_system_prompt()}
-                            ] + self.conversation_history
-                            
-                            follow_up = self._make_api_call(messages)
-                            follow_up_message = follow_up["choices"][0]["message"]["content"]
-                            
-                            self.conversation_history.append({
-                                "role": "assistant",
-                                "content": follow_up_message
-                            })
-                            
-                            return {
-                                "response": follow_up_message,
-                                "tool_used": tool_name,
-                                "tool_reasoning": reasoning,
-                                "tool_result": tool_result
-                            }
-                except json.JSONDecodeError:
-                    pass  # Not a JSON response, treat as normal text
+        except Exception as e:
+            return self._error_result(e)
+        finally:
+            if speculation is not None:
+                speculation.discard()
+    
+    def stream_message(self, user_message: str) -> Iterator[Dict[str, Any]]:
+        """
+        Process a user message, yielding events as the reply streams in.
+        
+        Tool calls are detected while each reply is still arriving and the
+        tools start as soon as the JSON is complete; read-only tools start
+        as soon as their own call is written, even inside a longer reply.
+        
+        Args:
+            user_message: The user's input message
             
-            return {
-                "response": assistant_message,
-                "tool_used": None,
-                "tool_result": None
-            }
+        Yields:
+            Event dicts with "event" and "data" keys: "token" and "reasoning"
+            deltas, "tool_call_start" and "tool_call_finish" per tool call,
+            "follow_up" deltas for replies after tool steps, and a final
+            "done" (same dict as process_message) or "error"
+        """
+        with self._turn_lock:
+            self._sync_history()
+            self._add_message("user", user_message)
+            speculation = None
             
-        except Exception as e:
-            error_message = f"Error processing message: {str(e)}"
-            return {
-                "response": error_message,
-                "tool_used": None,
-                "tool_result": None,
-                "error": str(e)
-            }
+            try:
+                speculation = self._begin_speculation(user_message)
+                executed: List[Dict[str, Any]] = []
+                steps: List[Dict[str, Any]] = []
+                while True:
+                    text_event = "follow_up" if steps else "token"
+                    allow_tools = len(steps) < self.max_steps
+                    on_call_ready = self._on_call_ready(speculation, allow_tools)
+                    parser = StreamingReplyParser(self.tools if allow_tools else (), on_call_ready)
+                    native = (
+                        ToolCallAccumulator(on_call_ready) if allow_tools and self.tool_calling == "native" else None
+                    )
+                    tokens = self.tokens_used
+                    messages = self._build_messages()
+                    started = time.perf_counter()
+                    deltas = self._stream_api_call(messages, native)
+                    try:
+                        for delta in deltas:
+                            for event, text in parser.feed(delta):
+                                yield {"event": text_event if event == "token" else event, "data": {"text": text}}
+                            if parser.complete:
+                                break  # Tool call JSON is closed, don't wait for the stream to end
+                    finally:
+                        deltas.close()
+                    for event, text in parser.finish():
+                        yield {"event": text_event if event == "token" else event, "data": {"text": text}}
+                    step = {
+                        "step": len(steps) + 1,
+                        "model": self.served_model,
+                        "llm_ms": (time.perf_counter() - started) * 1000,
+                        "tokens": self.tokens_used - tokens
+                    }
+                    steps.append(step)
+                    
+                    assistant_message = parser.text
+                    tool_calls = parser.tool_calls
+                    if allow_tools and not tool_calls:
+                        tool_calls = self._parse_tool_calls(assistant_message, native.tool_calls if native else None)
+                    self._add_assistant_message(assistant_message, tool_calls)
+                    
+                    if not tool_calls:
+                        yield {"event": "done", "data": self._build_result(assistant_message, executed, steps)}
+                        return
+                    
+                    for index, tool_call in enumerate(tool_calls):
+                        yield {"event": "tool_call_start", "data": {
+                            "index": index,
+                            "tool": tool_call["tool"],
+                            "reasoning": tool_call.get("reasoning", ""),
+                            "parameters": tool_call["parameters"]
+                        }}
+                    started = time.perf_counter()
+                    results = self._execute_tool_calls(tool_calls, speculation)
+                    step["tool_calls"] = [result["tool"] for result in results]
+                    step["tools_ms"] = (time.perf_counter() - started) * 1000
+                    for index, result in enumerate(results):
+                        self._record_tool_result(result["tool"], result["result"], result.get("id"))
+                        yield {"event": "tool_call_finish", "data": {
+                            "index": index,
+                            "tool": result["tool"],
+                            "result": result["result"],
+                            "duration_ms": result["duration_ms"]
+                        }}
+                    executed.extend(results)
+                
+            except Exception as e:
+                yield {"event": "error", "data": self._error_result(e)}
+            finally:
+                if speculation is not None:
+                    speculation.discard()
+    
+    def _error_result(self, error: Exception) -> Dict[str, Any]:
+        """Build the result dict returned when processing fails."""
+        AGENT_ERRORS.labels(self.model).inc()
+        return {
+            "response": f"Error processing message: {str(error)}",
+            "tool_used": None,
+            "tool_result": None,
+            "error": str(error)
+        }
     
     def reset_conversation(self):
-        """Reset the conversation history."""
-        self.conversation_history = []
+        """Reset the conversation history and the session's shell state, after any turn in progress."""
+        with self._turn_lock:
+            self.conversation_history = []
+            if self.conversation_store is not None:
+                self.conversation_store.clear(self.session_id)
+                self._store_version = self.conversation_store.version(self.session_id)
+        pool = get_shell_pool()
+        if pool is not None:
+            pool.release(self.session_id)
+    
+    def get_conversation_history(self) -> HistoryView:
+        """Get a read-only view of the current conversation history, without copying it."""
+        return HistoryView(self.conversation_history)
     
-    def get_conversation_history(self) -> List[Dict[str, str]]:
-        """Get the current conversation history."""
-        return self.conversation_history.copy()
+    def get_history_page(self, offset: int = 0, limit: Optional[int] = None) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Get a slice of the conversation, copying only the requested messages.
+        
+        Reads the full transcript from the conversation store when there is
+        one, otherwise the in-memory history.
+        
+        Args:
+            offset: Index of the first message, oldest first
+            limit: Maximum number of messages (None for all remaining)
+            
+        Returns:
+            Tuple of (messages, total message count)
+        """
+        if self.conversation_store is not None:
+            return self.conversation_store.page(self.session_id, offset, limit)
+        end = None if limit is None else offset + limit
+        return self.conversation_history[offset:end], len(self.conversation_history)
@@ -0,0 +1,418 @@
+"""
+Asyncio-native AI Agent.
+Mirrors AIAgent's API with coroutine methods so one process can keep many
+LLM round trips and tool calls in flight at once.
+"""
+
+import asyncio
+import os
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence
+
+from core.agent import AIAgent
+from core.async_tools import get_async_tools
+from core.batch import BatchItem, BatchOptions, arun_batch
+from core.http import AsyncPooledHTTPClient, get_async_http_client
+from core.messages import encode_json
+from core.metrics import TOOL_SECONDS, record_usage
+from core.router import ModelEndpoint
+from core.shell_pool import get_shell_pool
+from core.speculation import Speculation
+from core.function_calling import ToolCallAccumulator
+from core.streaming import StreamingReplyParser, parse_sse_delta
+from core.tools import tool_session
+
+
+class AsyncAIAgent(AIAgent):
+    """AI Agent whose API calls and tool executions are awaitable."""
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        model: str = "openai/gpt-3.5-turbo",
+        http_client: Optional[AsyncPooledHTTPClient] = None,
+        **kwargs
+    ):
+        """
+        Initialize the async AI Agent.
+
+        Args:
+            api_key: OpenRouter API key (defaults to OPENROUTER_API_KEY env var)
+            model: Model identifier to use for reasoning
+            http_client: Async HTTP client (defaults to the shared async client)
+            **kwargs: Further AIAgent options (cache_system_prompt, context_manager, max_steps, session_id,
+                conversation_store, history_window, router, completion_cache, temperature,
+                tool_calling, job_manager, speculate, prefetch)
+        """
+        super().__init__(api_key=api_key, model=model, **kwargs)
+        self.async_http_client = http_client or get_async_http_client()
+        self._tool_semaphore = asyncio.Semaphore(int(os.getenv("TOOL_MAX_WORKERS", 8)))
+        self._async_turn_lock = asyncio.Lock()
+
+    @property
+    def async_tools(self) -> Dict[str, Any]:
+        """The shared async tool registry, following the current TOOLS version."""
+        return get_async_tools()
+
+    def _compact_history(self):
+        """Summarization is awaited in _build_messages_async instead."""
+
+    async def _build_messages_async(self) -> List[Dict[str, Any]]:
+        """Build the message list, awaiting any summarization of old turns."""
+        count = self.context_manager.summary_candidates(
+            self.conversation_history, self._build_system_prompt()
+        )
+        if count:
+            response = await self._make_api_call(self._summary_request(self.conversation_history[:count]))
+            summary = response["choices"][0]["message"]["content"]
+            self.context_manager.apply_summary(self.conversation_history, count, summary)
+        return self._build_messages()
+
+    async def _route_async(self, send, **options) -> Any:
+        """Awaitable ``_route``: ``send`` is a coroutine function."""
+        if self.router is None:
+            endpoint = ModelEndpoint(self.model, self.base_url)
+            result = await send(endpoint)
+        else:
+            result, endpoint = await self.router.acall(send, **options)
+        self.served_model = endpoint.model
+        return result
+
+    async def _make_api_call(self, messages: List[Dict[str, str]], tools: bool = False) -> Dict[str, Any]:
+        """
+        Make an API call to OpenRouter without blocking the event loop.
+
+        Args:
+            messages: List of message dictionaries
+            tools: Offer the tools as function schemas (native tool calling only)
+
+        Returns:
+            API response data
+        """
+        async def send(endpoint: ModelEndpoint) -> Dict[str, Any]:
+            response = await self.async_http_client.post(
+                endpoint.base_url,
+                headers=self._build_headers(),
+                content=encode_json(self._build_payload(messages, model=endpoint.model, tools=tools)),
+                retry_statuses=self.router is None  # The router falls back on 429/5xx itself
+            )
+            response.raise_for_status()
+            data = response.json()
+            record_usage(endpoint.model, data.get("usage"))
+            self._count_tokens(data.get("usage"))
+            return data
+
+        cached, key = self._lookup_completion(messages, tools)
+        if cached is not None:
+            return cached
+        started = time.perf_counter()
+        data = await self._route_async(send)
+        self._store_completion(messages, data, key, started, tools)
+        return data
+
+    async def _stream_api_call(self, messages: List[Dict[str, str]],
+                               tool_calls: Optional[ToolCallAccumulator] = None) -> AsyncIterator[str]:
+        """
+        Make a streaming API call to OpenRouter.
+
+        Args:
+            messages: List of message dictionaries
+            tool_calls: Collects native tool call fragments; passing one offers
+                the tools as function schemas (native tool calling only)
+
+        Yields:
+            Content deltas as they arrive
+        """
+        async def send(endpoint: ModelEndpoint):
+            context = self.async_http_client.stream(
+                "POST",
+                endpoint.base_url,
+                headers=self._build_headers(),
+                content=encode_json(self._build_payload(
+                    messages, stream=True, model=endpoint.model, tools=tool_calls is not None
+                ))
+            )
+            response = await context.__aenter__()
+            try:
+                response.raise_for_status()
+            except BaseException:
+                await context.__aexit__(None, None, None)
+                raise
+            return context, response
+
+        context, response = await self._route_async(send, hedge=False, record_latency=False)
+        received: List[str] = []
+        try:
+            async for line in response.aiter_lines():
+                done, delta = parse_sse_delta(line)
+                if done:
+                    return
+                if tool_calls is not None and delta.get("tool_calls"):
+                    tool_calls.feed(delta["tool_calls"])
+                    received.extend(call.get("function", {}).get("arguments") or "" for call in delta["tool_calls"])
+                if delta.get("content"):
+                    received.append(delta["content"])
+                    yield delta["content"]
+        finally:
+            await context.__aexit__(None, None, None)
+            self._count_tokens(self._estimate_usage(messages, received))
+
+    async def _run_tool_async(self, tool_call: Dict[str, Any],
+                              speculation: Optional[Speculation] = None) -> Dict[str, Any]:
+        """Execute a single tool call, or wait on the matching one ``speculation`` started early."""
+        started = time.perf_counter()
+        error = self._invalid_tool_call(tool_call, self.async_tools)
+        if error is not None:
+            result = {"success": False, "error": error}
+        elif self.job_manager is not None and self.job_manager.should_background(tool_call["parameters"]):
+            try:
+                result = self._submit_job(tool_call, self._resume_on_loop(asyncio.get_running_loop()))
+            except Exception as e:
+                result = {"success": False, "error": str(e)}
+        else:
+            task = speculation.take(tool_call) if speculation is not None else None
+            result = await (task if task is not None else self._call_tool_async(tool_call))
+        duration = time.perf_counter() - started
+        TOOL_SECONDS.labels(self._tool_label(tool_call, self.async_tools)).observe(duration)
+        return self._tool_call_result(tool_call, result, duration)
+
+    async def _call_tool_async(self, tool_call: Dict[str, Any]) -> Any:
+        """Call an async tool for this session, bounded by the per-agent tool semaphore."""
+        async with self._tool_semaphore:
+            session = tool_session.set(self.session_id)
+            try:
+                return await self.async_tools[tool_call["tool"]](**tool_call["parameters"])
+            except Exception as e:
+                return {"success": False, "error": str(e)}
+            finally:
+                tool_session.reset(session)
+
+    def _launch_tool(self, tool_call: Dict[str, Any]) -> "asyncio.Task":
+        """Start a speculative tool call as a task on the running loop."""
+        return asyncio.ensure_future(self._call_tool_async(tool_call))
+
+    def _speculate(self, speculation: Speculation, tool_call: Dict[str, Any], tools: Optional[Dict[str, Any]] = None):
+        """Start a tool call early if the async registry can run it."""
+        super()._speculate(speculation, tool_call, self.async_tools if tools is None else tools)
+
+    def _resume_on_loop(self, loop: asyncio.AbstractEventLoop) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+        """Job completion callback that runs resume_job on the agent's event loop."""
+        def on_complete(job: Dict[str, Any]) -> Dict[str, Any]:
+            return asyncio.run_coroutine_threadsafe(self.resume_job(job), loop).result()
+        return on_complete
+
+    async def _execute_tool_calls_async(self, tool_calls: List[Dict[str, Any]],
+                                        speculation: Optional[Speculation] = None) -> List[Dict[str, Any]]:
+        """Execute the tool calls of one step concurrently, keeping their order."""
+        return list(await asyncio.gather(*(self._run_tool_async(call, speculation) for call in tool_calls)))
+
+    async def process_message(self, user_message: str) -> Dict[str, Any]:
+        """
+        Process a user message and potentially execute tools.
+
+        Args:
+            user_message: The user's input message
+
+        Returns:
+            The same dict as AIAgent.process_message
+        """
+        async with self._async_turn_lock:
+            self._sync_history()
+            self._add_message("user", user_message)
+            return await self._run_turn(self._begin_speculation(user_message))
+
+    async def resume_job(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Continue the conversation with a finished background job's result.
+
+        Args:
+            job: The finished job record
+
+        Returns:
+            The same dict as process_message, for the model's follow-up reply
+        """
+        async with self._async_turn_lock:
+            self._sync_history()
+            self._record_tool_result(job["tool"], self._job_result(job))
+            return await self._run_turn()
+
+    async def areset_conversation(self):
+        """Reset the conversation history and the session's shell state, after any turn in progress."""
+        async with self._async_turn_lock:
+            self.conversation_history = []
+            store = self.conversation_store
+            if store is not None:
+                await asyncio.to_thread(store.clear, self.session_id)
+                self._store_version = await asyncio.to_thread(store.version, self.session_id)
+        pool = get_shell_pool()
+        if pool is not None:
+            await asyncio.to_thread(pool.release, self.session_id)
+
+    @classmethod
+    def process_batch(
+        cls,
+        items: Sequence[BatchItem],
+        agent_factory: Optional[Callable[[str], "AsyncAIAgent"]] = None,
+        options: Optional[BatchOptions] = None,
+        **agent_options: Any
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Process many messages concurrently, yielding each result as it finishes.
+
+        Args:
+            items: (session_id, message) pairs; session_id may be None
+            agent_factory: Returns the agent for a session ID (defaults to a
+                new agent built from ``agent_options``)
+            options: Concurrency, rate and retry settings (defaults to the
+                BATCH_* environment variables)
+            **agent_options: Options for the agents this batch creates
+
+        Returns:
+            Async iterator of the same dicts as AIAgent.process_batch
+        """
+        async def process(session_id: Optional[str], message: str) -> Dict[str, Any]:
+            if session_id is None:
+                agent = cls(**agent_options)
+            elif agent_factory is not None:
+                agent = agent_factory(session_id)
+            else:
+                agent = cls(session_id=session_id, **agent_options)
+            async with agent._async_turn_lock:
+                agent._sync_history()
+                start, store = len(agent.conversation_history), agent.conversation_store
+                agent.conversation_store = None  # Held back until the message succeeds
+                result = None
+                try:
+                    agent._add_message("user", message)
+                    result = await agent._run_turn(agent._begin_speculation(message))
+                finally:
+                    agent._end_batch_attempt(start, store, result)
+                return result
+
+        return arun_batch(items, process, options)
+
+    async def _run_turn(self, speculation: Optional[Speculation] = None) -> Dict[str, Any]:
+        """Call the model, and the tools it asks for, until it replies with text."""
+        try:
+            executed: List[Dict[str, Any]] = []
+            steps: List[Dict[str, Any]] = []
+            while True:
+                tokens = self.tokens_used
+                messages = await self._build_messages_async()
+                allow_tools = len(steps) < self.max_steps
+                started = time.perf_counter()
+                response = await self._make_api_call(messages, tools=allow_tools)
+                reply = response["choices"][0]["message"]
+                assistant_message = reply.get("content") or ""
+                step = {
+                    "step": len(steps) + 1,
+                    "model": self.served_model,
+                    "llm_ms": (time.perf_counter() - started) * 1000,
+                    "tokens": self.tokens_used - tokens
+                }
+
+                tool_calls = self._parse_tool_calls(assistant_message, reply.get("tool_calls")) if allow_tools else []
+                self._add_assistant_message(assistant_message, tool_calls)
+                steps.append(step)
+                if not tool_calls:
+                    return self._build_result(assistant_message, executed, steps)
+
+                started = time.perf_counter()
+                results = await self._execute_tool_calls_async(tool_calls, speculation)
+                step["tool_calls"] = [result["tool"] for result in results]
+                step["tools_ms"] = (time.perf_counter() - started) * 1000
+                for result in results:
+                    self._record_tool_result(result["tool"], result["result"], result.get("id"))
+                executed.extend(results)
+
+        except Exception as e:
+            return self._error_result(e)
+        finally:
+            if speculation is not None:
+                speculation.discard()
+
+    async def stream_message(self, user_message: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Process a user message, yielding events as the reply streams in.
+
+        Args:
+            user_message: The user's input message
+
+        Yields:
+            The same events as AIAgent.stream_message
+        """
+        async with self._async_turn_lock:
+            self._sync_history()
+            self._add_message("user", user_message)
+            speculation = None
+
+            try:
+                speculation = self._begin_speculation(user_message)
+                executed: List[Dict[str, Any]] = []
+                steps: List[Dict[str, Any]] = []
+                while True:
+                    text_event = "follow_up" if steps else "token"
+                    allow_tools = len(steps) < self.max_steps
+                    on_call_ready = self._on_call_ready(speculation, allow_tools)
+                    parser = StreamingReplyParser(self.async_tools if allow_tools else (), on_call_ready)
+                    native = (
+                        ToolCallAccumulator(on_call_ready) if allow_tools and self.tool_calling == "native" else None
+                    )
+                    tokens = self.tokens_used
+                    messages = await self._build_messages_async()
+                    started = time.perf_counter()
+                    deltas = self._stream_api_call(messages, native)
+                    try:
+                        async for delta in deltas:
+                            for event, text in parser.feed(delta):
+                                yield {"event": text_event if event == "token" else event, "data": {"text": text}}
+                            if parser.complete:
+                                break
+                    finally:
+                        await deltas.aclose()
+                    for event, text in parser.finish():
+                        yield {"event": text_event if event == "token" else event, "data": {"text": text}}
+                    step = {
+                        "step": len(steps) + 1,
+                        "model": self.served_model,
+                        "llm_ms": (time.perf_counter() - started) * 1000,
+                        "tokens": self.tokens_used - tokens
+                    }
+                    steps.append(step)
+
+                    assistant_message = parser.text
+                    tool_calls = parser.tool_calls
+                    if allow_tools and not tool_calls:
+                        tool_calls = self._parse_tool_calls(assistant_message, native.tool_calls if native else None)
+                    self._add_assistant_message(assistant_message, tool_calls)
+
+                    if not tool_calls:
+                        yield {"event": "done", "data": self._build_result(assistant_message, executed, steps)}
+                        return
+
+                    for index, tool_call in enumerate(tool_calls):
+                        yield {"event": "tool_call_start", "data": {
+                            "index": index,
+                            "tool": tool_call["tool"],
+                            "reasoning": tool_call.get("reasoning", ""),
+                            "parameters": tool_call["parameters"]
+                        }}
+                    started = time.perf_counter()
+                    results = await self._execute_tool_calls_async(tool_calls, speculation)
+                    step["tool_calls"] = [result["tool"] for result in results]
+                    step["tools_ms"] = (time.perf_counter() - started) * 1000
+                    for index, result in enumerate(results):
+                        self._record_tool_result(result["tool"], result["result"], result.get("id"))
+                        yield {"event": "tool_call_finish", "data": {
+                            "index": index,
+                            "tool": result["tool"],
+                            "result": result["result"],
+                            "duration_ms": result["duration_ms"]
+                        }}
+                    executed.extend(results)
+
+            except Exception as e:
+                yield {"event": "error", "data": self._error_result(e)}
+            finally:
+                if speculation is not None:
+                    speculation.discard()
@@ -0,0 +1,159 @@
+"""
+Asyncio variants of the agent tools.
+Lets AsyncAIAgent run tools without tying up a worker thread per call.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from core.http import get_async_http_client
+from core.search_cache import get_search_cache
+from core.shell_pool import get_shell_pool
+from core.write_engine import flush_pending_writes, has_pending_writes
+from core.tools import (
+    SEARCH_URL,
+    SHELL_MAX_OUTPUT_BYTES,
+    TOOLS,
+    OutputBuffer,
+    _READ_CHUNK_SIZE,
+    _kill_process_group,
+    _parse_search_results,
+    _run_in_shell_pool,
+    _search_error,
+    _search_params,
+    _shell_result,
+    ensure_plugins,
+    tool_session,
+    write_to_file
+)
+
+
+async def _pump(stream: asyncio.StreamReader, buffer: OutputBuffer):
+    """Copy a subprocess stream into a bounded buffer."""
+    while True:
+        chunk = await stream.read(_READ_CHUNK_SIZE)
+        if not chunk:
+            return
+        buffer.write(chunk)
+
+
+async def run_shell(command: str, timeout: int = 30, max_output_bytes: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Execute a shell command without blocking the event loop.
+
+    Output is captured with the same per-stream cap as the blocking tool and
+    the whole process group is killed on timeout. Buffered file appends are
+    written out first. With SHELL_POOL_ENABLED the session's persistent shell
+    worker is used from a thread instead.
+
+    Args:
+        command: The shell command to execute
+        timeout: Maximum time to wait for command execution (seconds)
+        max_output_bytes: Bytes kept per stream (defaults to SHELL_MAX_OUTPUT_BYTES)
+
+    Returns:
+        Dict containing status, output, and error information
+    """
+    if has_pending_writes():
+        await asyncio.to_thread(flush_pending_writes)
+    if tool_session.get() is not None and get_shell_pool() is not None:
+        result = await asyncio.to_thread(_run_in_shell_pool, command, timeout, max_output_bytes)
+        if result is not None:
+            return result
+
+    max_output_bytes = max_output_bytes or SHELL_MAX_OUTPUT_BYTES
+    stdout, stderr = OutputBuffer(max_output_bytes), OutputBuffer(max_output_bytes)
+    try:
+        process = await asyncio.create_subprocess_shell(
+            command,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True
+        )
+        readers = asyncio.gather(_pump(process.stdout, stdout), _pump(process.stderr, stderr))
+        try:
+            await asyncio.wait_for(asyncio.shield(readers), timeout=timeout)
+            returncode = await process.wait()
+        except asyncio.TimeoutError:
+            _kill_process_group(process)
+            await process.wait()
+            readers.cancel()
+            return _shell_result(-1, stdout.getvalue(), f"Command timed out after {timeout} seconds")
+        return _shell_result(returncode, stdout.getvalue(), stderr.getvalue())
+    except Exception as e:
+        return _shell_result(-1, error=str(e))
+
+
+async def run_web_search(query: str, num_results: int = 5) -> Dict[str, Any]:
+    """
+    Perform a web search over the shared async HTTP client.
+
+    Uses the same search cache as the blocking tool.
+
+    Args:
+        query: The search query
+        num_results: Number of results to return
+
+    Returns:
+        Dict containing search results and metadata, with a ``cached`` flag
+    """
+    cache = get_search_cache()
+    if cache is None:
+        return dict(await _fetch_search(query, num_results), cached=False)
+    return await cache.aget_or_fetch(query, num_results, _fetch_search)
+
+
+async def _fetch_search(query: str, num_results: int) -> Dict[str, Any]:
+    """Run a search against the upstream API."""
+    try:
+        response = await get_async_http_client().get(
+            SEARCH_URL, params=_search_params(query), timeout=10
+        )
+        response.raise_for_status()
+        return _parse_search_results(response.json(), query, num_results)
+    except Exception as e:
+        return _search_error(query, e)
+
+
+def _to_thread(func: Callable[..., Any]) -> Callable[..., Awaitable[Any]]:
+    """Wrap a blocking tool so it runs in the default executor."""
+    async def wrapper(**kwargs):
+        return await asyncio.to_thread(func, **kwargs)
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+# Async tool registry, same names as TOOLS
+ASYNC_TOOLS: Dict[str, Callable[..., Awaitable[Dict[str, Any]]]] = {
+    "run_shell": run_shell,
+    "run_web_search": run_web_search,
+    "write_to_file": _to_thread(write_to_file)
+}
+
+
+# (registry version, async tool registry)
+_async_tools_cache: Tuple[int, Dict[str, Callable[..., Awaitable[Dict[str, Any]]]]] = (0, {})
+
+
+def get_async_tools() -> Dict[str, Callable[..., Awaitable[Dict[str, Any]]]]:
+    """
+    Get the async tool registry.
+
+    Tools that only have a blocking implementation in TOOLS are wrapped to run
+    in a worker thread. Built once per tool registry version and shared by
+    every agent; callers must not modify it.
+
+    Returns:
+        Dict mapping tool names to coroutine functions
+    """
+    global _async_tools_cache
+    cache = _async_tools_cache
+    if cache[0] != TOOLS.version:
+        ensure_plugins()
+        version = TOOLS.version
+        tools = {name: _to_thread(func) for name, func in TOOLS.items()}
+        tools.update({name: func for name, func in ASYNC_TOOLS.items() if name in TOOLS})
+        cache = _async_tools_cache = (version, tools)
+    return cache[1]
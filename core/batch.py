@@ -0,0 +1,245 @@
+"""
+Batch processing for many independent chat messages.
+Runs (session_id, message) items concurrently under a concurrency limit and
+a rate budget, retrying failed items, and yields each result as it finishes.
+"""
+
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from core.ratelimit import TokenBucket
+
+# (session_id or None for a one-off session, message)
+BatchItem = Tuple[Optional[str], str]
+
+
+class BatchOptions:
+    """Concurrency, rate and retry settings for a batch."""
+
+    def __init__(self, max_concurrency: int = 8, rate: float = 0, max_retries: int = 2,
+                 retry_backoff: float = 0.5, admit: Optional[Callable[[Optional[str]], float]] = None):
+        """
+        Initialize the options.
+
+        Args:
+            max_concurrency: Items processed at once
+            rate: Item attempts started per second across the batch (0 for no limit)
+            max_retries: Extra attempts for an item whose result is an error
+            retry_backoff: Seconds before the first retry, doubling after each
+            admit: Asked before each attempt with the item's session ID; returns
+                0 to go ahead or the seconds to wait before asking again (e.g.
+                RateLimiter.check, so batches share the server's rate limits)
+        """
+        self.max_concurrency = max(1, max_concurrency)
+        self.rate = rate
+        self.max_retries = max(0, max_retries)
+        self.retry_backoff = retry_backoff
+        self.admit = admit
+
+    @classmethod
+    def from_env(cls) -> "BatchOptions":
+        """Create options configured from BATCH_* environment variables."""
+        return cls(
+            max_concurrency=int(os.getenv("BATCH_MAX_CONCURRENCY", 8)),
+            rate=float(os.getenv("BATCH_RATE", 0)),
+            max_retries=int(os.getenv("BATCH_MAX_RETRIES", 2)),
+            retry_backoff=float(os.getenv("BATCH_RETRY_BACKOFF", 0.5))
+        )
+
+    def limiter(self) -> Optional[TokenBucket]:
+        return TokenBucket(self.rate, burst=self.max_concurrency) if self.rate > 0 else None
+
+
+class BatchRequestError(ValueError):
+    """A /chat/batch payload that can't be processed; the message is safe to return."""
+
+
+def parse_batch_request(data: Any, defaults: Optional[BatchOptions] = None,
+                        max_items: Optional[int] = None) -> Tuple[List[BatchItem], BatchOptions]:
+    """
+    Read the items and options of a /chat/batch payload.
+
+    Args:
+        data: Decoded JSON body: {"items": [{"message", "session_id"?}], "concurrency"?, "max_retries"?}
+        defaults: Server settings; a request may lower but not raise them
+        max_items: Most items one request may carry (defaults to BATCH_MAX_ITEMS, or 1000)
+
+    Returns:
+        Tuple of (items, options)
+
+    Raises:
+        BatchRequestError: If the payload is malformed or too large
+    """
+    defaults = defaults or BatchOptions.from_env()
+    max_items = max_items if max_items is not None else int(os.getenv("BATCH_MAX_ITEMS", 1000))
+    raw_items = data.get("items") if isinstance(data, dict) else None
+    if not isinstance(raw_items, list) or not raw_items:
+        raise BatchRequestError("Missing 'items' in request body")
+    if len(raw_items) > max_items:
+        raise BatchRequestError(f"A batch may hold at most {max_items} items")
+    items: List[BatchItem] = []
+    for index, item in enumerate(raw_items):
+        if not isinstance(item, dict) or not isinstance(item.get("message"), str):
+            raise BatchRequestError(f"Item {index} is missing 'message'")
+        session_id = item.get("session_id")
+        if session_id is not None and not isinstance(session_id, str):
+            raise BatchRequestError(f"Item {index} has a non-string 'session_id'")
+        items.append((session_id, item["message"]))
+    try:
+        concurrency = int(data.get("concurrency", defaults.max_concurrency))
+        max_retries = int(data.get("max_retries", defaults.max_retries))
+    except (TypeError, ValueError):
+        raise BatchRequestError("'concurrency' and 'max_retries' must be integers")
+    options = BatchOptions(
+        max_concurrency=min(concurrency, defaults.max_concurrency),
+        rate=defaults.rate,
+        max_retries=min(max_retries, defaults.max_retries),
+        retry_backoff=defaults.retry_backoff,
+        admit=defaults.admit
+    )
+    return items, options
+
+
+def _groups(items: Sequence[BatchItem]) -> List[List[Tuple[int, Optional[str], str]]]:
+    """
+    Split items into units of work.
+
+    Messages for the same session run one after another in their original
+    order, since each continues that session's conversation; items without
+    a session are independent.
+    """
+    sessions: "OrderedDict[Any, List[Tuple[int, Optional[str], str]]]" = OrderedDict()
+    for index, (session_id, message) in enumerate(items):
+        key = session_id if session_id is not None else ("item", index)
+        sessions.setdefault(key, []).append((index, session_id, message))
+    return list(sessions.values())
+
+
+def _outcome(index: int, session_id: Optional[str], result: Dict[str, Any], attempts: int) -> Dict[str, Any]:
+    return {
+        "index": index,
+        "session_id": session_id,
+        "status": "error" if "error" in result else "ok",
+        "attempts": attempts,
+        "result": result
+    }
+
+
+def run_batch(
+    items: Sequence[BatchItem],
+    process: Callable[[Optional[str], str], Dict[str, Any]],
+    options: Optional[BatchOptions] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Process items concurrently, yielding results in completion order.
+
+    Args:
+        items: (session_id, message) pairs
+        process: Handles one message, returning a result dict (with "error" on failure)
+        options: Concurrency, rate and retry settings (defaults from the environment)
+
+    Yields:
+        Dicts with the item's "index", "session_id", "status" ("ok" or
+        "error"), "attempts" and "result". Closing the iterator early stops
+        items that haven't started.
+    """
+    options = options or BatchOptions.from_env()
+    limiter = options.limiter()
+    results: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+    stopped = threading.Event()
+
+    def attempt(session_id: Optional[str], message: str) -> Dict[str, Any]:
+        try:
+            return process(session_id, message)
+        except Exception as e:
+            return {"error": str(e)}
+
+    def work(group: List[Tuple[int, Optional[str], str]]):
+        for index, session_id, message in group:
+            attempts = 0
+            while not stopped.is_set():
+                try:
+                    wait = options.admit(session_id) if options.admit is not None else 0
+                    if wait:
+                        time.sleep(wait)
+                        continue
+                    if limiter is not None:
+                        limiter.acquire()
+                except Exception as e:
+                    result = {"error": str(e)}  # Report the item instead of leaving the consumer waiting
+                    break
+                attempts += 1
+                result = attempt(session_id, message)
+                if "error" not in result or attempts > options.max_retries:
+                    break
+                time.sleep(options.retry_backoff * 2 ** (attempts - 1))
+            else:
+                return
+            results.put(_outcome(index, session_id, result, attempts))
+
+    groups = _groups(items)
+    executor = ThreadPoolExecutor(max_workers=min(options.max_concurrency, len(groups) or 1),
+                                  thread_name_prefix="agent-batch")
+    try:
+        futures = [executor.submit(work, group) for group in groups]
+        for _ in range(len(items)):
+            yield results.get()
+        for future in futures:
+            future.result()
+    finally:
+        stopped.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def arun_batch(
+    items: Sequence[BatchItem],
+    process: Callable[[Optional[str], str], Awaitable[Dict[str, Any]]],
+    options: Optional[BatchOptions] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """Awaitable ``run_batch``: ``process`` is a coroutine function and units of work are tasks."""
+    options = options or BatchOptions.from_env()
+    limiter = options.limiter()
+    results: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+    semaphore = asyncio.Semaphore(options.max_concurrency)
+
+    async def attempt(session_id: Optional[str], message: str) -> Dict[str, Any]:
+        try:
+            return await process(session_id, message)
+        except Exception as e:
+            return {"error": str(e)}
+
+    async def work(group: List[Tuple[int, Optional[str], str]]):
+        async with semaphore:
+            for index, session_id, message in group:
+                attempts = 0
+                while True:
+                    try:
+                        wait = options.admit(session_id) if options.admit is not None else 0
+                        if wait:
+                            await asyncio.sleep(wait)
+                            continue
+                        if limiter is not None:
+                            await limiter.aacquire()
+                    except Exception as e:
+                        result = {"error": str(e)}
+                        break
+                    attempts += 1
+                    result = await attempt(session_id, message)
+                    if "error" not in result or attempts > options.max_retries:
+                        break
+                    await asyncio.sleep(options.retry_backoff * 2 ** (attempts - 1))
+                results.put_nowait(_outcome(index, session_id, result, attempts))
+
+    tasks = [asyncio.ensure_future(work(group)) for group in _groups(items)]
+    try:
+        for _ in range(len(items)):
+            yield await results.get()
+    finally:
+        for task in tasks:
+            task.cancel()
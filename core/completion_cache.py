@@ -0,0 +1,320 @@
+"""
+Completion cache for repeated prompts.
+Answers LLM requests whose model and messages exactly match a recent one
+(or, optionally, whose last message is similar enough) without a round trip.
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from core.context import is_tool_result
+from core.messages import json_default
+from core.metrics import COMPLETION_CACHE_EVENTS
+
+MessageDict = Dict[str, Any]
+# Sparse unit vector: feature index -> weight
+Embedding = Dict[int, float]
+
+# Sessions whose hit statistics are kept (least recently active dropped first)
+MAX_TRACKED_SESSIONS = 10000
+
+# Candidates kept per shared context for similarity lookups
+SIMILARITY_BUCKET_SIZE = 64
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def hashed_embedding(text: str, dimensions: int = 4096) -> Embedding:
+    """
+    Embed text locally as a normalized bag of hashed words and word pairs.
+
+    Cheap and dependency-free; good at catching rephrasings that differ in
+    case, punctuation or a word or two, not at paraphrases.
+    """
+    words = _WORD_RE.findall(text.lower())
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    vector: Embedding = {}
+    for feature in features:
+        index = zlib.crc32(feature.encode("utf-8")) % dimensions
+        vector[index] = vector.get(index, 0.0) + 1.0
+    norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+    return {index: weight / norm for index, weight in vector.items()} if norm else {}
+
+
+def _cosine(a: Embedding, b: Embedding) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(index, 0.0) for index, weight in a.items())
+
+
+def _digest(*parts: Any) -> str:
+    encoded = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=json_default)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class CachedCompletion:
+    """A stored API response with what it cost to produce."""
+
+    __slots__ = ("data", "model", "expires_at", "tokens", "latency", "key", "context")
+
+    def __init__(self, data: Dict[str, Any], model: str, expires_at: float, latency: float,
+                 key: str, context: Optional[str]):
+        self.data = data
+        self.model = model
+        self.expires_at = expires_at
+        usage = data.get("usage") or {}
+        self.tokens = (usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0)
+        self.latency = latency
+        self.key = key
+        self.context = context
+
+
+class CompletionCache:
+    """
+    TTL + LRU cache of chat completion responses.
+
+    Entries are keyed on a hash of the model and the full message list,
+    system prompt included. Only requests with an explicit temperature of 0
+    are cached: any other temperature, including the provider's default
+    sampling when none is sent, gives a different reply each time. Requests
+    carrying tool results are never cached either. With
+    ``similarity_threshold`` set, a request whose messages match a cached
+    one except for the last user message is also answered when that
+    message's embedding is at least that similar.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 3600,
+        similarity_threshold: float = 0,
+        embed: Callable[[str], Embedding] = hashed_embedding
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Maximum number of responses kept
+            ttl: Seconds a response stays fresh
+            similarity_threshold: Cosine similarity needed for a near-match of the
+                last user message (0 disables the similarity tier)
+            embed: Turns text into a sparse unit vector for the similarity tier
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.embed = embed
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, CachedCompletion]" = OrderedDict()
+        # context hash -> [(key, embedding of the last user message)]
+        self._similar: Dict[str, List[Tuple[str, Embedding]]] = {}
+        self._stats = {"hits": 0, "similar_hits": 0, "misses": 0, "skipped": 0, "evictions": 0,
+                       "saved_tokens": 0, "saved_ms": 0.0}
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    @classmethod
+    def from_env(cls) -> Optional["CompletionCache"]:
+        """
+        Create a cache configured from COMPLETION_CACHE_* environment variables.
+
+        Returns:
+            The cache, or None unless COMPLETION_CACHE_ENABLED is true
+        """
+        if os.getenv("COMPLETION_CACHE_ENABLED", "false").lower() != "true":
+            return None
+        return cls(
+            max_entries=int(os.getenv("COMPLETION_CACHE_MAX_ENTRIES", 1024)),
+            ttl=float(os.getenv("COMPLETION_CACHE_TTL", 3600)),
+            similarity_threshold=float(os.getenv("COMPLETION_CACHE_SIMILARITY", 0))
+        )
+
+    @staticmethod
+    def cacheable(messages: List[MessageDict], temperature: Optional[float] = None) -> bool:
+        """Whether a request may be answered from, and stored in, the cache."""
+        if temperature != 0:
+            return False
+        return not any(is_tool_result(message) for message in messages)
+
+    def _similarity_parts(self, model: str, messages: List[MessageDict]) -> Optional[Tuple[str, str]]:
+        """Hash of everything but the last message, and that message's text, if it is a user message."""
+        if not self.similarity_threshold or not messages:
+            return None
+        last = messages[-1]
+        if last.get("role") != "user" or not isinstance(last.get("content"), str):
+            return None
+        return _digest(model, messages[:-1]), last["content"]
+
+    def lookup(self, model: str, messages: List[MessageDict], session_id: Optional[str] = None,
+               key: Optional[str] = None) -> Optional[CachedCompletion]:
+        """
+        Find a fresh cached response for a request.
+
+        Args:
+            model: Model the request is for
+            messages: The request's messages
+            session_id: Session to credit a hit or miss to
+            key: The request's key, if already computed with ``key_for``
+
+        Returns:
+            The cached completion, or None on a miss
+        """
+        key = key or self.key_for(model, messages)
+        now = time.time()
+        event = "misses"
+        with self._lock:
+            entry = self._fresh(key, now)
+            if entry is not None:
+                event = "hits"
+        if entry is None:
+            parts = self._similarity_parts(model, messages)
+            if parts is not None:
+                entry = self._find_similar(parts[0], self.embed(parts[1]), now)
+                if entry is not None:
+                    event = "similar_hits"
+        self._record(event, session_id, entry)
+        return entry
+
+    def store(self, model: str, messages: List[MessageDict], data: Dict[str, Any], served_model: str,
+              latency: float, key: Optional[str] = None):
+        """
+        Cache a successful response.
+
+        Args:
+            model: Model the request was for
+            messages: The request's messages
+            data: The API response
+            served_model: Model that produced the response
+            latency: Seconds the round trip took, credited as saved on each hit
+            key: The request's key, if already computed with ``key_for``
+        """
+        key = key or self.key_for(model, messages)
+        parts = self._similarity_parts(model, messages)
+        embedding = self.embed(parts[1]) if parts is not None else None
+        entry = CachedCompletion(data, served_model, time.time() + self.ttl, latency, key,
+                                 parts[0] if parts is not None else None)
+        with self._lock:
+            previous = self._entries.get(key)
+            if previous is not None:
+                self._forget_similar(previous)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            if embedding:
+                bucket = self._similar.setdefault(entry.context, [])
+                bucket.append((key, embedding))
+                del bucket[:-SIMILARITY_BUCKET_SIZE]
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._forget_similar(evicted)
+                self._stats["evictions"] += 1
+
+    def record_skip(self, session_id: Optional[str] = None):
+        """Count a request that was not eligible for caching."""
+        self._record("skipped", session_id, None)
+
+    @staticmethod
+    def key_for(model: str, messages: List[MessageDict]) -> str:
+        """Hash a request's model and messages into its cache key."""
+        return _digest(model, messages)
+
+    def clear(self):
+        """Drop every cached response (statistics are kept)."""
+        with self._lock:
+            self._entries.clear()
+            self._similar.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries), max_entries=self.max_entries,
+                         sessions=len(self._sessions))
+        stats["saved_ms"] = round(stats["saved_ms"], 1)
+        return stats
+
+    def get_session_stats(self, session_id: str) -> Dict[str, Any]:
+        """Get one session's hits, misses, skips and the tokens and time its hits saved."""
+        with self._lock:
+            stats = dict(self._sessions.get(session_id) or self._empty_session_stats())
+        stats["saved_ms"] = round(stats["saved_ms"], 1)
+        return stats
+
+    def _fresh(self, key: str, now: float) -> Optional[CachedCompletion]:
+        """Get an unexpired entry, dropping it if stale; the caller must hold the lock."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= now:
+            del self._entries[key]
+            self._forget_similar(entry)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _find_similar(self, context: str, embedding: Embedding, now: float) -> Optional[CachedCompletion]:
+        if not embedding:
+            return None
+        with self._lock:
+            best_key, best_score = None, self.similarity_threshold
+            for key, candidate in self._similar.get(context, ()):
+                score = _cosine(embedding, candidate)
+                if score >= best_score:
+                    best_key, best_score = key, score
+            return self._fresh(best_key, now) if best_key is not None else None
+
+    def _forget_similar(self, entry: CachedCompletion):
+        """Remove an entry from its similarity bucket; the caller must hold the lock."""
+        bucket = self._similar.get(entry.context) if entry.context else None
+        if bucket is None:
+            return
+        bucket[:] = [item for item in bucket if item[0] != entry.key]
+        if not bucket:
+            del self._similar[entry.context]
+
+    @staticmethod
+    def _empty_session_stats() -> Dict[str, Any]:
+        return {"hits": 0, "similar_hits": 0, "misses": 0, "skipped": 0, "saved_tokens": 0, "saved_ms": 0.0}
+
+    def _record(self, event: str, session_id: Optional[str], entry: Optional[CachedCompletion]):
+        COMPLETION_CACHE_EVENTS.labels(event).inc()
+        with self._lock:
+            targets = [self._stats]
+            if session_id is not None:
+                stats = self._sessions.get(session_id)
+                if stats is None:
+                    stats = self._sessions[session_id] = self._empty_session_stats()
+                    if len(self._sessions) > MAX_TRACKED_SESSIONS:
+                        self._sessions.popitem(last=False)
+                else:
+                    self._sessions.move_to_end(session_id)
+                targets.append(stats)
+            for stats in targets:
+                stats[event] += 1
+                if entry is not None:
+                    stats["saved_tokens"] += entry.tokens
+                    stats["saved_ms"] += entry.latency * 1000
+
+
+_completion_cache: Optional[CompletionCache] = None
+_completion_cache_loaded = False
+_completion_cache_lock = threading.Lock()
+
+
+def get_completion_cache() -> Optional[CompletionCache]:
+    """
+    Get the process-wide completion cache.
+
+    Returns None unless COMPLETION_CACHE_ENABLED is true.
+    """
+    global _completion_cache, _completion_cache_loaded
+    if not _completion_cache_loaded:
+        with _completion_cache_lock:
+            if not _completion_cache_loaded:
+                _completion_cache = CompletionCache.from_env()
+                _completion_cache_loaded = True
+    return _completion_cache
@@ -0,0 +1,250 @@
+"""
+Context-window management for the AI Agent.
+Keeps the history sent with each request inside a token budget by dropping
+old tool outputs, trimming old turns or folding them into a summary.
+"""
+
+import os
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from core.messages import Message
+
+try:
+    import tiktoken
+except ImportError:  # Optional, fall back to a character heuristic
+    tiktoken = None
+
+
+# Context window sizes (tokens) for models we commonly route to
+MODEL_CONTEXT_WINDOWS: Dict[str, int] = {
+    "openai/gpt-3.5-turbo": 16385,
+    "openai/gpt-4": 8192,
+    "openai/gpt-4-turbo": 128000,
+    "openai/gpt-4o": 128000,
+    "openai/gpt-4o-mini": 128000,
+    "anthropic/claude-3-haiku": 200000,
+    "anthropic/claude-3.5-sonnet": 200000,
+    "google/gemini-pro": 32768,
+    "meta-llama/llama-3-70b-instruct": 8192,
+    "mistralai/mistral-7b-instruct": 32768
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Tokens each message costs on top of its content (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+STRATEGIES = ("trim", "drop_tool_outputs", "summarize")
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+SUMMARY_PROMPT = (
+    "Summarize the following conversation between a user and an AI agent. "
+    "Keep facts, decisions, file names, commands and open questions that later "
+    "turns may depend on. Be concise."
+)
+
+_TOOL_RESULT_PATTERN = re.compile(r"^Tool '([^']+)' executed\. Result: ")
+
+_encoding = None
+
+
+def _get_encoding():
+    """Load the tiktoken encoding once, or None if it's unavailable."""
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False  # Encoding files unavailable, use the heuristic
+    return _encoding or None
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    """
+    Count the tokens in a piece of text.
+
+    Uses tiktoken when it is installed and roughly four characters per token
+    otherwise. Results are cached, so re-counting an unchanged history is cheap.
+
+    Args:
+        text: Text to count
+
+    Returns:
+        Token count
+    """
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def count_message_tokens(message: Dict[str, Any]) -> int:
+    """Count the tokens a single chat message costs, native tool calls included."""
+    content = message.get("content")
+    if not isinstance(content, str):
+        content = "".join(part.get("text", "") for part in content or [])
+    tokens = count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+    for call in message.get("tool_calls") or ():
+        function = call.get("function") or {}
+        tokens += count_tokens(function.get("name", "") + function.get("arguments", ""))
+    return tokens
+
+
+def is_tool_result(message: Dict[str, Any]) -> bool:
+    """Check whether a history message carries a tool result (text protocol or native ``tool`` message)."""
+    if message.get("role") == "tool":
+        return True
+    content = message.get("content")
+    return message.get("role") == "user" and isinstance(content, str) and bool(_TOOL_RESULT_PATTERN.match(content))
+
+
+class ContextManager:
+    """
+    Fits a conversation history into a token budget.
+
+    Strategies:
+        trim: drop the oldest messages
+        drop_tool_outputs: replace old tool results with a short placeholder,
+            then trim if still over budget
+        summarize: fold old turns into a single summary message kept in the
+            history (the agent supplies the summary), then trim if needed
+
+    The most recent ``keep_recent`` messages are never summarized or have
+    their tool output dropped.
+    """
+
+    def __init__(
+        self,
+        max_tokens: Optional[int] = None,
+        model: str = "openai/gpt-3.5-turbo",
+        strategy: str = "drop_tool_outputs",
+        reserve_tokens: int = 1024,
+        keep_recent: int = 6
+    ):
+        """
+        Initialize the context manager.
+
+        Args:
+            max_tokens: Token budget for the whole prompt (defaults to the model's
+                context window minus ``reserve_tokens``)
+            model: Model identifier used to look up the context window
+            strategy: One of "trim", "drop_tool_outputs" or "summarize"
+            reserve_tokens: Tokens left free for the completion
+            keep_recent: Number of latest messages always sent verbatim
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown context strategy '{strategy}', expected one of {STRATEGIES}")
+        if max_tokens is None:
+            max_tokens = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW) - reserve_tokens
+        self.max_tokens = max_tokens
+        self.strategy = strategy
+        self.keep_recent = keep_recent
+
+    @classmethod
+    def from_env(cls, model: str) -> "ContextManager":
+        """Create a context manager configured from CONTEXT_* environment variables."""
+        max_tokens = os.getenv("CONTEXT_MAX_TOKENS")
+        return cls(
+            max_tokens=int(max_tokens) if max_tokens else None,
+            model=model,
+            strategy=os.getenv("CONTEXT_STRATEGY", "drop_tool_outputs"),
+            reserve_tokens=int(os.getenv("CONTEXT_RESERVE_TOKENS", 1024)),
+            keep_recent=int(os.getenv("CONTEXT_KEEP_RECENT", 6))
+        )
+
+    def history_budget(self, system_prompt: str) -> int:
+        """Tokens left for the history once the system prompt is accounted for."""
+        return self.max_tokens - count_tokens(system_prompt) - MESSAGE_OVERHEAD_TOKENS
+
+    def summary_candidates(self, history: List[Dict[str, Any]], system_prompt: str) -> int:
+        """
+        Decide how many of the oldest messages should be folded into a summary.
+
+        Args:
+            history: Full conversation history
+            system_prompt: System prompt sent with the history
+
+        Returns:
+            Number of leading messages to summarize (0 when the history fits)
+        """
+        if self.strategy != "summarize":
+            return 0
+        candidates = len(history) - self.keep_recent
+        # Native tool results must stay with the assistant message that called them
+        while candidates > 0 and history[candidates].get("role") == "tool":
+            candidates -= 1
+        if candidates < 2:
+            return 0
+        total = sum(count_message_tokens(message) for message in history)
+        if total <= self.history_budget(system_prompt):
+            return 0
+        return candidates
+
+    def apply_summary(self, history: List[Dict[str, Any]], count: int, summary: str):
+        """Replace the ``count`` oldest messages with a single summary message, in place."""
+        history[:count] = [Message("system", SUMMARY_PREFIX + summary)]
+
+    def fit(self, history: List[Dict[str, Any]], system_prompt: str) -> List[Dict[str, Any]]:
+        """
+        Select the messages to send so they fit the budget.
+
+        The history itself is not modified.
+
+        Args:
+            history: Full conversation history
+            system_prompt: System prompt sent with the history
+
+        Returns:
+            The messages to send after the system prompt
+        """
+        budget = self.history_budget(system_prompt)
+        costs = [count_message_tokens(message) for message in history]
+        total = sum(costs)
+        if total <= budget:
+            return history
+
+        messages = list(history)
+        if self.strategy == "drop_tool_outputs":
+            protected = len(messages) - self.keep_recent
+            for i in range(protected):
+                if total <= budget:
+                    break
+                if messages[i].get("role") == "tool":
+                    messages[i] = Message(
+                        "tool", "Result omitted to save context.", {"tool_call_id": messages[i].get("tool_call_id")}
+                    )
+                elif is_tool_result(messages[i]):
+                    tool_name = _TOOL_RESULT_PATTERN.match(messages[i]["content"]).group(1)
+                    messages[i] = Message("user", f"Tool '{tool_name}' executed. Result omitted to save context.")
+                else:
+                    continue
+                new_cost = count_message_tokens(messages[i])
+                total += new_cost - costs[i]
+                costs[i] = new_cost
+
+        # Trim the oldest messages, always keeping the latest one
+        start = 0
+        while total > budget and start < len(messages) - 1:
+            total -= costs[start]
+            start += 1
+        # Don't open with native tool results whose calling message was trimmed
+        while start < len(messages) - 1 and messages[start].get("role") == "tool":
+            start += 1
+        return messages[start:]
+
+
+def format_transcript(messages: List[Dict[str, Any]], max_chars_per_message: int = 2000) -> str:
+    """Render messages as plain text for the summarization prompt."""
+    lines = []
+    for message in messages:
+        content = message.get("content") or ""
+        for call in message.get("tool_calls") or ():
+            function = call.get("function") or {}
+            content += f"\n[tool call] {function.get('name')}({function.get('arguments', '')})"
+        if len(content) > max_chars_per_message:
+            content = content[:max_chars_per_message] + " [...]"
+        lines.append(f"{message.get('role', 'user')}: {content}")
+    return "\n\n".join(lines)
@@ -0,0 +1,226 @@
+"""
+Structured tool calling.
+Builds JSON schemas for OpenRouter's native function calling from the tool
+registry, validates tool parameters before dispatch and finds tool calls
+embedded anywhere in a text reply.
+"""
+
+import json
+import re
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from core.streaming import as_tool_calls
+from core.tools import TOOL_DESCRIPTIONS, TOOLS, ensure_plugins, parameters_schema
+
+# Characters that can change the JSON scanner's state
+_JSON_TOKEN_RE = re.compile(r'[{}\[\]"\\]')
+
+# (registry version, tool schemas, parameter schemas by tool name)
+_schema_cache: Tuple[int, List[Dict[str, Any]], Dict[str, Dict[str, Any]]] = (0, [], {})
+
+
+def _compile_schemas() -> Tuple[int, List[Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+    """Build the function schemas for the current tool registry."""
+    global _schema_cache
+    ensure_plugins()
+    version = TOOLS.version
+    tools = []
+    parameters = {}
+    for name, description in TOOL_DESCRIPTIONS.items():
+        if name not in TOOLS:
+            continue
+        parameters[name] = description.get("schema") or parameters_schema(description.get("parameters", ""))
+        tools.append({
+            "type": "function",
+            "function": {
+                "name": name,
+                "description": description.get("description", ""),
+                "parameters": parameters[name]
+            }
+        })
+    _schema_cache = (version, tools, parameters)
+    return _schema_cache
+
+
+def get_tool_schemas() -> List[Dict[str, Any]]:
+    """
+    Get the ``tools`` list for a native function-calling request.
+
+    Built once per tool registry version and shared by every agent.
+    """
+    cache = _schema_cache
+    if cache[0] != TOOLS.version:
+        cache = _compile_schemas()
+    return cache[1]
+
+
+def get_parameters_schema(tool_name: str) -> Optional[Dict[str, Any]]:
+    """Get a tool's parameter schema, or None for a tool without a description."""
+    cache = _schema_cache
+    if cache[0] != TOOLS.version:
+        cache = _compile_schemas()
+    return cache[2].get(tool_name)
+
+
+def _matches_type(value: Any, schema_type: str) -> bool:
+    if schema_type == "integer":
+        return isinstance(value, int) and not isinstance(value, bool)
+    if schema_type == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return isinstance(value, {
+        "string": str, "boolean": bool, "array": list, "object": dict
+    }[schema_type])
+
+
+def validate_parameters(tool_name: str, parameters: Any) -> Optional[str]:
+    """
+    Check tool call parameters against the tool's schema.
+
+    Args:
+        tool_name: Name of the tool to call
+        parameters: Parameters supplied by the model
+
+    Returns:
+        A description of the first problem found, or None if they are valid
+    """
+    if not isinstance(parameters, dict):
+        return "parameters must be an object"
+    schema = get_parameters_schema(tool_name)
+    if schema is None:
+        return None
+    properties = schema["properties"]
+    for name in schema["required"]:
+        if name not in parameters:
+            return f"missing required parameter '{name}'"
+    for name, value in parameters.items():
+        if name not in properties:
+            return f"unknown parameter '{name}'"
+        schema_type = properties[name].get("type")
+        if schema_type and value is not None and not _matches_type(value, schema_type):
+            return f"parameter '{name}' must be of type {schema_type}"
+    return None
+
+
+def extract_tool_calls(text: str, tool_names: Iterable[str]) -> List[Dict[str, Any]]:
+    """
+    Find tool calls in a reply, including ones wrapped in prose or code fences.
+
+    The text is scanned once, jumping between the characters that matter
+    to JSON structure; only balanced top-level ``{...}`` or ``[...]`` spans
+    are decoded.
+
+    Args:
+        text: Assistant reply
+        tool_names: Names of tools the agent can execute
+
+    Returns:
+        Every tool call found, in order (empty for a normal reply)
+    """
+    calls: List[Dict[str, Any]] = []
+    depth = 0
+    start = 0
+    in_string = False
+    skip_to = 0
+    for match in _JSON_TOKEN_RE.finditer(text):
+        i = match.start()
+        if i < skip_to:
+            continue  # Escaped character
+        c = text[i]
+        if in_string:
+            if c == "\\":
+                skip_to = i + 2
+            elif c == '"':
+                in_string = False
+        elif depth == 0:
+            if c in "{[":
+                start, depth = i, 1
+        elif c == '"':
+            in_string = True
+        elif c in "{[":
+            depth += 1
+        elif c in "}]":
+            depth -= 1
+            if depth == 0:
+                try:
+                    parsed = json.loads(text[start:i + 1])
+                except ValueError:
+                    continue
+                calls.extend(as_tool_calls(parsed, tool_names))
+    return calls
+
+
+def parse_native_tool_calls(tool_calls: List[Dict[str, Any]], reasoning: str = "") -> List[Dict[str, Any]]:
+    """
+    Convert OpenRouter ``tool_calls`` into the agent's tool call dicts.
+
+    Args:
+        tool_calls: The ``tool_calls`` of an assistant message
+        reasoning: Text the model sent alongside the calls
+
+    Returns:
+        Dicts with "id", "tool", "parameters" and "reasoning"; arguments that
+        are not a JSON object are passed on as-is for validation to reject
+    """
+    calls = []
+    for call in tool_calls:
+        function = call.get("function") or {}
+        arguments = function.get("arguments") or "{}"
+        try:
+            parameters = json.loads(arguments) if isinstance(arguments, str) else arguments
+        except ValueError:
+            parameters = arguments
+        calls.append({
+            "id": call.get("id"),
+            "tool": function.get("name"),
+            "parameters": parameters,
+            "reasoning": reasoning
+        })
+    return calls
+
+
+class ToolCallAccumulator:
+    """Reassembles native ``tool_calls`` from the fragments of a streamed reply."""
+
+    def __init__(self, on_call_ready: Optional[Callable[[Dict[str, Any]], None]] = None):
+        """
+        Initialize the accumulator.
+
+        Args:
+            on_call_ready: Called with each parsed call as soon as its
+                arguments form a complete JSON object
+        """
+        self._calls: Dict[int, Dict[str, Any]] = {}
+        self.on_call_ready = on_call_ready
+        self._ready = set()
+
+    def feed(self, fragments: List[Dict[str, Any]]):
+        """Merge the ``delta.tool_calls`` fragments of one stream chunk."""
+        for fragment in fragments:
+            index = fragment.get("index", 0)
+            call = self._calls.setdefault(index, {
+                "id": None, "type": "function", "function": {"name": "", "arguments": ""}
+            })
+            if fragment.get("id"):
+                call["id"] = fragment["id"]
+            function = fragment.get("function") or {}
+            call["function"]["name"] += function.get("name") or ""
+            call["function"]["arguments"] += function.get("arguments") or ""
+            if self.on_call_ready is not None and index not in self._ready:
+                self._check_ready(index, call)
+
+    def _check_ready(self, index: int, call: Dict[str, Any]):
+        """Report a call once its name is in and its arguments parse as an object."""
+        if not call["function"]["name"] or not call["function"]["arguments"].rstrip().endswith("}"):
+            return
+        try:
+            arguments = json.loads(call["function"]["arguments"])
+        except ValueError:
+            return
+        if isinstance(arguments, dict):
+            self._ready.add(index)
+            self.on_call_ready(parse_native_tool_calls([call])[0])
+
+    @property
+    def tool_calls(self) -> List[Dict[str, Any]]:
+        """The completed ``tool_calls``, in index order."""
+        return [self._calls[index] for index in sorted(self._calls)]
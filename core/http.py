@@ -0,0 +1,354 @@
+"""
+Shared HTTP client for upstream API calls.
+Keeps TCP/TLS connections alive across agents and retries transient failures.
+"""
+
+import asyncio
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+if TYPE_CHECKING:
+    import requests
+
+
+# Upstream statuses that are worth retrying with backoff
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class PoolStats:
+    """Thread-safe counters describing connection reuse."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connection_hits = 0
+        self.connection_misses = 0
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_checkout(self, reused: bool):
+        with self._lock:
+            if reused:
+                self.connection_hits += 1
+            else:
+                self.connection_misses += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return a point-in-time copy of the counters."""
+        with self._lock:
+            checkouts = self.connection_hits + self.connection_misses
+            return {
+                "requests": self.requests,
+                "connection_hits": self.connection_hits,
+                "connection_misses": self.connection_misses,
+                "hit_ratio": self.connection_hits / checkouts if checkouts else 0.0
+            }
+
+
+def _counting_pool_class(base: type, stats: PoolStats) -> type:
+    """Build a urllib3 pool class that reports connection reuse to ``stats``."""
+
+    class CountingConnectionPool(base):
+        def _get_conn(self, timeout=None):
+            conn = super()._get_conn(timeout=timeout)
+            # A connection without a live socket has to handshake again
+            stats.record_checkout(reused=getattr(conn, "sock", None) is not None)
+            return conn
+
+    CountingConnectionPool.__name__ = f"Counting{base.__name__}"
+    return CountingConnectionPool
+
+
+def _counting_adapter(stats: PoolStats, **kwargs) -> Any:
+    """Build a requests HTTPAdapter whose connection pools feed ``stats``."""
+    from requests.adapters import HTTPAdapter
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    class CountingAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                "http": _counting_pool_class(HTTPConnectionPool, stats),
+                "https": _counting_pool_class(HTTPSConnectionPool, stats)
+            }
+
+    return CountingAdapter(**kwargs)
+
+
+class PooledHTTPClient:
+    """
+    Thread-safe HTTP client backed by keep-alive connection pools.
+
+    A single instance is meant to be shared by every agent in the process so
+    consecutive LLM calls reuse already established connections. requests
+    and urllib3 are imported when the first client is built, so processes
+    that never make a synchronous call (like the ASGI server) skip them.
+    """
+
+    def __init__(
+        self,
+        pool_connections: int = 10,
+        pool_maxsize: int = 20,
+        pool_block: bool = False,
+        max_retries: int = 3,
+        backoff_factor: float = 0.5,
+        timeout: Optional[float] = None,
+        retry_statuses: bool = True
+    ):
+        """
+        Initialize the HTTP client.
+
+        Args:
+            pool_connections: Number of per-host pools to keep cached
+            pool_maxsize: Maximum number of kept-alive connections per host
+            pool_block: Wait for a free connection instead of opening extra ones
+            max_retries: Retries for connection errors and 429/5xx responses
+            backoff_factor: Exponential backoff factor between retries (seconds)
+            timeout: Default request timeout in seconds (None waits indefinitely)
+            retry_statuses: Also retry 429/5xx responses (honouring Retry-After);
+                when False only connection errors are retried
+        """
+        import requests
+        from urllib3.util.retry import Retry
+
+        self.timeout = timeout
+        self.stats = PoolStats()
+
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUS_CODES if retry_statuses else (),
+            allowed_methods=None,  # LLM completions are POSTs, retry them too
+            respect_retry_after_header=retry_statuses,
+            raise_on_status=False
+        )
+        adapter = _counting_adapter(
+            self.stats,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+            max_retries=retry
+        )
+
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    @classmethod
+    def from_env(cls, retry_statuses: bool = True) -> "PooledHTTPClient":
+        """Create a client configured from HTTP_POOL_* environment variables."""
+        timeout = os.getenv("HTTP_POOL_TIMEOUT")
+        return cls(
+            pool_connections=int(os.getenv("HTTP_POOL_CONNECTIONS", 10)),
+            pool_maxsize=int(os.getenv("HTTP_POOL_MAXSIZE", 20)),
+            pool_block=os.getenv("HTTP_POOL_BLOCK", "false").lower() == "true",
+            max_retries=int(os.getenv("HTTP_POOL_MAX_RETRIES", 3)),
+            backoff_factor=float(os.getenv("HTTP_POOL_BACKOFF", 0.5)),
+            timeout=float(timeout) if timeout else None,
+            retry_statuses=retry_statuses
+        )
+
+    def request(self, method: str, url: str, **kwargs) -> "requests.Response":
+        """Send a request through the pooled session."""
+        kwargs.setdefault("timeout", self.timeout)
+        self.stats.record_request()
+        return self.session.request(method, url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> "requests.Response":
+        """Send a POST request through the pooled session."""
+        return self.request("POST", url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> "requests.Response":
+        """Send a GET request through the pooled session."""
+        return self.request("GET", url, **kwargs)
+
+    def preconnect(self, url: str) -> bool:
+        """
+        Open a connection to a URL's host and keep it in the pool.
+
+        Does the TCP and TLS handshakes ahead of the first request without
+        sending anything, so that request finds a live connection. Requests
+        sent through a proxy don't use it.
+
+        Args:
+            url: Any URL on the host to connect to
+
+        Returns:
+            Whether a new connection was opened (False if the pool already had one)
+
+        Raises:
+            OSError: If the host can't be resolved or reached
+        """
+        pool = self.session.get_adapter(url).poolmanager.connection_from_url(url)
+        conn = pool._get_conn()
+        try:
+            if getattr(conn, "sock", None) is not None:
+                return False
+            conn.connect()
+            return True
+        except BaseException:
+            conn.close()
+            raise
+        finally:
+            pool._put_conn(conn)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get connection reuse counters."""
+        return self.stats.snapshot()
+
+    def close(self):
+        """Close all pooled connections."""
+        self.session.close()
+
+
+_shared_client: Optional[PooledHTTPClient] = None
+_shared_client_lock = threading.Lock()
+
+
+def get_http_client() -> PooledHTTPClient:
+    """Get the process-wide shared HTTP client, creating it on first use."""
+    global _shared_client
+    if _shared_client is None:
+        with _shared_client_lock:
+            if _shared_client is None:
+                _shared_client = PooledHTTPClient.from_env()
+    return _shared_client
+
+
+def get_http_pool_stats() -> Optional[Dict[str, Any]]:
+    """Get the shared HTTP client's pool statistics, or None if it hasn't been built (never builds it)."""
+    client = _shared_client
+    return client.get_stats() if client is not None else None
+
+
+_routed_client: Optional[PooledHTTPClient] = None
+
+
+def get_routed_http_client() -> PooledHTTPClient:
+    """
+    Get the process-wide HTTP client for calls made through a model router.
+
+    It retries connection errors only: a 429 or 5xx comes straight back, so
+    the router's fallback and hedging decide what happens next instead of
+    the client waiting out Retry-After on the same model.
+    """
+    global _routed_client
+    if _routed_client is None:
+        with _shared_client_lock:
+            if _routed_client is None:
+                _routed_client = PooledHTTPClient.from_env(retry_statuses=False)
+    return _routed_client
+
+
+class AsyncPooledHTTPClient:
+    """
+    Asyncio HTTP client backed by an httpx connection pool.
+
+    Mirrors PooledHTTPClient for AsyncAIAgent: one instance is shared by every
+    async agent so in-flight LLM calls multiplex over kept-alive connections.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 1000,
+        max_keepalive_connections: int = 100,
+        max_retries: int = 3,
+        backoff_factor: float = 0.5,
+        timeout: Optional[float] = None
+    ):
+        """
+        Initialize the async HTTP client.
+
+        Args:
+            max_connections: Maximum number of concurrent connections
+            max_keepalive_connections: Maximum number of idle connections kept alive
+            max_retries: Retries for connection errors and 429/5xx responses
+            backoff_factor: Exponential backoff factor between retries (seconds)
+            timeout: Default request timeout in seconds (None waits indefinitely)
+        """
+        import httpx
+
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.stats = PoolStats()
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections
+            ),
+            transport=httpx.AsyncHTTPTransport(retries=max_retries),
+            timeout=timeout
+        )
+
+    @classmethod
+    def from_env(cls) -> "AsyncPooledHTTPClient":
+        """Create a client configured from HTTP_POOL_* environment variables."""
+        timeout = os.getenv("HTTP_POOL_TIMEOUT")
+        return cls(
+            max_connections=int(os.getenv("HTTP_POOL_ASYNC_MAX_CONNECTIONS", 1000)),
+            max_keepalive_connections=int(os.getenv("HTTP_POOL_MAXSIZE", 20)),
+            max_retries=int(os.getenv("HTTP_POOL_MAX_RETRIES", 3)),
+            backoff_factor=float(os.getenv("HTTP_POOL_BACKOFF", 0.5)),
+            timeout=float(timeout) if timeout else None
+        )
+
+    async def request(self, method: str, url: str, retry_statuses: bool = True, **kwargs):
+        """
+        Send a request, retrying 429/5xx responses with exponential backoff.
+
+        Pass ``retry_statuses=False`` to get those responses back at once,
+        for calls whose caller (like the model router) handles them.
+        """
+        self.stats.record_request()
+        attempt = 0
+        while True:
+            response = await self.client.request(method, url, **kwargs)
+            if (not retry_statuses or response.status_code not in RETRY_STATUS_CODES
+                    or attempt >= self.max_retries):
+                return response
+            retry_after = response.headers.get("Retry-After")
+            delay = self.backoff_factor * (2 ** attempt)
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            await response.aclose()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def post(self, url: str, **kwargs):
+        """Send a POST request through the pooled client."""
+        return await self.request("POST", url, **kwargs)
+
+    async def get(self, url: str, **kwargs):
+        """Send a GET request through the pooled client."""
+        return await self.request("GET", url, **kwargs)
+
+    def stream(self, method: str, url: str, **kwargs):
+        """Open a streamed request; use as ``async with client.stream(...) as response``."""
+        self.stats.record_request()
+        return self.client.stream(method, url, **kwargs)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get request counters."""
+        return self.stats.snapshot()
+
+    async def aclose(self):
+        """Close all pooled connections."""
+        await self.client.aclose()
+
+
+_shared_async_client: Optional[AsyncPooledHTTPClient] = None
+
+
+def get_async_http_client() -> AsyncPooledHTTPClient:
+    """
+    Get the shared async HTTP client, creating it on first use.
+
+    Must be called from the event loop that will use the client.
+    """
+    global _shared_async_client
+    if _shared_async_client is None:
+        _shared_async_client = AsyncPooledHTTPClient.from_env()
+    return _shared_async_client
@@ -0,0 +1,543 @@
+"""
+Background jobs for long-running tool calls.
+Tool calls that ask for more time than a configured threshold run on a
+bounded worker pool instead of inside the chat request; clients poll or
+stream the job, and the agent resumes the conversation when it finishes.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, List, Optional
+
+from core.metrics import JOB_EVENTS
+
+logger = logging.getLogger(__name__)
+
+Job = Dict[str, Any]
+
+# Statuses a job never leaves
+FINISHED_STATUSES = ("succeeded", "failed")
+
+# Seconds a stream waits for news before checking the job again
+STREAM_POLL_INTERVAL = 0.25
+
+
+class JobQueueFullError(RuntimeError):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+def is_finished(job: Job) -> bool:
+    """Whether a job is done, including the agent's follow-up reply when one is expected."""
+    return job["status"] in FINISHED_STATUSES and (not job["resume"] or job["follow_up"] is not None)
+
+
+class JobBroker:
+    """
+    Interface for where job records and output live.
+
+    Jobs always execute in the process that accepted them; the broker only
+    holds their state, so a shared broker lets any worker process answer
+    status and stream requests.
+    """
+
+    def create(self, job: Job):
+        """Store a new job record."""
+        raise NotImplementedError
+
+    def update(self, job_id: str, **fields: Any):
+        """Change fields of a job record."""
+        raise NotImplementedError
+
+    def append_output(self, job_id: str, stream: str, text: str):
+        """Append a chunk of output ("stdout" or "stderr")."""
+        raise NotImplementedError
+
+    def get(self, job_id: str, offset: int = 0) -> Optional[Job]:
+        """
+        Get a job with its output chunks from ``offset`` on.
+
+        Returns:
+            The job record with "output" (list of {"stream", "text"}) and
+            "next_offset", or None for an unknown job
+        """
+        raise NotImplementedError
+
+    def list(self, session_id: str) -> List[Job]:
+        """Get a session's job records (without output), oldest first."""
+        raise NotImplementedError
+
+    def wait(self, job_id: str, timeout: float):
+        """Block until the job may have changed, or ``timeout`` seconds pass."""
+        time.sleep(timeout)
+
+    def prune(self, finished_before: float):
+        """Delete jobs that finished before a timestamp."""
+        raise NotImplementedError
+
+
+class InMemoryJobBroker(JobBroker):
+    """Job records in this process's memory; waiters are woken on every change."""
+
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+        self._output: Dict[str, List[Dict[str, str]]] = {}
+        self._changed = threading.Condition()
+
+    def create(self, job: Job):
+        with self._changed:
+            self._jobs[job["id"]] = dict(job)
+            self._output[job["id"]] = []
+            self._changed.notify_all()
+
+    def update(self, job_id: str, **fields: Any):
+        with self._changed:
+            self._jobs[job_id].update(fields)
+            self._changed.notify_all()
+
+    def append_output(self, job_id: str, stream: str, text: str):
+        with self._changed:
+            self._output[job_id].append({"stream": stream, "text": text})
+            self._changed.notify_all()
+
+    def get(self, job_id: str, offset: int = 0) -> Optional[Job]:
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            output = self._output[job_id][offset:]
+            return dict(job, output=output, next_offset=offset + len(output))
+
+    def list(self, session_id: str) -> List[Job]:
+        with self._changed:
+            return [dict(job) for job in self._jobs.values() if job["session_id"] == session_id]
+
+    def wait(self, job_id: str, timeout: float):
+        with self._changed:
+            self._changed.wait(timeout)
+
+    def prune(self, finished_before: float):
+        with self._changed:
+            for job_id in [
+                job_id for job_id, job in self._jobs.items()
+                if job["finished_at"] is not None and job["finished_at"] < finished_before
+            ]:
+                del self._jobs[job_id]
+                del self._output[job_id]
+
+
+class SQLiteJobBroker(JobBroker):
+    """
+    Job records in a SQLite database in WAL mode, shared by every worker
+    process on the host. Each thread gets its own connection; streams poll.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize the broker.
+
+        Args:
+            path: Database file, created if it doesn't exist
+        """
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, "
+            "session_id TEXT NOT NULL, "
+            "record TEXT NOT NULL, "
+            "finished_at REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_session ON jobs (session_id)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_output ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "job_id TEXT NOT NULL, "
+            "stream TEXT NOT NULL, "
+            "text TEXT NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS job_output_job ON job_output (job_id, id)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def create(self, job: Job):
+        self._conn().execute(
+            "INSERT INTO jobs (id, session_id, record, finished_at) VALUES (?, ?, ?, ?)",
+            (job["id"], job["session_id"], json.dumps(job), job["finished_at"])
+        )
+
+    def update(self, job_id: str, **fields: Any):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT record FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is not None:
+                job = dict(json.loads(row[0]), **fields)
+                conn.execute(
+                    "UPDATE jobs SET record = ?, finished_at = ? WHERE id = ?",
+                    (json.dumps(job), job["finished_at"], job_id)
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def append_output(self, job_id: str, stream: str, text: str):
+        self._conn().execute(
+            "INSERT INTO job_output (job_id, stream, text) VALUES (?, ?, ?)", (job_id, stream, text)
+        )
+
+    def get(self, job_id: str, offset: int = 0) -> Optional[Job]:
+        conn = self._conn()
+        row = conn.execute("SELECT record FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        output = [
+            {"stream": stream, "text": text}
+            for stream, text in conn.execute(
+                "SELECT stream, text FROM job_output WHERE job_id = ? ORDER BY id LIMIT -1 OFFSET ?",
+                (job_id, offset)
+            )
+        ]
+        return dict(json.loads(row[0]), output=output, next_offset=offset + len(output))
+
+    def list(self, session_id: str) -> List[Job]:
+        rows = self._conn().execute(
+            "SELECT record FROM jobs WHERE session_id = ? ORDER BY rowid", (session_id,)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def wait(self, job_id: str, timeout: float):
+        time.sleep(min(timeout, STREAM_POLL_INTERVAL))
+
+    def prune(self, finished_before: float):
+        conn = self._conn()
+        conn.execute(
+            "DELETE FROM job_output WHERE job_id IN (SELECT id FROM jobs WHERE finished_at < ?)",
+            (finished_before,)
+        )
+        conn.execute("DELETE FROM jobs WHERE finished_at < ?", (finished_before,))
+
+
+def create_job_broker(kind: str, path: Optional[str] = None) -> JobBroker:
+    """
+    Create a job broker.
+
+    Args:
+        kind: "memory" or "sqlite"
+        path: Database file (sqlite)
+    """
+    if kind == "memory":
+        return InMemoryJobBroker()
+    if kind == "sqlite":
+        return SQLiteJobBroker(path or "jobs.db")
+    raise ValueError(f"Unknown job broker '{kind}', expected 'memory' or 'sqlite'")
+
+
+class JobManager:
+    """
+    Runs long tool calls in the background with bounded concurrency.
+
+    A call is backgrounded when its ``timeout`` parameter exceeds
+    ``threshold`` seconds. At most ``max_workers`` jobs run at once in the
+    process and at most ``max_per_session`` per session; the rest wait in
+    FIFO order, up to ``max_queued``.
+    """
+
+    def __init__(
+        self,
+        broker: Optional[JobBroker] = None,
+        threshold: float = 30,
+        max_workers: int = 4,
+        max_per_session: int = 2,
+        max_queued: int = 100,
+        max_output_bytes: int = 1024 * 1024,
+        retention: float = 3600
+    ):
+        """
+        Initialize the manager.
+
+        Args:
+            broker: Where job state lives (defaults to in-process memory)
+            threshold: Requested tool timeout, in seconds, above which a call becomes a job
+            max_workers: Jobs running at once in this process
+            max_per_session: Jobs running at once per session
+            max_queued: Jobs allowed to wait for a free slot
+            max_output_bytes: Output kept per job for polling and streaming
+            retention: Seconds finished jobs stay queryable
+        """
+        self.broker = broker or InMemoryJobBroker()
+        self.threshold = threshold
+        self.max_workers = max_workers
+        self.max_per_session = max_per_session
+        self.max_queued = max_queued
+        self.max_output_bytes = max_output_bytes
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent-job")
+        self._lock = threading.Lock()
+        self._pending: Deque[Job] = deque()
+        self._running: Dict[str, int] = {}
+        self._stats = {"submitted": 0, "rejected": 0, "succeeded": 0, "failed": 0}
+
+    @classmethod
+    def from_env(cls) -> Optional["JobManager"]:
+        """
+        Create a manager configured from JOB_* environment variables.
+
+        Returns:
+            The manager, or None unless JOBS_ENABLED is true
+        """
+        if os.getenv("JOBS_ENABLED", "false").lower() != "true":
+            return None
+        return cls(
+            broker=create_job_broker(os.getenv("JOB_BROKER", "memory").lower(), os.getenv("JOB_BROKER_PATH") or None),
+            threshold=float(os.getenv("JOB_THRESHOLD_SECONDS", 30)),
+            max_workers=int(os.getenv("JOB_MAX_WORKERS", 4)),
+            max_per_session=int(os.getenv("JOB_MAX_PER_SESSION", 2)),
+            max_queued=int(os.getenv("JOB_MAX_QUEUED", 100)),
+            max_output_bytes=int(os.getenv("JOB_MAX_OUTPUT_BYTES", 1024 * 1024)),
+            retention=float(os.getenv("JOB_RETENTION_SECONDS", 3600))
+        )
+
+    def should_background(self, parameters: Dict[str, Any]) -> bool:
+        """Whether a tool call asks for more time than the threshold."""
+        timeout = parameters.get("timeout")
+        return isinstance(timeout, (int, float)) and not isinstance(timeout, bool) and timeout > self.threshold
+
+    def submit(
+        self,
+        session_id: str,
+        tool: str,
+        parameters: Dict[str, Any],
+        run: Callable[[Callable[[str, str], None]], Any],
+        on_complete: Optional[Callable[[Job], None]] = None
+    ) -> Job:
+        """
+        Queue a tool call as a job.
+
+        Args:
+            session_id: Session the call belongs to
+            tool: Tool name
+            parameters: Tool parameters
+            run: Runs the tool; receives a callback taking ("stdout" or "stderr", text)
+            on_complete: Called with the finished job from the worker thread; its
+                return value becomes the job's ``follow_up``
+
+        Returns:
+            The new job record
+
+        Raises:
+            JobQueueFullError: If ``max_queued`` jobs are already waiting
+        """
+        now = time.time()
+        self.broker.prune(now - self.retention)
+        job = {
+            "id": uuid.uuid4().hex,
+            "session_id": session_id,
+            "tool": tool,
+            "parameters": parameters,
+            "status": "queued",
+            "result": None,
+            "resume": on_complete is not None,
+            "follow_up": None,
+            "output_bytes": 0,
+            "output_truncated": False,
+            "created_at": now,
+            "started_at": None,
+            "finished_at": None
+        }
+        with self._lock:
+            if len(self._pending) >= self.max_queued:
+                self._stats["rejected"] += 1
+                JOB_EVENTS.labels(tool, "rejected").inc()
+                raise JobQueueFullError(f"Too many background jobs queued ({self.max_queued})")
+            self.broker.create(job)
+            self._pending.append(dict(job, run=run, on_complete=on_complete))
+            self._stats["submitted"] += 1
+            JOB_EVENTS.labels(tool, "submitted").inc()
+            self._dispatch()
+        return job
+
+    def _dispatch(self):
+        """Start queued jobs whose session and the pool have a free slot; the caller must hold the lock."""
+        running = sum(self._running.values())
+        blocked: Deque[Job] = deque()
+        while self._pending and running < self.max_workers:
+            job = self._pending.popleft()
+            if self._running.get(job["session_id"], 0) >= self.max_per_session:
+                blocked.append(job)
+                continue
+            self._running[job["session_id"]] = self._running.get(job["session_id"], 0) + 1
+            running += 1
+            self._executor.submit(self._execute, job)
+        blocked.extend(self._pending)
+        self._pending = blocked
+
+    def _execute(self, job: Job):
+        job_id = job["id"]
+        written = 0
+        truncated = False
+
+        def on_output(stream: str, text: str):
+            nonlocal written, truncated
+            if truncated:
+                return
+            size = len(text.encode("utf-8"))
+            if written + size > self.max_output_bytes:
+                truncated = True
+                self.broker.update(job_id, output_truncated=True)
+                return
+            written += size
+            self.broker.append_output(job_id, stream, text)
+
+        status = "failed"
+        finished: Optional[Job] = None
+        try:
+            self.broker.update(job_id, status="running", started_at=time.time())
+            try:
+                result = job["run"](on_output)
+                if not isinstance(result, dict) or result.get("success", True):
+                    status = "succeeded"
+            except Exception as e:
+                result = {"success": False, "error": str(e)}
+            finished = {key: value for key, value in job.items() if key not in ("run", "on_complete")}
+            finished.update(status=status, result=result, output_bytes=written, finished_at=time.time())
+            self.broker.update(
+                job_id, status=status, result=result, output_bytes=written, finished_at=finished["finished_at"]
+            )
+        except Exception as e:
+            # The broker couldn't record the job's progress; make sure it doesn't stay "running"
+            logger.error(f"Could not record job {job_id}: {e}")
+            status = "failed"
+            result = {"success": False, "error": f"Could not record the job's result: {e}"}
+            if finished is not None:
+                finished.update(status=status, result=result)
+            try:
+                self.broker.update(job_id, status=status, result=result, finished_at=time.time())
+            except Exception as e:
+                logger.error(f"Could not mark job {job_id} failed: {e}")
+        finally:
+            JOB_EVENTS.labels(job["tool"], status).inc()
+            with self._lock:
+                self._stats[status] += 1
+                self._running[job["session_id"]] -= 1
+                if not self._running[job["session_id"]]:
+                    del self._running[job["session_id"]]
+                self._dispatch()
+        if job["on_complete"] is not None and finished is not None:
+            try:
+                follow_up = job["on_complete"](finished)
+            except Exception as e:
+                follow_up = {"error": str(e)}
+            self.broker.update(job_id, follow_up=follow_up if follow_up is not None else {})
+
+    def get(self, job_id: str, offset: int = 0) -> Optional[Job]:
+        """Get a job with its output from chunk ``offset`` on, or None if unknown."""
+        return self.broker.get(job_id, offset)
+
+    def list(self, session_id: str) -> List[Job]:
+        """Get a session's jobs, oldest first."""
+        return self.broker.list(session_id)
+
+    def stream(self, job_id: str, offset: int = 0, timeout: float = 3600) -> Iterator[Dict[str, Any]]:
+        """
+        Follow a job until it finishes.
+
+        Yields:
+            Event dicts: "status" on every status change, "output" per output
+            chunk, then "done" with the final job record (or "error" for an
+            unknown job or when ``timeout`` seconds pass)
+        """
+        deadline = time.monotonic() + timeout
+        status = None
+        while True:
+            job = self.broker.get(job_id, offset)
+            if job is None:
+                yield {"event": "error", "data": {"error": f"Unknown job '{job_id}'"}}
+                return
+            events, offset, status = self._events(job, status)
+            yield from events
+            if is_finished(job):
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                yield {"event": "error", "data": {"error": "Timed out waiting for the job"}}
+                return
+            self.broker.wait(job_id, min(remaining, 1.0))
+
+    async def astream(self, job_id: str, offset: int = 0, timeout: float = 3600) -> AsyncIterator[Dict[str, Any]]:
+        """Awaitable ``stream``, polling the broker without blocking the event loop."""
+        deadline = time.monotonic() + timeout
+        status = None
+        while True:
+            job = self.broker.get(job_id, offset)
+            if job is None:
+                yield {"event": "error", "data": {"error": f"Unknown job '{job_id}'"}}
+                return
+            events, offset, status = self._events(job, status)
+            for event in events:
+                yield event
+            if is_finished(job):
+                return
+            if time.monotonic() >= deadline:
+                yield {"event": "error", "data": {"error": "Timed out waiting for the job"}}
+                return
+            await asyncio.sleep(STREAM_POLL_INTERVAL)
+
+    @staticmethod
+    def _events(job: Job, status: Optional[str]):
+        """Events for what changed in a job since the last look; returns (events, next offset, status)."""
+        events = []
+        if job["status"] != status:
+            events.append({"event": "status", "data": {"id": job["id"], "status": job["status"]}})
+        events.extend({"event": "output", "data": chunk} for chunk in job["output"])
+        if is_finished(job):
+            events.append({"event": "done", "data": {
+                key: value for key, value in job.items() if key not in ("output", "next_offset")
+            }})
+        return events, job["next_offset"], job["status"]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(
+                self._stats,
+                running=sum(self._running.values()),
+                queued=len(self._pending),
+                max_workers=self.max_workers,
+                max_per_session=self.max_per_session
+            )
+
+
+_job_manager: Optional[JobManager] = None
+_job_manager_loaded = False
+_job_manager_lock = threading.Lock()
+
+
+def get_job_manager() -> Optional[JobManager]:
+    """
+    Get the process-wide job manager.
+
+    Returns None unless JOBS_ENABLED is true.
+    """
+    global _job_manager, _job_manager_loaded
+    if not _job_manager_loaded:
+        with _job_manager_lock:
+            if not _job_manager_loaded:
+                _job_manager = JobManager.from_env()
+                _job_manager_loaded = True
+    return _job_manager
@@ -0,0 +1,149 @@
+"""
+Compact chat messages and JSON encoding.
+Histories hold one Message per turn, a read-only mapping with __slots__
+instead of a dict, and are encoded with orjson when it is installed.
+"""
+
+import json
+import sys
+from collections.abc import Mapping, Sequence
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+try:
+    import orjson
+except ImportError:  # Optional; the standard library encoder is used instead
+    orjson = None
+
+
+class Message(Mapping):
+    """
+    One chat message: a role, its content and any protocol fields.
+
+    Behaves as a read-only mapping, so code written against message dicts
+    (``message["role"]``, ``message.get("tool_calls")``) works unchanged,
+    but costs a fraction of a dict's memory. Roles are interned, so every
+    message of a role shares one string. Messages are never modified in
+    place, which lets history views share them without copying.
+    """
+
+    __slots__ = ("role", "content", "fields")
+
+    def __init__(self, role: str, content: Any, fields: Optional[Dict[str, Any]] = None):
+        """
+        Initialize the message.
+
+        Args:
+            role: "system", "user", "assistant" or "tool"
+            content: Message text (or content parts)
+            fields: Extra protocol fields such as ``tool_calls`` or ``tool_call_id``
+        """
+        self.role = sys.intern(role)
+        self.content = content
+        self.fields = fields or None
+
+    @classmethod
+    def from_dict(cls, message: Mapping) -> "Message":
+        """Convert a message dict, such as one decoded from JSON; Messages are returned as they are."""
+        if isinstance(message, Message):
+            return message
+        fields = {key: value for key, value in message.items() if key != "role" and key != "content"}
+        return cls(message["role"], message.get("content"), fields)
+
+    def to_dict(self) -> Dict[str, Any]:
+        message = {"role": self.role, "content": self.content}
+        if self.fields:
+            message.update(self.fields)
+        return message
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "role":
+            return self.role
+        if key == "content":
+            return self.content
+        if self.fields is not None and key in self.fields:
+            return self.fields[key]
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key == "role":
+            return self.role
+        if key == "content":
+            return self.content
+        return self.fields.get(key, default) if self.fields is not None else default
+
+    def __iter__(self) -> Iterator[str]:
+        yield "role"
+        yield "content"
+        if self.fields is not None:
+            yield from self.fields
+
+    def __len__(self) -> int:
+        return 2 + (len(self.fields) if self.fields is not None else 0)
+
+    def __repr__(self) -> str:
+        return f"Message({self.to_dict()!r})"
+
+    def __getstate__(self):
+        return self.role, self.content, self.fields
+
+    def __setstate__(self, state):
+        role, self.content, self.fields = state
+        self.role = sys.intern(role)
+
+
+class HistoryView(Sequence):
+    """
+    Read-only view of a conversation history that doesn't copy it.
+
+    Reflects the list it wraps; slicing returns a list of the selected
+    messages only.
+    """
+
+    __slots__ = ("_messages",)
+
+    def __init__(self, messages: List[Mapping]):
+        self._messages = messages
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        return self._messages[index]
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __iter__(self) -> Iterator[Mapping]:
+        return iter(self._messages)
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, HistoryView):
+            other = other._messages
+        return isinstance(other, (list, tuple)) and list(self._messages) == list(other)
+
+    def __repr__(self) -> str:
+        return f"HistoryView({self._messages!r})"
+
+
+def json_default(value: Any) -> Any:
+    """Encode the types the JSON encoders don't know: messages and history views."""
+    if isinstance(value, Message):
+        return value.to_dict()
+    if isinstance(value, HistoryView):
+        return list(value)
+    if isinstance(value, Mapping):
+        return dict(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode_json(value: Any) -> bytes:
+    """
+    Encode a value as compact UTF-8 JSON, with orjson when it is installed.
+
+    Messages and history views are encoded as plain objects and lists.
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=json_default)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=json_default).encode("utf-8")
+
+
+def compact_json(value: Any) -> str:
+    """Encode a value as compact JSON text (no indentation or padding) for storing in a message."""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=json_default)
@@ -0,0 +1,266 @@
+"""
+Lightweight in-process metrics for the AI Agent.
+Latency histograms and counters with Prometheus text exposition, cheap
+enough to record on every request.
+"""
+
+import math
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Tuple
+
+# Latency bucket upper bounds in seconds, from sub-millisecond tool calls to slow LLM turns
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0
+)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [
+        '{}="{}"'.format(name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Fixed-bucket latency histogram with approximate quantiles."""
+
+    __slots__ = ("bounds", "counts", "count", "sum", "_lock")
+
+    def __init__(self, bounds: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimate a quantile by interpolating inside its bucket.
+
+        Returns:
+            The estimate in the observed unit, or None with no observations
+        """
+        with self._lock:
+            counts = list(self.counts)
+            count = self.count
+        if not count:
+            return None
+        rank = q * count
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                if index == len(self.bounds):
+                    return self.bounds[-1]  # Beyond the last bound, report the bound
+                lower = self.bounds[index - 1] if index else 0.0
+                upper = self.bounds[index]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.bounds[-1]
+
+
+class Counter:
+    """Monotonic counter."""
+
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+class MetricFamily:
+    """A named metric with one child per combination of label values."""
+
+    def __init__(self, name: str, help_text: str, kind: str, label_names: Tuple[str, ...],
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.label_names = label_names
+        self.buckets = buckets
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str) -> Any:
+        """Get the child for these label values, creating it on first use."""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = Histogram(self.buckets) if self.kind == "histogram" else Counter()
+                    self._children[values] = child
+        return child
+
+    def render(self) -> List[str]:
+        """Render the family in the Prometheus text format."""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self._sorted_children():
+            if self.kind == "counter":
+                lines.append(f"{self.name}{_format_labels(self.label_names, values)} {_format_value(child.value)}")
+                continue
+            with child._lock:
+                counts = list(child.counts)
+                total, count = child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, values, le)} {cumulative}")
+            labels = _format_labels(self.label_names, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Summarize every child: counter values, or histogram count and quantiles."""
+        series = []
+        for values, child in self._sorted_children():
+            entry: Dict[str, Any] = {"labels": dict(zip(self.label_names, values))}
+            if self.kind == "counter":
+                entry["value"] = child.value
+            else:
+                entry["count"] = child.count
+                entry["sum"] = child.sum
+                for q in QUANTILES:
+                    entry[f"p{int(q * 100)}"] = child.quantile(q)
+            series.append(entry)
+        return series
+
+    def _sorted_children(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        with self._lock:
+            return sorted(self._children.items())
+
+
+class MetricsRegistry:
+    """Holds metric families and renders them together."""
+
+    def __init__(self):
+        self._families: Dict[str, MetricFamily] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, help_text: str, label_names: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> MetricFamily:
+        return self._register(MetricFamily(name, help_text, "histogram", label_names, buckets))
+
+    def counter(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()) -> MetricFamily:
+        return self._register(MetricFamily(name, help_text, "counter", label_names))
+
+    def render_prometheus(self) -> str:
+        """Render every family in the Prometheus text exposition format (0.0.4)."""
+        lines = []
+        with self._lock:
+            families = list(self._families.values())
+        for family in families:
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Summarize every family, with p50/p95/p99 for histograms."""
+        with self._lock:
+            families = list(self._families.values())
+        return {family.name: family.snapshot() for family in families}
+
+    def _register(self, family: MetricFamily) -> MetricFamily:
+        with self._lock:
+            existing = self._families.get(family.name)
+            if existing is not None:
+                return existing
+            self._families[family.name] = family
+            return family
+
+
+class span:
+    """
+    Time a block of code into a histogram child.
+
+    Usage:
+        with span(TOOL_SECONDS.labels("run_shell")):
+            ...
+    """
+
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self) -> "span":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+# Process-wide registry exposed on /metrics
+METRICS = MetricsRegistry()
+
+LLM_SECONDS = METRICS.histogram(
+    "agent_llm_seconds", "Latency of each LLM round trip by model and tool-loop step", ("model", "step")
+)
+PHASE_SECONDS = METRICS.histogram(
+    "agent_phase_seconds", "Latency of agent phases outside the LLM call", ("phase", "model")
+)
+TOOL_SECONDS = METRICS.histogram(
+    "agent_tool_seconds", "Latency of each tool invocation", ("tool",)
+)
+HTTP_SECONDS = METRICS.histogram(
+    "http_request_seconds", "Latency of API requests by route", ("method", "route", "status")
+)
+LLM_TOKENS = METRICS.counter(
+    "llm_tokens_total", "Tokens reported in OpenRouter usage by model and direction", ("model", "direction")
+)
+LLM_ROUTER_EVENTS = METRICS.counter(
+    "llm_router_events_total", "Model router calls served, failed, hedged and fallen back by model", ("model", "event")
+)
+COMPLETION_CACHE_EVENTS = METRICS.counter(
+    "llm_completion_cache_total", "Completion cache lookups by outcome", ("outcome",)
+)
+JOB_EVENTS = METRICS.counter(
+    "agent_jobs_total", "Background tool jobs submitted, rejected, succeeded and failed by tool", ("tool", "outcome")
+)
+SPECULATIVE_TOOLS = METRICS.counter(
+    "agent_speculative_tools_total", "Read-only tool calls started early, then used or discarded, by tool",
+    ("tool", "outcome")
+)
+RATE_LIMITED = METRICS.counter(
+    "http_rate_limited_total", "Requests refused by a rate limit, by the scope whose budget was exhausted", ("scope",)
+)
+AGENT_ERRORS = METRICS.counter(
+    "agent_errors_total", "Messages that failed with an error", ("model",)
+)
+
+
+def record_usage(model: str, usage: Optional[Dict[str, Any]]):
+    """Count the prompt and completion tokens of an OpenRouter ``usage`` object."""
+    if not usage:
+        return
+    LLM_TOKENS.labels(model, "in").inc(usage.get("prompt_tokens") or 0)
+    LLM_TOKENS.labels(model, "out").inc(usage.get("completion_tokens") or 0)
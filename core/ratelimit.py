@@ -0,0 +1,450 @@
+"""
+Rate limiting and request serialization.
+Token buckets that admit work at a sustained rate with bounded bursts, keyed
+per session, per client IP and globally (in memory or in SQLite shared by
+every worker process), and a fair lock that serves waiters in arrival order.
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+from core.metrics import RATE_LIMITED
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+
+    Holds up to ``burst`` tokens and refills at ``rate`` tokens per second;
+    every check is O(1).
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        """
+        Initialize the bucket, full.
+
+        Args:
+            rate: Tokens added per second
+            burst: Maximum tokens held (defaults to one second's worth, at least 1)
+        """
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        """Add the tokens earned since the last update; the caller must hold the lock."""
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """
+        Take tokens if the bucket has them.
+
+        Returns:
+            0 if the tokens were taken, otherwise the seconds until they will be available
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def acquire(self, tokens: float = 1):
+        """Block until the tokens can be taken."""
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: float = 1):
+        """Wait without blocking the event loop until the tokens can be taken."""
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+class FairLock:
+    """
+    Reentrant lock granted in arrival order.
+
+    ``threading.RLock`` lets any waiter win when it is released, so a busy
+    session could starve one of its requests; here each release hands the
+    lock straight to the longest waiter.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._owner: Optional[int] = None
+        self._depth = 0
+        self._waiters: Deque[Tuple[int, threading.Event]] = deque()
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """
+        Take the lock, queueing behind earlier waiters.
+
+        Args:
+            blocking: Wait for the lock; if False, return at once when it is held
+
+        Returns:
+            Whether the lock was taken
+        """
+        me = threading.get_ident()
+        with self._lock:
+            if self._owner == me:
+                self._depth += 1
+                return True
+            if self._owner is None:
+                self._owner, self._depth = me, 1
+                return True
+            if not blocking:
+                return False
+            granted = threading.Event()
+            self._waiters.append((me, granted))
+        granted.wait()
+        return True
+
+    def release(self):
+        with self._lock:
+            if self._owner != threading.get_ident():
+                raise RuntimeError("Cannot release a lock held by another thread")
+            self._depth -= 1
+            if self._depth:
+                return
+            if self._waiters:
+                self._owner, granted = self._waiters.popleft()
+                self._depth = 1
+                granted.set()
+            else:
+                self._owner = None
+
+    @property
+    def waiting(self) -> int:
+        """Number of threads queued for the lock."""
+        return len(self._waiters)
+
+    def __enter__(self) -> "FairLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+# (bucket key, refill per second, capacity, cost)
+Charge = Tuple[str, float, float, float]
+
+
+def _refilled(tokens: float, updated: float, rate: float, capacity: float, now: float) -> float:
+    return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+
+def _settle(balances: List[float], charges: Sequence[Charge]) -> Tuple[float, int]:
+    """
+    Check that every bucket can pay its charge.
+
+    A bucket pays when its balance covers the cost; a zero cost just requires
+    the bucket not to be in debt.
+
+    Returns:
+        (0, -1) if all can pay, otherwise (seconds until the first that can't
+        will be able to, its index)
+    """
+    for index, (balance, (_, rate, _, cost)) in enumerate(zip(balances, charges)):
+        if balance < cost:
+            return ((cost - balance) / rate if rate > 0 else float("inf")), index
+    return 0.0, -1
+
+
+class BucketStore:
+    """
+    Interface for token bucket state.
+
+    Implementations must apply ``take`` atomically across all its buckets.
+    """
+
+    def take(self, charges: Sequence[Charge]) -> Tuple[float, int]:
+        """
+        Deduct every charge if every bucket can pay it, otherwise deduct nothing.
+
+        Returns:
+            (0, -1) if taken, otherwise (seconds to wait, index of the bucket that can't pay)
+        """
+        raise NotImplementedError
+
+    def charge(self, charges: Sequence[Charge]):
+        """Deduct every charge unconditionally; buckets may go into debt."""
+        raise NotImplementedError
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get store statistics."""
+        raise NotImplementedError
+
+
+class InMemoryBucketStore(BucketStore):
+    """
+    Process-local bucket state.
+
+    Buckets are kept in least-recently-used order and the oldest is dropped
+    past ``max_keys`` (it comes back full), so memory stays bounded however
+    many sessions and clients are seen.
+    """
+
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        # key -> [tokens, updated]
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    def _balances(self, charges: Sequence[Charge], now: float) -> List[List[float]]:
+        """Refill and return the charged buckets; the caller must hold the lock."""
+        entries = []
+        for key, rate, capacity, _ in charges:
+            entry = self._buckets.get(key)
+            if entry is None:
+                entry = self._buckets[key] = [capacity, now]
+            else:
+                self._buckets.move_to_end(key)
+                entry[0] = _refilled(entry[0], entry[1], rate, capacity, now)
+                entry[1] = now
+            entries.append(entry)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return entries
+
+    def take(self, charges: Sequence[Charge]) -> Tuple[float, int]:
+        with self._lock:
+            entries = self._balances(charges, time.monotonic())
+            wait, index = _settle([entry[0] for entry in entries], charges)
+            if index < 0:
+                for entry, charge in zip(entries, charges):
+                    entry[0] -= charge[3]
+            return wait, index
+
+    def charge(self, charges: Sequence[Charge]):
+        with self._lock:
+            for entry, charge in zip(self._balances(charges, time.monotonic()), charges):
+                entry[0] -= charge[3]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"backend": "memory", "buckets": len(self._buckets), "max_buckets": self.max_keys}
+
+
+class SQLiteBucketStore(BucketStore):
+    """
+    Bucket state in a SQLite database shared by every worker process.
+
+    Each ``take`` runs in one write transaction, so limits hold across the
+    prefork launcher's workers. Buckets idle for ``idle_ttl`` seconds are
+    pruned; by then they have refilled.
+    """
+
+    def __init__(self, path: str = "ratelimit.db", idle_ttl: float = 3600):
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self._local = threading.local()
+        self._pruned = time.time()
+        self._connect().executescript(
+            "PRAGMA journal_mode=WAL;"
+            "CREATE TABLE IF NOT EXISTS rate_buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL);"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        """Get this thread's connection, opening it on first use."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _apply(self, charges: Sequence[Charge], conditional: bool) -> Tuple[float, int]:
+        connection = self._connect()
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            balances = []
+            for key, rate, capacity, _ in charges:
+                row = connection.execute("SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+                balances.append(capacity if row is None else _refilled(row[0], row[1], rate, capacity, now))
+            wait, index = _settle(balances, charges) if conditional else (0.0, -1)
+            if index < 0:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO rate_buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                    [(charge[0], balance - charge[3], now) for balance, charge in zip(balances, charges)]
+                )
+            if now - self._pruned > self.idle_ttl:
+                connection.execute("DELETE FROM rate_buckets WHERE updated < ?", (now - self.idle_ttl,))
+                self._pruned = now
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return wait, index
+
+    def take(self, charges: Sequence[Charge]) -> Tuple[float, int]:
+        return self._apply(charges, conditional=True)
+
+    def charge(self, charges: Sequence[Charge]):
+        self._apply(charges, conditional=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        count = self._connect().execute("SELECT COUNT(*) FROM rate_buckets").fetchone()[0]
+        return {"backend": "sqlite", "buckets": count}
+
+
+def create_bucket_store(kind: str = "memory", path: str = "ratelimit.db") -> BucketStore:
+    """
+    Create a bucket store by name.
+
+    Args:
+        kind: "memory" for process-local limits or "sqlite" for limits shared by every worker
+        path: Database file for the SQLite store
+    """
+    if kind == "memory":
+        return InMemoryBucketStore(int(os.getenv("RATE_LIMIT_MAX_KEYS", 10000)))
+    if kind == "sqlite":
+        return SQLiteBucketStore(path)
+    raise ValueError(f"Unknown rate limit store '{kind}', expected 'memory' or 'sqlite'")
+
+
+SCOPES = ("session", "ip", "global")
+UNITS = ("requests", "tokens")
+
+
+class RateLimiter:
+    """
+    Request and upstream-token budgets per session, per client IP and globally.
+
+    Each budget is a token bucket holding one minute's allowance. A request
+    is admitted only if every request bucket has room for it and no token
+    bucket is in debt; the upstream tokens it used are charged afterwards,
+    so a costly request delays the ones after it.
+    """
+
+    def __init__(self, limits: Dict[Tuple[str, str], float], store: Optional[BucketStore] = None):
+        """
+        Initialize the limiter.
+
+        Args:
+            limits: Allowance per minute by (scope, unit), e.g. {("ip", "requests"): 60};
+                scopes are "session", "ip" and "global", units "requests" and "tokens"
+            store: Where bucket state lives (defaults to process memory)
+        """
+        for scope, unit in limits:
+            if scope not in SCOPES or unit not in UNITS:
+                raise ValueError(f"Unknown rate limit '{scope}' {unit}")
+        self.limits = {key: per_minute for key, per_minute in limits.items() if per_minute > 0}
+        self.store = store or InMemoryBucketStore()
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self._limited = {scope: 0 for scope in SCOPES}
+
+    @classmethod
+    def from_env(cls) -> Optional["RateLimiter"]:
+        """
+        Create a limiter configured from RATE_LIMIT_* environment variables.
+
+        Returns:
+            The limiter, or None if no limit is set
+        """
+        suffixes = {"requests": "RPM", "tokens": "TPM"}
+        limits = {
+            (scope, unit): float(os.getenv(f"RATE_LIMIT_{scope.upper()}_{suffixes[unit]}", 0))
+            for scope in SCOPES for unit in UNITS
+        }
+        if not any(per_minute > 0 for per_minute in limits.values()):
+            return None
+        store = create_bucket_store(
+            os.getenv("RATE_LIMIT_STORE", "memory").lower(),
+            os.getenv("RATE_LIMIT_STORE_PATH", "ratelimit.db")
+        )
+        return cls(limits, store)
+
+    def _charges(self, unit: str, session_id: Optional[str], client_ip: Optional[str],
+                 cost: float) -> Tuple[List[Charge], List[str]]:
+        """Build the charges of ``unit`` for the limited scopes a request falls under."""
+        ids = {"session": session_id, "ip": client_ip, "global": ""}
+        charges, scopes = [], []
+        for scope in SCOPES:
+            per_minute = self.limits.get((scope, unit))
+            if per_minute is None or ids[scope] is None:
+                continue
+            charges.append((f"{scope}:{unit}:{ids[scope]}", per_minute / 60, per_minute, cost))
+            scopes.append(scope)
+        return charges, scopes
+
+    def check(self, session_id: Optional[str], client_ip: Optional[str]) -> Tuple[float, Optional[str]]:
+        """
+        Admit one request, charging it to every request budget it falls under.
+
+        Args:
+            session_id: The request's session (None to skip the session budgets)
+            client_ip: The client's address (None to skip the IP budgets)
+
+        Returns:
+            (0, None) if admitted, otherwise (seconds until it could be, the
+            scope whose budget is exhausted); a refused request is not charged
+        """
+        requests, request_scopes = self._charges("requests", session_id, client_ip, 1)
+        tokens, token_scopes = self._charges("tokens", session_id, client_ip, 0)
+        if not requests and not tokens:
+            return 0.0, None
+        wait, index = self.store.take(requests + tokens)
+        with self._lock:
+            if index < 0:
+                self._admitted += 1
+                return 0.0, None
+            scope = (request_scopes + token_scopes)[index]
+            self._limited[scope] += 1
+        RATE_LIMITED.labels(scope).inc()
+        return wait, scope
+
+    def charge_tokens(self, session_id: Optional[str], client_ip: Optional[str], tokens: float):
+        """Charge the upstream tokens an admitted request used to its token budgets."""
+        charges, _ = self._charges("tokens", session_id, client_ip, tokens)
+        if charges and tokens > 0:
+            self.store.charge(charges)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {
+                "limits_per_minute": {f"{scope}_{unit}": value for (scope, unit), value in self.limits.items()},
+                "admitted": self._admitted,
+                "limited": dict(self._limited)
+            }
+        stats["store"] = self.store.get_stats()
+        return stats
+
+
+_rate_limiter: Optional[RateLimiter] = None
+_rate_limiter_loaded = False
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    """
+    Get the process-wide rate limiter.
+
+    Returns:
+        The limiter configured by the RATE_LIMIT_* environment variables, or
+        None if no limit is set
+    """
+    global _rate_limiter, _rate_limiter_loaded
+    if not _rate_limiter_loaded:
+        with _rate_limiter_lock:
+            if not _rate_limiter_loaded:
+                _rate_limiter = RateLimiter.from_env()
+                _rate_limiter_loaded = True
+    return _rate_limiter
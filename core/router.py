@@ -0,0 +1,398 @@
+"""
+Latency-aware model routing.
+Tracks rolling latency and error rates per model endpoint, sends each call
+to the fastest healthy one, hedges slow calls with a second endpoint and
+falls back on rate limits and server errors.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from core.http import RETRY_STATUS_CODES
+from core.metrics import LLM_ROUTER_EVENTS
+
+
+class ModelEndpoint(NamedTuple):
+    """A model served by one chat completions URL."""
+
+    model: str
+    base_url: str
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether another endpoint may succeed where this error occurred (429/5xx, connection errors, timeouts)."""
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status in RETRY_STATUS_CODES
+    # requests' errors are OSErrors; httpx's transport errors are not
+    return isinstance(error, (OSError, TimeoutError)) or any(
+        cls.__name__ == "TransportError" for cls in type(error).__mro__
+    )
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    response = getattr(error, "response", None)
+    value = response.headers.get("Retry-After") if response is not None else None
+    return float(value) if value and value.isdigit() else None
+
+
+class EndpointHealth:
+    """Rolling latency and outcome window of one endpoint."""
+
+    def __init__(self, endpoint: ModelEndpoint, window: int):
+        self.endpoint = endpoint
+        self.latencies: deque = deque(maxlen=window)
+        self.outcomes: deque = deque(maxlen=window)
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record_success(self, latency: Optional[float]):
+        with self._lock:
+            self.requests += 1
+            self.outcomes.append(True)
+            if latency is not None:
+                self.latencies.append(latency)
+
+    def record_failure(self, error_threshold: float, min_samples: int, cooldown: float,
+                       retry_after: Optional[float] = None):
+        """
+        Count a failed call. Starts a cooldown of ``retry_after`` seconds when
+        given, or of ``cooldown`` seconds once at least ``min_samples`` outcomes
+        show an error rate of ``error_threshold`` or more.
+        """
+        with self._lock:
+            self.requests += 1
+            self.errors += 1
+            self.outcomes.append(False)
+            if retry_after is None and len(self.outcomes) >= min_samples and \
+                    self.outcomes.count(False) / len(self.outcomes) >= error_threshold:
+                retry_after = cooldown
+            if retry_after is not None:
+                self.cooldown_until = max(self.cooldown_until, time.monotonic() + retry_after)
+                self.outcomes.clear()  # Start afresh once the cooldown ends
+
+    def cooling_down(self, now: float) -> bool:
+        return now < self.cooldown_until
+
+    def error_rate(self) -> float:
+        with self._lock:
+            return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def quantile(self, q: float, min_samples: int = 1) -> Optional[float]:
+        """Latency quantile over the window, or None with fewer than ``min_samples`` observations."""
+        with self._lock:
+            latencies = sorted(self.latencies)
+        if len(latencies) < max(1, min_samples):
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+
+class ModelRouter:
+    """
+    Routes chat completion calls across a pool of model endpoints.
+
+    Endpoints are ranked by their median latency over the last ``window``
+    calls; endpoints without data rank first so each gets measured, and ties
+    keep the configured order. An endpoint that answers 429, or whose error
+    rate over the window reaches ``error_threshold``, sits out for
+    ``cooldown`` seconds (or the Retry-After it was sent). A call that fails
+    with a retryable error moves on to the next endpoint. Once the chosen
+    endpoint has ``min_samples`` latencies, a call still running after its
+    p95 is hedged: the same request goes to the next endpoint and whichever
+    answers first is used.
+    """
+
+    def __init__(
+        self,
+        endpoints: List[ModelEndpoint],
+        window: int = 100,
+        min_samples: int = 20,
+        hedge: bool = True,
+        hedge_quantile: float = 0.95,
+        error_threshold: float = 0.5,
+        cooldown: float = 30,
+        max_workers: int = 64
+    ):
+        """
+        Initialize the router.
+
+        Args:
+            endpoints: Model endpoints in order of preference
+            window: Calls per endpoint kept for latency and error statistics
+            min_samples: Latencies needed before an endpoint's calls are hedged,
+                and outcomes needed before its error rate can trigger a cooldown
+            hedge: Send a second request when the first is slower than its p95
+            hedge_quantile: Latency quantile after which a call is hedged
+            error_threshold: Error rate over the window that triggers a cooldown
+            cooldown: Seconds an unhealthy endpoint is skipped
+            max_workers: Threads running hedged calls
+        """
+        if not endpoints:
+            raise ValueError("ModelRouter needs at least one endpoint")
+        self.endpoints = [EndpointHealth(endpoint, window) for endpoint in endpoints]
+        self.min_samples = min_samples
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.served: Dict[ModelEndpoint, int] = {endpoint: 0 for endpoint in endpoints}
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0
+
+    @classmethod
+    def from_env(cls, default_base_url: str) -> Optional["ModelRouter"]:
+        """
+        Create a router from MODEL_POOL and MODEL_ROUTER_* environment variables.
+
+        MODEL_POOL is a comma-separated list of models, each optionally
+        followed by ``@<chat completions URL>`` (defaults to
+        ``default_base_url``). Returns None when MODEL_POOL is unset.
+        """
+        pool = [entry.strip() for entry in os.getenv("MODEL_POOL", "").split(",") if entry.strip()]
+        if not pool:
+            return None
+        endpoints = []
+        for entry in pool:
+            model, _, base_url = entry.partition("@")
+            endpoints.append(ModelEndpoint(model, base_url or default_base_url))
+        return cls(
+            endpoints,
+            window=int(os.getenv("MODEL_ROUTER_WINDOW", 100)),
+            min_samples=int(os.getenv("MODEL_ROUTER_MIN_SAMPLES", 20)),
+            hedge=os.getenv("MODEL_ROUTER_HEDGE", "true").lower() == "true",
+            error_threshold=float(os.getenv("MODEL_ROUTER_ERROR_THRESHOLD", 0.5)),
+            cooldown=float(os.getenv("MODEL_ROUTER_COOLDOWN", 30))
+        )
+
+    def ranked(self) -> List[EndpointHealth]:
+        """Endpoints in the order they would be tried: healthy first, then by median latency."""
+        now = time.monotonic()
+        scored = []
+        for index, health in enumerate(self.endpoints):
+            median = health.quantile(0.5)
+            scored.append((health.cooling_down(now), median or 0.0, index, health))
+        return [entry[-1] for entry in sorted(scored, key=lambda entry: entry[:3])]
+
+    def _hedge_delay(self, health: EndpointHealth, remaining: List[EndpointHealth]) -> Optional[float]:
+        if not self.hedge or not remaining:
+            return None
+        return health.quantile(self.hedge_quantile, self.min_samples)
+
+    def _record_failure(self, health: EndpointHealth, error: BaseException):
+        status = getattr(getattr(error, "response", None), "status_code", None)
+        retry_after = (_retry_after(error) or self.cooldown) if status == 429 else None
+        health.record_failure(self.error_threshold, self.min_samples, self.cooldown, retry_after)
+        LLM_ROUTER_EVENTS.labels(health.endpoint.model, "error").inc()
+
+    def _attempt(self, health: EndpointHealth, send: Callable[[ModelEndpoint], Any], record_latency: bool) -> Any:
+        started = time.perf_counter()
+        try:
+            result = send(health.endpoint)
+        except Exception as e:
+            self._record_failure(health, e)
+            raise
+        health.record_success(time.perf_counter() - started if record_latency else None)
+        return result
+
+    def _served(self, health: EndpointHealth, hedged: bool):
+        with self._stats_lock:
+            self.served[health.endpoint] += 1
+            if hedged:
+                self.hedge_wins += 1
+        LLM_ROUTER_EVENTS.labels(health.endpoint.model, "served").inc()
+
+    def _count(self, event: str, health: EndpointHealth):
+        with self._stats_lock:
+            if event == "hedge":
+                self.hedges += 1
+            else:
+                self.fallbacks += 1
+        LLM_ROUTER_EVENTS.labels(health.endpoint.model, event).inc()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="model-hedge")
+        return self._executor
+
+    def call(self, send: Callable[[ModelEndpoint], Any], hedge: bool = True,
+             record_latency: bool = True) -> Tuple[Any, ModelEndpoint]:
+        """
+        Run ``send`` against the best endpoint, hedging and falling back as needed.
+
+        Args:
+            send: Performs the request for an endpoint and returns its result,
+                raising (e.g. ``raise_for_status``) on failure
+            hedge: Allow a hedged second request (disable for streams)
+            record_latency: Count the call's duration in the latency window
+
+        Returns:
+            Tuple of (result, endpoint that produced it)
+        """
+        candidates = self.ranked()
+        tried = set()
+        last_error: Optional[BaseException] = None
+        for position, health in enumerate(candidates):
+            if health in tried:
+                continue  # Already answered as a hedge
+            if tried:
+                self._count("fallback", health)
+            tried.add(health)
+            remaining = [other for other in candidates[position + 1:] if other not in tried]
+            delay = self._hedge_delay(health, remaining) if hedge else None
+            try:
+                if delay is None:
+                    result = self._attempt(health, send, record_latency)
+                    self._served(health, False)
+                    return result, health.endpoint
+                return self._hedged_call(health, remaining[0], send, delay, record_latency, tried)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                last_error = e
+        raise last_error
+
+    def _hedged_call(self, primary: EndpointHealth, backup: EndpointHealth, send: Callable[[ModelEndpoint], Any],
+                     delay: float, record_latency: bool, tried: set) -> Tuple[Any, ModelEndpoint]:
+        executor = self._get_executor()
+        pending = {executor.submit(self._attempt, primary, send, record_latency): (primary, False)}
+        done, _ = wait(pending, timeout=delay)
+        if not done:
+            self._count("hedge", backup)
+            tried.add(backup)
+            pending[executor.submit(self._attempt, backup, send, record_latency)] = (backup, True)
+        error: Optional[BaseException] = None
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                health, hedged = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                self._served(health, hedged)
+                return result, health.endpoint  # A slower duplicate finishes in the background
+        raise error
+
+    async def acall(self, send: Callable[[ModelEndpoint], Awaitable[Any]], hedge: bool = True,
+                    record_latency: bool = True) -> Tuple[Any, ModelEndpoint]:
+        """Awaitable ``call``: ``send`` is a coroutine function, and the slower of two hedged requests is cancelled."""
+        candidates = self.ranked()
+        tried = set()
+        last_error: Optional[BaseException] = None
+        for position, health in enumerate(candidates):
+            if health in tried:
+                continue
+            if tried:
+                self._count("fallback", health)
+            tried.add(health)
+            remaining = [other for other in candidates[position + 1:] if other not in tried]
+            delay = self._hedge_delay(health, remaining) if hedge else None
+            try:
+                if delay is None:
+                    result = await self._attempt_async(health, send, record_latency)
+                    self._served(health, False)
+                    return result, health.endpoint
+                return await self._hedged_call_async(health, remaining[0], send, delay, record_latency, tried)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                last_error = e
+        raise last_error
+
+    async def _attempt_async(self, health: EndpointHealth, send: Callable[[ModelEndpoint], Awaitable[Any]],
+                             record_latency: bool) -> Any:
+        started = time.perf_counter()
+        try:
+            result = await send(health.endpoint)
+        except Exception as e:
+            self._record_failure(health, e)
+            raise
+        health.record_success(time.perf_counter() - started if record_latency else None)
+        return result
+
+    async def _hedged_call_async(self, primary: EndpointHealth, backup: EndpointHealth,
+                                 send: Callable[[ModelEndpoint], Awaitable[Any]], delay: float,
+                                 record_latency: bool, tried: set) -> Tuple[Any, ModelEndpoint]:
+        pending = {asyncio.ensure_future(self._attempt_async(primary, send, record_latency)): (primary, False)}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                self._count("hedge", backup)
+                tried.add(backup)
+                pending[asyncio.ensure_future(self._attempt_async(backup, send, record_latency))] = (backup, True)
+            error: Optional[BaseException] = None
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    health, hedged = pending.pop(task)
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    self._served(health, hedged)
+                    return task.result(), health.endpoint
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get per-endpoint latency, error and traffic statistics plus hedge and fallback counts."""
+        now = time.monotonic()
+        endpoints = []
+        for health in self.endpoints:
+            p50, p95 = health.quantile(0.5), health.quantile(0.95)
+            endpoints.append({
+                "model": health.endpoint.model,
+                "base_url": health.endpoint.base_url,
+                "requests": health.requests,
+                "errors": health.errors,
+                "served": self.served[health.endpoint],
+                "error_rate": round(health.error_rate(), 3),
+                "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+                "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                "cooling_down": health.cooling_down(now)
+            })
+        return {
+            "endpoints": endpoints,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "fallbacks": self.fallbacks
+        }
+
+
+_model_router: Optional[ModelRouter] = None
+_model_router_loaded = False
+_model_router_lock = threading.Lock()
+
+
+def get_model_router() -> Optional[ModelRouter]:
+    """
+    Get the process-wide model router configured by MODEL_POOL.
+
+    Returns None when no pool is configured (the default), in which case
+    agents call their own model directly.
+    """
+    global _model_router, _model_router_loaded
+    if not _model_router_loaded:
+        with _model_router_lock:
+            if not _model_router_loaded:
+                _model_router = ModelRouter.from_env(
+                    os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1/chat/completions")
+                )
+                _model_router_loaded = True
+    return _model_router
@@ -0,0 +1,288 @@
+"""
+Response cache for web searches.
+Keeps recent search results in memory (and optionally on disk) and coalesces
+concurrent identical queries into a single upstream request.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+CacheKey = Tuple[str, int]
+
+# Disk writes between prunes of expired and surplus rows
+DISK_PRUNE_INTERVAL = 64
+
+
+def normalize_query(query: str, num_results: int) -> CacheKey:
+    """Build the cache key for a search: case- and whitespace-insensitive query, result count."""
+    return " ".join(query.lower().split()), int(num_results)
+
+
+class _InFlight:
+    """A search being fetched by one thread while others wait for it."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+
+
+class SearchCache:
+    """
+    TTL + LRU cache for search results with single-flight fetching.
+
+    Only successful results are cached. When ``path`` is set, entries are
+    also written to a SQLite file so they survive restarts and can be shared
+    by several server processes; expired rows, and the oldest rows beyond
+    ``max_disk_entries``, are pruned on open and every
+    ``DISK_PRUNE_INTERVAL`` writes.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300, path: Optional[str] = None,
+                 max_disk_entries: int = 10000):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Maximum number of results kept in memory
+            ttl: Seconds a result stays fresh
+            path: Optional SQLite file for the disk layer
+            max_disk_entries: Maximum number of results kept on disk
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self._lock = threading.Lock()
+        # key -> (expires_at wall-clock time, result)
+        self._entries: "OrderedDict[CacheKey, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._inflight: Dict[CacheKey, _InFlight] = {}
+        self._async_inflight: Dict[CacheKey, asyncio.Future] = {}
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "disk_hits": 0, "evictions": 0, "disk_pruned": 0}
+        self._db: Optional[sqlite3.Connection] = None
+        self._disk_writes = 0
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS search_cache "
+                "(key TEXT PRIMARY KEY, expires_at REAL NOT NULL, result TEXT NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS search_cache_expires_at ON search_cache (expires_at)")
+            self.prune()
+
+    @classmethod
+    def from_env(cls) -> Optional["SearchCache"]:
+        """
+        Create a cache configured from SEARCH_CACHE_* environment variables.
+
+        Returns:
+            The cache, or None when SEARCH_CACHE_TTL is 0
+        """
+        ttl = float(os.getenv("SEARCH_CACHE_TTL", 300))
+        if ttl <= 0:
+            return None
+        return cls(
+            max_entries=int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", 1024)),
+            ttl=ttl,
+            path=os.getenv("SEARCH_CACHE_PATH") or None,
+            max_disk_entries=int(os.getenv("SEARCH_CACHE_MAX_DISK_ENTRIES", 10000))
+        )
+
+    def get_or_fetch(
+        self,
+        query: str,
+        num_results: int,
+        fetch: Callable[[str, int], Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """
+        Get a search result from the cache, fetching it on a miss.
+
+        Concurrent callers asking for the same key wait for the first
+        caller's fetch instead of issuing their own; a failed result they
+        share is returned uncached.
+
+        Args:
+            query: The search query
+            num_results: Number of results requested
+            fetch: Function performing the upstream search
+
+        Returns:
+            The search result dict with a ``cached`` flag
+        """
+        key = normalize_query(query, num_results)
+        result = self.get(key)
+        if result is not None:
+            return self._answer(result, query, cached=True)
+
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _InFlight()
+                self._stats["misses"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.result is None:  # The leader's fetch raised
+                return self._answer(fetch(query, num_results), query, cached=False)
+            return self._answer(flight.result, query, cached=bool(flight.result.get("success")))
+
+        try:
+            flight.result = fetch(query, num_results)
+            self.put(key, flight.result)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.done.set()
+        return self._answer(flight.result, query, cached=False)
+
+    async def aget_or_fetch(
+        self,
+        query: str,
+        num_results: int,
+        fetch: Callable[[str, int], Awaitable[Dict[str, Any]]]
+    ) -> Dict[str, Any]:
+        """Async counterpart of ``get_or_fetch`` for coroutines on one event loop."""
+        key = normalize_query(query, num_results)
+        result = self.get(key)
+        if result is not None:
+            return self._answer(result, query, cached=True)
+
+        future = self._async_inflight.get(key)
+        if future is not None:
+            with self._lock:
+                self._stats["coalesced"] += 1
+            result = await asyncio.shield(future)
+            if result is None:  # The leader's fetch raised or was cancelled
+                return self._answer(await fetch(query, num_results), query, cached=False)
+            return self._answer(result, query, cached=bool(result.get("success")))
+
+        future = self._async_inflight[key] = asyncio.get_running_loop().create_future()
+        with self._lock:
+            self._stats["misses"] += 1
+        result = None
+        try:
+            result = await fetch(query, num_results)
+            self.put(key, result)
+        finally:
+            del self._async_inflight[key]
+            future.set_result(result)  # None sends followers to fetch for themselves
+        return self._answer(result, query, cached=False)
+
+    def get(self, key: CacheKey) -> Optional[Dict[str, Any]]:
+        """Look up a fresh result in memory, then on disk."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return entry[1]
+                del self._entries[key]
+
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT expires_at, result FROM search_cache WHERE key = ?", (json.dumps(key),)
+            ).fetchone()
+            if row is None or row[0] <= now:
+                return None
+            result = json.loads(row[1])
+            self._remember(key, row[0], result)
+            self._stats["hits"] += 1
+            self._stats["disk_hits"] += 1
+            return result
+
+    def put(self, key: CacheKey, result: Dict[str, Any]):
+        """Store a successful result; failures are never cached."""
+        if not result.get("success"):
+            return
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, result)
+            if self._db is None:
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO search_cache (key, expires_at, result) VALUES (?, ?, ?)",
+                (json.dumps(key), expires_at, json.dumps(result))
+            )
+            self._disk_writes += 1
+            if self._disk_writes % DISK_PRUNE_INTERVAL:
+                return
+        self.prune()
+
+    def prune(self) -> int:
+        """
+        Delete expired rows from the disk layer, then the soonest-expiring rows beyond ``max_disk_entries``.
+
+        Returns:
+            Number of rows deleted
+        """
+        if self._db is None:
+            return 0
+        with self._lock:
+            deleted = self._db.execute("DELETE FROM search_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+            deleted += self._db.execute(
+                "DELETE FROM search_cache WHERE key IN "
+                "(SELECT key FROM search_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_disk_entries,)
+            ).rowcount
+            self._stats["disk_pruned"] += deleted
+            return deleted
+
+    def clear(self):
+        """Drop every cached result, in memory and on disk."""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM search_cache")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), max_entries=self.max_entries)
+
+    def _remember(self, key: CacheKey, expires_at: float, result: Dict[str, Any]):
+        """Insert into the memory layer; the caller must hold the lock."""
+        self._entries[key] = (expires_at, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    @staticmethod
+    def _answer(result: Dict[str, Any], query: str, cached: bool) -> Dict[str, Any]:
+        """Copy a shared result for one caller."""
+        answer = dict(result, cached=cached)
+        if "query" in answer:
+            answer["query"] = query
+        return answer
+
+
+_search_cache: Optional[SearchCache] = None
+_search_cache_loaded = False
+_search_cache_lock = threading.Lock()
+
+
+def get_search_cache() -> Optional[SearchCache]:
+    """
+    Get the process-wide search cache.
+
+    Returns None when caching is disabled (SEARCH_CACHE_TTL=0).
+    """
+    global _search_cache, _search_cache_loaded
+    if not _search_cache_loaded:
+        with _search_cache_lock:
+            if not _search_cache_loaded:
+                _search_cache = SearchCache.from_env()
+                _search_cache_loaded = True
+    return _search_cache
@@ -0,0 +1,337 @@
+"""
+Session stores for per-conversation agents.
+Bounds how many agents a server process keeps alive and how much memory
+their conversation histories may hold.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from core.shell_pool import get_shell_pool
+
+
+def estimate_message_bytes(message: Dict[str, Any]) -> int:
+    """Approximate the memory held by one message dict and its values."""
+    return sys.getsizeof(message) + sum(sys.getsizeof(value) for value in message.values())
+
+
+def estimate_history_bytes(history: List[Dict[str, Any]]) -> int:
+    """
+    Approximate the memory held by a conversation history.
+
+    Args:
+        history: List of message dicts
+
+    Returns:
+        Approximate size in bytes of the list, its dicts and their values
+    """
+    return sys.getsizeof(history) + sum(estimate_message_bytes(message) for message in history)
+
+
+class SessionStore:
+    """
+    Interface for storing one agent per session ID.
+
+    Implementations decide how many sessions to keep and for how long.
+    """
+
+    def get(self, session_id: str) -> Optional[Any]:
+        """Get the agent for a session, or None if it doesn't exist."""
+        raise NotImplementedError
+
+    def get_or_create(self, session_id: str, factory: Callable[[], Any]) -> Any:
+        """Get the agent for a session, creating it with ``factory`` if needed."""
+        raise NotImplementedError
+
+    def remove(self, session_id: str) -> bool:
+        """Drop a session. Returns True if it existed."""
+        raise NotImplementedError
+
+    def record_usage(self, session_id: str):
+        """Update the accounting for a session after it has processed a message."""
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get store statistics."""
+        raise NotImplementedError
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Process-local session store with LRU and idle-TTL eviction.
+
+    Sessions are kept in least-recently-used order. Creating a session beyond
+    ``max_sessions`` evicts the least recently used one, a background sweeper
+    drops sessions idle for longer than ``ttl``, and histories growing past
+    ``max_session_bytes`` lose their oldest messages, trimmed under the
+    agent's turn lock. Dropped sessions release their pooled shell worker.
+    The lock only guards dict bookkeeping and is never held while an agent
+    is processing.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        ttl: Optional[float] = 3600,
+        max_session_bytes: Optional[int] = 1024 * 1024,
+        sweep_interval: float = 60
+    ):
+        """
+        Initialize the session store.
+
+        Args:
+            max_sessions: Maximum number of live sessions
+            ttl: Seconds a session may stay idle before eviction (None keeps it forever)
+            max_session_bytes: Approximate byte budget per session history (None for no limit)
+            sweep_interval: Seconds between background TTL sweeps
+        """
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_session_bytes = max_session_bytes
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        # session_id -> [agent, last_access, approximate bytes]
+        self._sessions: "OrderedDict[str, List[Any]]" = OrderedDict()
+        # session_id -> set once the agent being built for it is stored
+        self._building: Dict[str, threading.Event] = {}
+        self._bytes = 0
+        self._evictions = {"lru": 0, "ttl": 0}
+        self._trimmed_messages = 0
+        self._sweeper: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls) -> "InMemorySessionStore":
+        """Create a store configured from SESSION_* environment variables."""
+        ttl = float(os.getenv("SESSION_TTL_SECONDS", 3600))
+        max_bytes = int(os.getenv("SESSION_MAX_BYTES", 1024 * 1024))
+        return cls(
+            max_sessions=int(os.getenv("SESSION_MAX_COUNT", 1000)),
+            ttl=ttl if ttl > 0 else None,
+            max_session_bytes=max_bytes if max_bytes > 0 else None,
+            sweep_interval=float(os.getenv("SESSION_SWEEP_INTERVAL", 60))
+        )
+
+    def get(self, session_id: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            if not self._expired(entry, time.monotonic()):
+                entry[1] = time.monotonic()
+                self._sessions.move_to_end(session_id)
+                return entry[0]
+            self._evict(session_id, "ttl")
+        _release_shell(session_id)
+        return None
+
+    def get_or_create(self, session_id: str, factory: Callable[[], Any]) -> Any:
+        while True:
+            agent = self.get(session_id)
+            if agent is not None:
+                return agent
+            with self._lock:
+                if session_id in self._sessions:
+                    continue
+                building = self._building.get(session_id)
+                if building is None:
+                    # Reserve the session, so concurrent requests wait for this agent instead of building their own
+                    building = self._building[session_id] = threading.Event()
+                    break
+            building.wait()  # Then look again; if the build failed, one waiter takes over
+
+        # Build the agent outside the lock, it may be slow
+        evicted = []
+        try:
+            agent = factory()
+            with self._lock:
+                self._sessions[session_id] = [agent, time.monotonic(), 0]
+                while len(self._sessions) > self.max_sessions:
+                    oldest = next(iter(self._sessions))
+                    self._evict(oldest, "lru")
+                    evicted.append(oldest)
+        finally:
+            with self._lock:
+                del self._building[session_id]
+            building.set()
+        for oldest in evicted:
+            _release_shell(oldest)
+        return agent
+
+    def remove(self, session_id: str) -> bool:
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry is None:
+                return False
+            self._bytes -= entry[2]
+        _release_shell(session_id)
+        return True
+
+    def record_usage(self, session_id: str):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+        if entry is None:
+            return
+
+        # Skip a session with a turn in progress, that turn's own call trims it
+        agent = entry[0]
+        async_lock = getattr(agent, "_async_turn_lock", None)
+        if async_lock is not None and async_lock.locked():
+            return
+        turn_lock = getattr(agent, "_turn_lock", None)
+        if turn_lock is not None and not turn_lock.acquire(blocking=False):
+            return
+        try:
+            history = agent.conversation_history
+            size = estimate_history_bytes(history)
+            trimmed = 0
+            if self.max_session_bytes is not None and size > self.max_session_bytes:
+                # Drop the oldest messages, always keeping the latest one
+                while size > self.max_session_bytes and trimmed < len(history) - 1:
+                    size -= estimate_message_bytes(history[trimmed])
+                    trimmed += 1
+                del history[:trimmed]
+        finally:
+            if turn_lock is not None:
+                turn_lock.release()
+
+        with self._lock:
+            self._trimmed_messages += trimmed
+            if self._sessions.get(session_id) is entry:
+                self._bytes += size - entry[2]
+                entry[2] = size
+
+    def sweep(self) -> int:
+        """
+        Evict every session idle for longer than the TTL.
+
+        Returns:
+            Number of sessions evicted
+        """
+        if self.ttl is None:
+            return 0
+        evicted = []
+        now = time.monotonic()
+        with self._lock:
+            # Sessions are in LRU order, so expired ones are at the front
+            while self._sessions:
+                session_id, entry = next(iter(self._sessions.items()))
+                if not self._expired(entry, now):
+                    break
+                self._evict(session_id, "ttl")
+                evicted.append(session_id)
+        for session_id in evicted:
+            _release_shell(session_id)
+        return len(evicted)
+
+    def start_sweeper(self):
+        """Start the background TTL sweeper thread if it isn't running."""
+        if self.ttl is None or (self._sweeper and self._sweeper.is_alive()):
+            return
+
+        def run():
+            while True:
+                time.sleep(self.sweep_interval)
+                self.sweep()
+
+        self._sweeper = threading.Thread(target=run, name="session-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "live_sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "evictions": dict(self._evictions),
+                "trimmed_messages": self._trimmed_messages,
+                "approx_bytes": self._bytes
+            }
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _expired(self, entry: List[Any], now: float) -> bool:
+        return self.ttl is not None and now - entry[1] > self.ttl
+
+    def _evict(self, session_id: str, reason: str):
+        """Drop a session; the caller must hold the lock, and release its shell worker after."""
+        entry = self._sessions.pop(session_id)
+        self._bytes -= entry[2]
+        self._evictions[reason] += 1
+
+
+def _release_shell(session_id: str):
+    """Close a dropped session's pooled shell worker, if the pool is enabled."""
+    pool = get_shell_pool()
+    if pool is not None:
+        pool.release(session_id)
+
+
+class AgentPool:
+    """
+    Agents built ahead of time for the first sessions of a process.
+
+    ``fill`` builds up to ``size`` agents, normally from the startup warmup,
+    and ``take`` hands one to a new session by giving it the session's ID.
+    The pool isn't refilled: once it is empty, agents are built on demand,
+    which is cheap once the process is warm.
+    """
+
+    def __init__(self, factory: Callable[[], Any], size: int = 4):
+        """
+        Initialize the pool.
+
+        Args:
+            factory: Builds an agent not yet bound to a session
+            size: Agents to build ahead of time
+        """
+        self.factory = factory
+        self.size = size
+        self._lock = threading.Lock()
+        self._ready: List[Any] = []
+        self._filled = False
+        self._stats = {"built_ahead": 0, "handed_out": 0, "built_on_demand": 0}
+
+    @classmethod
+    def from_env(cls, factory: Callable[[], Any]) -> "AgentPool":
+        """Create a pool sized by the AGENT_POOL_SIZE environment variable."""
+        return cls(factory, size=int(os.getenv("AGENT_POOL_SIZE", 4)))
+
+    def fill(self) -> int:
+        """
+        Build the pool's agents, once.
+
+        Returns:
+            Number of agents built
+        """
+        with self._lock:
+            if self._filled:
+                return 0
+            self._filled = True
+        built = 0
+        for _ in range(self.size):
+            agent = self.factory()
+            with self._lock:
+                self._ready.append(agent)
+                self._stats["built_ahead"] += 1
+            built += 1
+        return built
+
+    def take(self, session_id: str) -> Any:
+        """Get an agent for a new session, prebuilt if one is left."""
+        with self._lock:
+            agent = self._ready.pop() if self._ready else None
+            self._stats["handed_out" if agent is not None else "built_on_demand"] += 1
+        if agent is None:
+            agent = self.factory()
+        agent.session_id = session_id
+        return agent
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, size=self.size, ready=len(self._ready))
@@ -0,0 +1,355 @@
+"""
+Persistent shell workers for run_shell.
+Each session gets a long-lived /bin/sh that keeps its working directory and
+environment between commands, avoiding a process spawn per call.
+"""
+
+import os
+import selectors
+import shlex
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from core.tools import SHELL_MAX_OUTPUT_BYTES, OutputBuffer, _READ_CHUNK_SIZE, _shell_result
+
+
+class _SentinelStream:
+    """Collects one command's output from a worker pipe until its sentinel."""
+
+    def __init__(self, buffer: OutputBuffer, token: bytes, needs_status: bool):
+        self.buffer = buffer
+        self.token = token
+        self.needs_status = needs_status
+        self.pending = b""
+        self.after: Optional[bytes] = None  # Bytes following the sentinel
+        self.done = False
+        self.eof = False
+
+    def feed(self, data: bytes):
+        if self.after is not None:
+            self.after += data
+        else:
+            self.pending += data
+            index = self.pending.find(self.token)
+            if index < 0:
+                # Keep enough bytes to spot a sentinel split across reads
+                keep = len(self.token) - 1
+                self.buffer.write(self.pending[:-keep])
+                self.pending = self.pending[-keep:]
+                return
+            self.buffer.write(self.pending[:index])
+            self.after = self.pending[index + len(self.token):]
+            self.pending = b""
+        self.done = not self.needs_status or b"\n" in self.after
+
+    def status(self) -> Optional[int]:
+        """Exit status printed after the sentinel, if any."""
+        if not self.after:
+            return None
+        try:
+            return int(self.after.split(b"\n", 1)[0].lstrip(b":"))
+        except ValueError:
+            return None
+
+
+class ShellWorker:
+    """A long-lived shell that runs one command at a time over its pipes."""
+
+    def __init__(self, shell: str = "/bin/sh"):
+        self.process = subprocess.Popen(
+            [shell],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True
+        )
+        self.commands_run = 0
+        self.last_used = time.monotonic()
+        self.busy = False
+
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+    def run(self, command: str, timeout: float = 30, max_output_bytes: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Run a command in this shell.
+
+        The command is evaluated in the shell itself (so ``cd`` and ``export``
+        persist), with stdin detached, and is followed by a random sentinel on
+        both output streams that marks where its output ends.
+
+        Returns:
+            The run_shell result dict
+        """
+        max_output_bytes = max_output_bytes or SHELL_MAX_OUTPUT_BYTES
+        token = f"__agent_done_{uuid.uuid4().hex}__"
+        script = (
+            f"{{ eval {shlex.quote(command)}\n}} </dev/null; __agent_rc=$?; "
+            f"printf '%s:%d\\n' '{token}' \"$__agent_rc\"; printf '%s\\n' '{token}' >&2\n"
+        )
+        stdout = _SentinelStream(OutputBuffer(max_output_bytes), token.encode(), needs_status=True)
+        stderr = _SentinelStream(OutputBuffer(max_output_bytes), token.encode(), needs_status=False)
+        self.commands_run += 1
+
+        try:
+            self.process.stdin.write(script.encode())
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            self.kill()
+            return _shell_result(-1, error=f"Shell worker unavailable: {e}")
+
+        deadline = time.monotonic() + timeout
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.process.stdout, selectors.EVENT_READ, stdout)
+            selector.register(self.process.stderr, selectors.EVENT_READ, stderr)
+            while not (stdout.done and stderr.done):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.kill()
+                    return _shell_result(
+                        -1, stdout.buffer.getvalue(), f"Command timed out after {timeout} seconds"
+                    )
+                for key, _ in selector.select(remaining):
+                    stream = key.data
+                    data = os.read(key.fd, _READ_CHUNK_SIZE)
+                    if data:
+                        stream.feed(data)
+                        if stream.done:
+                            selector.unregister(key.fileobj)
+                    else:
+                        stream.eof = True
+                        selector.unregister(key.fileobj)
+                if stdout.eof or stderr.eof:
+                    # The command exited the shell itself
+                    stdout.buffer.write(stdout.pending)
+                    stderr.buffer.write(stderr.pending)
+                    returncode = self.process.wait()
+                    return _shell_result(returncode, stdout.buffer.getvalue(), stderr.buffer.getvalue())
+
+        returncode = stdout.status()
+        return _shell_result(
+            returncode if returncode is not None else -1,
+            stdout.buffer.getvalue(),
+            stderr.buffer.getvalue()
+        )
+
+    def ping(self, timeout: float = 2) -> bool:
+        """Check that the shell still answers commands."""
+        return self.is_alive() and self.run(":", timeout=timeout)["returncode"] == 0
+
+    def kill(self):
+        """Kill the shell and everything it started."""
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        self.process.wait()
+        for pipe in (self.process.stdin, self.process.stdout, self.process.stderr):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+
+class _Reservation:
+    """Holds a session's place in the pool while its worker is being spawned."""
+
+    busy = True
+
+    def kill(self):
+        pass
+
+
+class ShellWorkerPool:
+    """
+    Session-keyed pool of persistent shell workers.
+
+    Workers are recycled after ``max_commands`` commands, on timeout, or when
+    a health check fails; idle workers expire after ``idle_timeout``. When the
+    pool is full or a session's worker is busy, ``run`` returns None and the
+    caller falls back to a one-shot process.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 16,
+        max_commands: int = 100,
+        idle_timeout: float = 600,
+        health_check_interval: float = 60,
+        shell: str = "/bin/sh"
+    ):
+        """
+        Initialize the pool.
+
+        Args:
+            max_workers: Maximum number of live shell workers
+            max_commands: Commands a worker runs before it is replaced
+            idle_timeout: Seconds an idle worker is kept before it is closed
+            health_check_interval: Idle seconds after which a worker is pinged before reuse
+            shell: Shell executable
+        """
+        self.max_workers = max_workers
+        self.max_commands = max_commands
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.shell = shell
+        self._lock = threading.Lock()
+        # session_id -> worker, or a reservation while its worker spawns
+        self._workers: "OrderedDict[str, Any]" = OrderedDict()
+        self._stats = {"spawned": 0, "recycled": 0, "commands": 0, "fallbacks": 0}
+
+    @classmethod
+    def from_env(cls) -> "ShellWorkerPool":
+        """Create a pool configured from SHELL_POOL_* environment variables."""
+        return cls(
+            max_workers=int(os.getenv("SHELL_POOL_MAX_WORKERS", 16)),
+            max_commands=int(os.getenv("SHELL_POOL_MAX_COMMANDS", 100)),
+            idle_timeout=float(os.getenv("SHELL_POOL_IDLE_TIMEOUT", 600)),
+            health_check_interval=float(os.getenv("SHELL_POOL_HEALTH_CHECK_INTERVAL", 60))
+        )
+
+    def run(self, session_id: str, command: str, timeout: float = 30,
+            max_output_bytes: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        Run a command in the session's shell worker.
+
+        Returns:
+            The run_shell result dict, or None if no worker is available
+        """
+        worker = self._checkout(session_id)
+        if worker is None:
+            with self._lock:
+                self._stats["fallbacks"] += 1
+            return None
+        try:
+            return worker.run(command, timeout=timeout, max_output_bytes=max_output_bytes)
+        finally:
+            self._checkin(session_id, worker)
+
+    def release(self, session_id: str):
+        """Close the session's worker, if it is idle."""
+        with self._lock:
+            worker = self._workers.get(session_id)
+            if worker is None or worker.busy:
+                return
+            del self._workers[session_id]
+        worker.kill()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(
+                self._stats,
+                workers=len(self._workers),
+                busy=sum(1 for worker in self._workers.values() if worker.busy)
+            )
+
+    def close(self):
+        """Kill every worker."""
+        with self._lock:
+            workers = list(self._workers.values())
+            self._workers.clear()
+        for worker in workers:
+            worker.kill()
+
+    def _checkout(self, session_id: str) -> Optional[ShellWorker]:
+        retired = []
+        with self._lock:
+            now = time.monotonic()
+            for key, idle in list(self._workers.items()):
+                if not idle.busy and now - idle.last_used > self.idle_timeout:
+                    retired.append(self._workers.pop(key))
+
+            worker = self._workers.get(session_id)
+            if worker is not None:
+                if worker.busy:
+                    worker = None
+                    reserve = False
+                else:
+                    worker.busy = True
+                    self._workers.move_to_end(session_id)
+                    reserve = False
+            else:
+                # Make room by closing the least recently used idle worker
+                if len(self._workers) >= self.max_workers:
+                    for key, idle in self._workers.items():
+                        if not idle.busy:
+                            retired.append(self._workers.pop(key))
+                            break
+                reserve = len(self._workers) < self.max_workers
+                if reserve:
+                    # Hold the slot, so concurrent calls for the session fall back instead of spawning too
+                    slot = self._workers[session_id] = _Reservation()
+                    self._stats["spawned"] += 1
+
+        for old in retired:
+            old.kill()
+
+        if worker is not None:
+            slot = worker  # Stays busy in the pool until it is replaced
+            healthy = worker.is_alive()
+            if healthy and time.monotonic() - worker.last_used > self.health_check_interval:
+                healthy = worker.ping()
+            if healthy:
+                return worker
+            worker.kill()
+            with self._lock:
+                self._stats["recycled"] += 1
+                self._stats["spawned"] += 1
+            reserve = True
+        if not reserve:
+            return None
+
+        # Spawn outside the lock, then publish the new worker in the slot held for it
+        try:
+            worker = ShellWorker(self.shell)
+        except BaseException:
+            with self._lock:
+                if self._workers.get(session_id) is slot:
+                    del self._workers[session_id]
+            raise
+        worker.busy = True
+        with self._lock:
+            published = self._workers.get(session_id) is slot
+            if published:
+                self._workers[session_id] = worker
+                self._workers.move_to_end(session_id)
+        if not published:
+            worker.kill()  # The pool was closed or the slot given up meanwhile
+            return None
+        return worker
+
+    def _checkin(self, session_id: str, worker: ShellWorker):
+        retire = not worker.is_alive() or worker.commands_run >= self.max_commands
+        with self._lock:
+            self._stats["commands"] += 1
+            worker.busy = False
+            worker.last_used = time.monotonic()
+            if retire:
+                self._stats["recycled"] += 1
+                if self._workers.get(session_id) is worker:
+                    del self._workers[session_id]
+        if retire:
+            worker.kill()
+
+
+_shell_pool: Optional[ShellWorkerPool] = None
+_shell_pool_lock = threading.Lock()
+
+
+def get_shell_pool() -> Optional[ShellWorkerPool]:
+    """
+    Get the process-wide shell worker pool.
+
+    Returns None unless SHELL_POOL_ENABLED is set to "true".
+    """
+    global _shell_pool
+    if _shell_pool is None and os.getenv("SHELL_POOL_ENABLED", "false").lower() == "true":
+        with _shell_pool_lock:
+            if _shell_pool is None:
+                _shell_pool = ShellWorkerPool.from_env()
+    return _shell_pool
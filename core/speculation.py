@@ -0,0 +1,118 @@
+"""
+Speculative execution of read-only tools.
+Starts tool calls that have no side effects before the agent is sure it
+needs them, and hands the running call over once the model confirms it.
+"""
+
+import json
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from core.metrics import SPECULATIVE_TOOLS
+from core.tools import TOOLS, is_read_only
+
+# Longest user message guessed to be a search query
+PREFETCH_MAX_QUERY = 200
+
+# Messages that read like a question or a lookup
+_LOOKUP_RE = re.compile(
+    r"^(who|what|when|where|which|why|how|is|are|does|do|can|search|find|look up|latest)\b", re.IGNORECASE
+)
+
+# Request phrasing stripped from the front of a lookup to leave the query
+_LOOKUP_PREFIX_RE = re.compile(r"^(please\s+)?(search( the web)? for|look up|find( out)?)\s+", re.IGNORECASE)
+
+
+def call_key(tool_call: Dict[str, Any]) -> Optional[str]:
+    """Identify a tool call by its tool and parameters, or None if they can't be compared."""
+    try:
+        return json.dumps([tool_call["tool"], tool_call["parameters"]], sort_keys=True)
+    except (TypeError, ValueError):
+        return None
+
+
+def predict_tool_calls(message: str) -> List[Dict[str, Any]]:
+    """
+    Guess the read-only tool calls a user message will lead to.
+
+    A question or lookup is guessed to need a web search for the message
+    itself. The guess only saves time when the model asks for exactly that
+    search, though with the search cache enabled a near miss still warms it.
+
+    Args:
+        message: The user's message
+
+    Returns:
+        Tool calls to start while the first completion is in flight
+    """
+    if "run_web_search" not in TOOLS or not is_read_only("run_web_search"):
+        return []
+    text = " ".join(message.split())
+    if not text or len(text) > PREFETCH_MAX_QUERY or not (text.endswith("?") or _LOOKUP_RE.match(text)):
+        return []
+    query = _LOOKUP_PREFIX_RE.sub("", text).rstrip("?.! ")
+    return [{"tool": "run_web_search", "parameters": {"query": query}}] if query else []
+
+
+class Speculation:
+    """
+    The speculative tool calls of one turn.
+
+    ``start`` launches a read-only call and remembers it by tool and
+    parameters, ``take`` hands it to the tool step that asks for the same
+    call, and ``discard`` cancels whatever was never asked for. Calls to
+    tools that aren't read-only are never started.
+    """
+
+    def __init__(self, launch: Callable[[Dict[str, Any]], Any]):
+        """
+        Initialize the speculation.
+
+        Args:
+            launch: Starts a tool call, returning its future (or asyncio task)
+        """
+        self._launch = launch
+        self._pending: Dict[str, Tuple[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def start(self, tool_call: Dict[str, Any]) -> bool:
+        """
+        Start a tool call early.
+
+        Args:
+            tool_call: Validated tool call with "tool" and "parameters"
+
+        Returns:
+            Whether it started; not for tools with side effects, or when the
+            same call is already running
+        """
+        if not is_read_only(tool_call["tool"]):
+            return False
+        key = call_key(tool_call)
+        if key is None:
+            return False
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending[key] = (tool_call["tool"], self._launch(tool_call))
+        SPECULATIVE_TOOLS.labels(tool_call["tool"], "started").inc()
+        return True
+
+    def take(self, tool_call: Dict[str, Any]) -> Optional[Any]:
+        """Claim the running call matching ``tool_call``, or None if none was started."""
+        key = call_key(tool_call)
+        with self._lock:
+            entry = self._pending.pop(key, None) if key is not None else None
+        if entry is None:
+            return None
+        SPECULATIVE_TOOLS.labels(entry[0], "used").inc()
+        return entry[1]
+
+    def discard(self):
+        """Cancel the calls nobody asked for; ones already running finish and are ignored."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for tool_name, future in pending.values():
+            future.cancel()
+            SPECULATIVE_TOOLS.labels(tool_name, "discarded").inc()
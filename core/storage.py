@@ -0,0 +1,274 @@
+"""
+Persistent conversation storage.
+Keeps every session's transcript in SQLite or append-only JSONL files so
+histories survive restarts and can be shared by several worker processes.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import Hashable, List, Optional, Tuple
+
+from core.messages import Message, compact_json
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, appends are then unlocked
+    fcntl = None
+
+# Bytes read at a time when scanning a JSONL log backwards
+_TAIL_BLOCK_SIZE = 64 * 1024
+
+
+def _encode(message: Message) -> str:
+    return compact_json(message)
+
+
+def _decode(line: str) -> Message:
+    return Message.from_dict(json.loads(line))
+
+
+class ConversationStore:
+    """
+    Interface for durable, append-only conversation transcripts.
+
+    ``version`` returns a cheap token that changes whenever a session's
+    transcript changes, letting agents in other processes detect that their
+    in-memory window is stale.
+    """
+
+    def append(self, session_id: str, message: Message) -> Hashable:
+        """Append one message. Returns the session's new version."""
+        raise NotImplementedError
+
+    def load(self, session_id: str, limit: Optional[int] = None) -> List[Message]:
+        """Load the latest ``limit`` messages (all when None), oldest first."""
+        raise NotImplementedError
+
+    def page(self, session_id: str, offset: int = 0, limit: Optional[int] = None) -> Tuple[List[Message], int]:
+        """Load a slice of the transcript. Returns (messages, total message count)."""
+        raise NotImplementedError
+
+    def version(self, session_id: str) -> Hashable:
+        """Get the session's current version (None for an empty transcript)."""
+        raise NotImplementedError
+
+    def clear(self, session_id: str):
+        """Delete a session's transcript."""
+        raise NotImplementedError
+
+
+class SQLiteConversationStore(ConversationStore):
+    """
+    Conversation store in a SQLite database in WAL mode.
+
+    Each thread gets its own connection; WAL lets readers in any process run
+    alongside a writer. Message IDs only ever grow, so the latest ID of a
+    session is its version.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize the store.
+
+        Args:
+            path: Database file, created if it doesn't exist
+        """
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "session_id TEXT NOT NULL, "
+            "message TEXT NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def append(self, session_id: str, message: Message) -> Hashable:
+        cursor = self._conn().execute(
+            "INSERT INTO messages (session_id, message) VALUES (?, ?)", (session_id, _encode(message))
+        )
+        return cursor.lastrowid
+
+    def load(self, session_id: str, limit: Optional[int] = None) -> List[Message]:
+        rows = self._conn().execute(
+            "SELECT message FROM ("
+            "SELECT id, message FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?"
+            ") ORDER BY id",
+            (session_id, -1 if limit is None else limit)
+        ).fetchall()
+        return [_decode(row[0]) for row in rows]
+
+    def page(self, session_id: str, offset: int = 0, limit: Optional[int] = None) -> Tuple[List[Message], int]:
+        conn = self._conn()
+        total = conn.execute("SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)).fetchone()[0]
+        rows = conn.execute(
+            "SELECT message FROM messages WHERE session_id = ? ORDER BY id LIMIT ? OFFSET ?",
+            (session_id, -1 if limit is None else limit, offset)
+        ).fetchall()
+        return [_decode(row[0]) for row in rows], total
+
+    def version(self, session_id: str) -> Hashable:
+        return self._conn().execute(
+            "SELECT MAX(id) FROM messages WHERE session_id = ?", (session_id,)
+        ).fetchone()[0]
+
+    def clear(self, session_id: str):
+        self._conn().execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+
+
+class JSONLConversationStore(ConversationStore):
+    """
+    Conversation store with one append-only JSON Lines file per session.
+
+    Appends take an exclusive ``flock`` so several processes can write the
+    same session safely; windowed loads read the file backwards from its end.
+    The file's inode, size and modification time form its version.
+    """
+
+    def __init__(self, directory: str):
+        """
+        Initialize the store.
+
+        Args:
+            directory: Directory holding the log files, created if it doesn't exist
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id: str) -> str:
+        name = hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.directory, f"{name}.jsonl")
+
+    def append(self, session_id: str, message: Message) -> Hashable:
+        line = (_encode(message) + "\n").encode("utf-8")
+        with open(self._path(session_id), "ab") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(line)
+            f.flush()
+            return self._stat_version(os.fstat(f.fileno()))
+
+    def load(self, session_id: str, limit: Optional[int] = None) -> List[Message]:
+        try:
+            f = open(self._path(session_id), "rb")
+        except FileNotFoundError:
+            return []
+        with f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_SH)
+            if limit is None:
+                lines = f.read().split(b"\n")[:-1]
+            else:
+                lines = self._tail(f, limit)
+        return [_decode(line) for line in lines]
+
+    def page(self, session_id: str, offset: int = 0, limit: Optional[int] = None) -> Tuple[List[Message], int]:
+        try:
+            f = open(self._path(session_id), "rb")
+        except FileNotFoundError:
+            return [], 0
+        messages = []
+        total = 0
+        end = None if limit is None else offset + limit
+        with f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_SH)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Partial line from a writer without locking
+                if total >= offset and (end is None or total < end):
+                    messages.append(_decode(line))
+                total += 1
+        return messages, total
+
+    def version(self, session_id: str) -> Hashable:
+        try:
+            return self._stat_version(os.stat(self._path(session_id)))
+        except FileNotFoundError:
+            return None
+
+    def clear(self, session_id: str):
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _stat_version(stat: os.stat_result) -> Hashable:
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    @staticmethod
+    def _tail(f, count: int) -> List[bytes]:
+        """Read the last ``count`` complete lines of a file without reading all of it."""
+        if count <= 0:
+            return []
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b""
+        # One extra newline marks the start of the oldest wanted line
+        while position > 0 and data.count(b"\n") <= count:
+            size = min(_TAIL_BLOCK_SIZE, position)
+            position -= size
+            f.seek(position)
+            data = f.read(size) + data
+        lines = data.split(b"\n")[:-1]  # Drop the text after the last newline
+        if position > 0:
+            lines = lines[1:]  # First piece may be a partial line
+        return lines[-count:]
+
+
+def create_conversation_store(kind: str, path: Optional[str] = None) -> Optional[ConversationStore]:
+    """
+    Create a conversation store.
+
+    Args:
+        kind: "sqlite", "jsonl" or "none"
+        path: Database file (sqlite) or directory (jsonl)
+
+    Returns:
+        The store, or None for "none"
+    """
+    if kind == "sqlite":
+        return SQLiteConversationStore(path or "conversations.db")
+    if kind == "jsonl":
+        return JSONLConversationStore(path or "conversations")
+    if kind == "none":
+        return None
+    raise ValueError(f"Unknown conversation store '{kind}', expected 'sqlite', 'jsonl' or 'none'")
+
+
+_conversation_store: Optional[ConversationStore] = None
+_conversation_store_loaded = False
+_conversation_store_lock = threading.Lock()
+
+
+def get_conversation_store() -> Optional[ConversationStore]:
+    """
+    Get the process-wide conversation store configured by CONVERSATION_STORE
+    and CONVERSATION_STORE_PATH.
+
+    Returns None when persistence is disabled (the default).
+    """
+    global _conversation_store, _conversation_store_loaded
+    if not _conversation_store_loaded:
+        with _conversation_store_lock:
+            if not _conversation_store_loaded:
+                _conversation_store = create_conversation_store(
+                    os.getenv("CONVERSATION_STORE", "none").lower(),
+                    os.getenv("CONVERSATION_STORE_PATH") or None
+                )
+                _conversation_store_loaded = True
+    return _conversation_store
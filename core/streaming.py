@@ -0,0 +1,292 @@
+"""
+Incremental parsing for streamed completions.
+Turns OpenRouter's SSE stream into text deltas and detects JSON tool calls
+while the reply is still arriving.
+"""
+
+import json
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Marker OpenRouter sends as the last SSE data line of a stream
+SSE_DONE = "[DONE]"
+
+
+def parse_sse_delta(line: str) -> Tuple[bool, Dict[str, Any]]:
+    """
+    Parse one line of a streamed chat completion into its delta.
+
+    Args:
+        line: A single line of the SSE response body
+
+    Returns:
+        Tuple of (stream finished, ``delta`` object carried by the line)
+    """
+    if not line.startswith("data:"):
+        return False, {}  # Blank separators and ": keep-alive" comments
+    data = line[len("data:"):].strip()
+    if data == SSE_DONE:
+        return True, {}
+    chunk = json.loads(data)
+    if "error" in chunk:
+        raise RuntimeError(chunk["error"].get("message", "Upstream stream error"))
+    choices = chunk.get("choices") or [{}]
+    return False, choices[0].get("delta") or {}
+
+
+def parse_sse_line(line: str) -> Tuple[bool, str]:
+    """
+    Parse one line of a streamed chat completion.
+
+    Args:
+        line: A single line of the SSE response body
+
+    Returns:
+        Tuple of (stream finished, content delta carried by the line)
+    """
+    done, delta = parse_sse_delta(line)
+    return done, delta.get("content") or ""
+
+
+def format_sse(event: str, data: Any) -> str:
+    """Encode one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def as_tool_calls(parsed: Any, tool_names: Iterable[str]) -> List[Dict[str, Any]]:
+    """
+    Interpret a parsed JSON reply as tool calls.
+
+    A reply is a tool call when it is a ``{"tool", "parameters"}`` object or a
+    non-empty array of them, and every named tool exists.
+
+    Args:
+        parsed: Decoded JSON value of the reply
+        tool_names: Names of tools the agent can execute
+
+    Returns:
+        The tool calls in order, or an empty list for a normal reply
+    """
+    calls = parsed if isinstance(parsed, list) else [parsed]
+    if not calls:
+        return []
+    for call in calls:
+        if not (isinstance(call, dict) and "tool" in call and "parameters" in call):
+            return []
+        if call["tool"] not in tool_names:
+            return []
+    return calls
+
+
+class StreamingReplyParser:
+    """
+    Incrementally classifies an assistant reply as text or JSON tool calls.
+
+    Mirrors the JSON check in AIAgent: once the first non-whitespace
+    character arrives, a text reply is passed through as ``token`` events
+    while a JSON object (or array of objects) is scanned in a single pass.
+    ``reasoning`` fields are streamed as ``reasoning`` events, ``tool_name``
+    is set as soon as the first ``tool`` value is complete, ``on_call_ready``
+    hears of each call once both its ``tool`` and ``parameters`` are, and
+    ``tool_calls`` is set the moment the top-level value closes, without
+    waiting for the stream to end. A value that closes without being a tool
+    call (or prose that merely starts with a bracket) is released as a
+    ``token`` event and the rest of the reply streams on as text.
+    """
+
+    def __init__(self, tool_names: Iterable[str],
+                 on_call_ready: Optional[Callable[[Dict[str, Any]], None]] = None):
+        """
+        Initialize the parser.
+
+        Args:
+            tool_names: Names of tools the agent can execute
+            on_call_ready: Called with each {"tool", "parameters"} call as soon
+                as it is fully written, possibly long before the reply ends
+        """
+        self.tool_names = set(tool_names)
+        self.on_call_ready = on_call_ready
+        self.text = ""
+        self.mode: Optional[str] = None  # "text" or "json" once decided
+        self.tool_name: Optional[str] = None
+        self.tool_calls: List[Dict[str, Any]] = []
+        self.complete = False
+        self._pos = 0
+        self._json_start = 0
+        self._object_depth = 1  # Depth at which tool call keys live
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect_key = False
+        self._string_start = 0
+        self._string_is_key = False
+        self._last_key: Optional[str] = None
+        self._call_tool: Optional[str] = None
+        self._call_parameters: Optional[Dict[str, Any]] = None
+        self._parameters_start: Optional[int] = None
+        self._reasoning_spans: List[List[Optional[int]]] = []
+        self._reasoning_index = 0
+        self._reasoning_emitted = 0
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        """
+        Consume the next content delta.
+
+        Args:
+            chunk: Text delta from the stream
+
+        Returns:
+            List of (event, text) pairs ready to be emitted
+        """
+        if self.complete:
+            return []
+        self.text += chunk
+
+        if self.mode is None:
+            stripped = self.text.lstrip()
+            if not stripped:
+                return []
+            if not stripped.startswith(("{", "[")):
+                self.mode = "text"
+                return [("token", self.text)]
+            self.mode = "json"
+            self._object_depth = 2 if stripped.startswith("[") else 1
+            self._json_start = len(self.text) - len(stripped)
+            self._pos = self._json_start
+        elif self.mode == "text":
+            return [("token", chunk)]
+
+        self._scan()
+        if self.mode == "text":
+            return [("token", self.text)]  # Not a tool call after all, release everything so far
+        return self._reasoning_events()
+
+    def finish(self) -> List[Tuple[str, str]]:
+        """
+        Flush the parser once the stream has ended.
+
+        Returns:
+            Remaining (event, text) pairs; a JSON reply that turned out not to
+            be a tool call is released as a single ``token`` event
+        """
+        if self.mode != "text" and not self.tool_calls and self.text:
+            return [("token", self.text)]
+        return []
+
+    def _scan(self):
+        """Advance the JSON scanner over newly received text."""
+        text = self.text
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == self._object_depth:
+                        self._end_key_or_value(i)
+                continue
+
+            if c == '"':
+                self._in_string = True
+                if self._depth == self._object_depth:
+                    self._string_start = i + 1
+                    self._string_is_key = self._expect_key
+                    if not self._string_is_key and self._last_key == "reasoning":
+                        self._reasoning_spans.append([i + 1, None])
+            elif c in "{[":
+                self._depth += 1
+                if self._depth == self._object_depth and c == "{":
+                    self._expect_key = True
+                    self._call_tool = self._call_parameters = None  # A new tool call object
+                elif self._depth == self._object_depth + 1 and c == "{" and self._last_key == "parameters":
+                    self._parameters_start = i
+            elif c in "}]":
+                self._depth -= 1
+                if self._depth == self._object_depth and self._parameters_start is not None:
+                    self._end_parameters(i + 1)
+                elif self._depth == 0:
+                    self._pos = i + 1
+                    self._end_json(i + 1)
+                    return
+            elif self._depth == self._object_depth:
+                if c == ",":
+                    self._expect_key = True
+                elif c == ":":
+                    self._expect_key = False
+        self._pos = len(text)
+
+    def _decode_string(self, start: int, end: int) -> Optional[str]:
+        """Decode a raw JSON string body, or None if it is malformed."""
+        try:
+            return json.loads('"' + self.text[start:end] + '"')
+        except json.JSONDecodeError:
+            return None
+
+    def _end_key_or_value(self, end: int):
+        """Handle a completed key or value string of a tool call object."""
+        value = self._decode_string(self._string_start, end)
+        if self._string_is_key:
+            self._last_key = value
+            return
+        if self._last_key == "tool" and value in self.tool_names:
+            if self.tool_name is None:
+                self.tool_name = value
+            self._call_tool = value
+            self._call_ready()
+        if self._reasoning_spans and self._reasoning_spans[-1][1] is None:
+            self._reasoning_spans[-1][1] = end
+
+    def _end_parameters(self, end: int):
+        """Handle the close of a tool call's ``parameters`` object."""
+        try:
+            self._call_parameters = json.loads(self.text[self._parameters_start:end])
+        except json.JSONDecodeError:
+            pass
+        self._parameters_start = None
+        self._call_ready()
+
+    def _call_ready(self):
+        """Report the current tool call once its tool and parameters are both known."""
+        if self._call_tool is not None and self._call_parameters is not None:
+            if self.on_call_ready is not None:
+                self.on_call_ready({"tool": self._call_tool, "parameters": self._call_parameters})
+            self._call_tool = self._call_parameters = None
+
+    def _end_json(self, end: int):
+        """Handle the close of the top-level value: stop at tool calls, fall back to text otherwise."""
+        try:
+            parsed = json.loads(self.text[self._json_start:end])
+        except json.JSONDecodeError:
+            self.mode = "text"
+            return
+        self.tool_calls = as_tool_calls(parsed, self.tool_names)
+        if self.tool_calls:
+            self.complete = True
+            self.text = self.text[:end]
+        else:
+            self.mode = "text"
+
+    def _reasoning_events(self) -> List[Tuple[str, str]]:
+        """Emit any newly decodable part of the reasoning fields."""
+        events = []
+        while self._reasoning_index < len(self._reasoning_spans):
+            start, end = self._reasoning_spans[self._reasoning_index]
+            raw_end = end if end is not None else len(self.text)
+            # Back off over a partially received escape sequence
+            decoded = None
+            for trim in range(0, 7):
+                if raw_end - trim < start:
+                    break
+                decoded = self._decode_string(start, raw_end - trim)
+                if decoded is not None:
+                    break
+            if decoded and len(decoded) > self._reasoning_emitted:
+                events.append(("reasoning", decoded[self._reasoning_emitted:]))
+                self._reasoning_emitted = len(decoded)
+            if end is None:
+                break
+            self._reasoning_index += 1
+            self._reasoning_emitted = 0
+        return events
@@ -4,122 +4,494 @@ Provides capabilities for shell execution, web search, and file operations.
 """
 
 import subprocess
+import codecs
+import inspect
+import itertools
 import json
 import os
-from typing import Dict, Any, Optional
-import requests
+import re
+import signal
+import threading
+import time
+import logging
+import typing
+from contextvars import ContextVar
+from typing import Callable, Dict, Any, Iterable, List, Optional, Tuple
+from core.search_cache import get_search_cache
+from core.write_engine import flush_pending_writes, get_write_engine
 
+logger = logging.getLogger(__name__)
 
-def run_shell(command: str, timeout: int = 30) -> Dict[str, Any]:
+
+def _shell_result(returncode: int, output: str = "", error: str = "") -> Dict[str, Any]:
+    """Build the result dict for a shell command."""
+    return {
+        "success": returncode == 0,
+        "output": output,
+        "error": error,
+        "returncode": returncode
+    }
+
+
+# Session the current tool call runs for, set by the agent while executing tools
+tool_session: ContextVar[Optional[str]] = ContextVar("tool_session", default=None)
+
+
+class ToolRegistry(dict):
+    """
+    Mapping of tool names to functions that tracks a registry version.
+    
+    The version changes whenever a tool is added, replaced or removed, so
+    anything derived from the registry (like the system prompt) knows when
+    to rebuild.
+    """
+    
+    _versions = itertools.count(1)
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = next(self._versions)
+    
+    def _changed(self):
+        self.version = next(self._versions)
+    
+    def __setitem__(self, name, func):
+        super().__setitem__(name, func)
+        self._changed()
+    
+    def __delitem__(self, name):
+        super().__delitem__(name)
+        self._changed()
+    
+    def pop(self, *args):
+        result = super().pop(*args)
+        self._changed()
+        return result
+    
+    def popitem(self):
+        result = super().popitem()
+        self._changed()
+        return result
+    
+    def setdefault(self, name, default=None):
+        result = super().setdefault(name, default)
+        self._changed()
+        return result
+    
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._changed()
+    
+    def clear(self):
+        super().clear()
+        self._changed()
+
+
+# Tool registry for easy access, filled by @tool and register_tool
+TOOLS = ToolRegistry()
+
+# Descriptions shown to the model, keyed like TOOLS
+TOOL_DESCRIPTIONS: Dict[str, Dict[str, Any]] = {}
+
+# Type names used in parameter summaries, mapped to JSON Schema types
+_SCHEMA_TYPES = {
+    "str": "string",
+    "int": "integer",
+    "float": "number",
+    "bool": "boolean",
+    "list": "array",
+    "dict": "object"
+}
+
+# One "name (type, optional)" entry of a parameter summary
+_PARAMETER_RE = re.compile(r"(\w+)(?:\s*\(([^)]*)\))?")
+
+# One "name: description" line of a docstring's Args section
+_ARG_DOC_RE = re.compile(r"^\s+(\w+):\s*(.+)$")
+
+
+def parameters_schema(summary: str, descriptions: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """
+    Build a JSON Schema object from a parameter summary.
+    
+    Args:
+        summary: Summary as registered with the tool, e.g.
+            "command (str), timeout (int, optional)"
+        descriptions: Optional description per parameter name
+        
+    Returns:
+        An "object" schema with a property per parameter; parameters not
+        marked optional are required
+    """
+    properties: Dict[str, Any] = {}
+    required = []
+    for match in _PARAMETER_RE.finditer(summary):
+        name, details = match.group(1), match.group(2) or ""
+        flags = [flag.strip().lower() for flag in details.split(",") if flag.strip()]
+        schema_type = _SCHEMA_TYPES.get(flags[0]) if flags else None
+        properties[name] = {"type": schema_type} if schema_type else {}
+        if descriptions and descriptions.get(name):
+            properties[name]["description"] = descriptions[name]
+        if "optional" not in flags:
+            required.append(name)
+    return {"type": "object", "properties": properties, "required": required}
+
+
+def _type_name(annotation: Any) -> Optional[str]:
+    """Summary type name for a parameter annotation, or None if it has no JSON equivalent."""
+    if annotation is inspect.Parameter.empty:
+        return None
+    args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+    if typing.get_origin(annotation) is typing.Union and len(args) == 1:
+        annotation = args[0]  # Optional[X]
+    annotation = typing.get_origin(annotation) or annotation
+    name = getattr(annotation, "__name__", None)
+    return name if name in _SCHEMA_TYPES else None
+
+
+def _parse_docstring(doc: Optional[str]) -> Tuple[str, Dict[str, str]]:
+    """Split a docstring into its summary line and per-argument descriptions."""
+    lines = inspect.cleandoc(doc or "").splitlines()
+    summary = lines[0].strip().rstrip(".") if lines else ""
+    arguments: Dict[str, str] = {}
+    in_args = False
+    for line in lines[1:]:
+        if line.strip() in ("Args:", "Arguments:"):
+            in_args = True
+        elif in_args:
+            match = _ARG_DOC_RE.match(line)
+            if match:
+                arguments[match.group(1)] = match.group(2).strip()
+            elif line.strip() and not line.startswith(" "):
+                in_args = False  # Next section
+    return summary, arguments
+
+
+def describe_tool(func: Callable[..., Any], name: Optional[str] = None, description: Optional[str] = None,
+                  exclude: Iterable[str] = ()) -> Dict[str, Any]:
+    """
+    Derive a tool's metadata from its signature and docstring.
+    
+    Args:
+        func: The tool implementation
+        name: Tool name (defaults to the function name)
+        description: What the tool does (defaults to the docstring's first line)
+        exclude: Parameters not exposed to the model
+        
+    Returns:
+        Dict with "name", "description", the "parameters" summary and its JSON "schema"
+    """
+    summary, arguments = _parse_docstring(func.__doc__)
+    entries = []
+    for parameter in inspect.signature(func).parameters.values():
+        if parameter.name in exclude or parameter.kind in (parameter.VAR_POSITIONAL, parameter.VAR_KEYWORD):
+            continue
+        flags = [_type_name(parameter.annotation)] if _type_name(parameter.annotation) else []
+        if parameter.default is not parameter.empty:
+            flags.append("optional")
+        entries.append(f"{parameter.name} ({', '.join(flags)})" if flags else parameter.name)
+    parameters = ", ".join(entries)
+    return {
+        "name": name or func.__name__,
+        "description": description or summary,
+        "parameters": parameters,
+        "schema": parameters_schema(parameters, arguments)
+    }
+
+
+def _add_tool(func: Callable[..., Any], spec: Dict[str, Any]):
+    """Register a tool under its metadata; the description goes in first so readers never see a bare tool."""
+    TOOL_DESCRIPTIONS[spec["name"]] = spec
+    TOOLS[spec["name"]] = func
+
+
+def tool(func: Optional[Callable[..., Any]] = None, *, name: Optional[str] = None,
+         description: Optional[str] = None, exclude: Iterable[str] = (), read_only: bool = False):
+    """
+    Decorator that registers a function as a tool.
+    
+    The name, description and typed parameter schema come from the
+    function's name, docstring and signature. Usable bare (``@tool``) or
+    with overrides (``@tool(exclude=("on_output",))``).
+    
+    Args:
+        func: The tool implementation (when used bare)
+        name: Tool name (defaults to the function name)
+        description: What the tool does (defaults to the docstring's first line)
+        exclude: Parameters not exposed to the model
+        read_only: The tool has no side effects, so the agent may start it
+            speculatively and throw the result away
+        
+    Returns:
+        The function, unchanged apart from a ``tool_spec`` attribute
+    """
+    def decorate(func: Callable[..., Any]) -> Callable[..., Any]:
+        func.tool_spec = describe_tool(func, name, description, exclude)
+        if read_only:
+            func.tool_spec["read_only"] = True
+        _add_tool(func, func.tool_spec)
+        return func
+    
+    return decorate(func) if func is not None else decorate
+
+
+# Default cap on captured bytes per output stream of a shell command
+SHELL_MAX_OUTPUT_BYTES = int(os.getenv("SHELL_MAX_OUTPUT_BYTES", 1024 * 1024))
+
+# Bytes read from a pipe at a time
+_READ_CHUNK_SIZE = 64 * 1024
+
+
+class OutputBuffer:
+    """
+    Bounded capture of a byte stream.
+    
+    Keeps the first and last ``max_bytes / 2`` bytes and counts what was
+    dropped in between, so memory stays constant however much is written.
+    """
+    
+    def __init__(self, max_bytes: int = SHELL_MAX_OUTPUT_BYTES):
+        self.head_limit = max_bytes // 2
+        self.tail_limit = max_bytes - self.head_limit
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.dropped = 0
+    
+    def write(self, data: bytes):
+        """Append a chunk of output."""
+        room = self.head_limit - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if not data:
+            return
+        self.tail += data
+        overflow = len(self.tail) - self.tail_limit
+        if overflow > 0:
+            del self.tail[:overflow]
+            self.dropped += overflow
+    
+    def getvalue(self) -> str:
+        """Decode the captured output, marking any truncated middle section."""
+        head = self.head.decode("utf-8", errors="replace")
+        tail = self.tail.decode("utf-8", errors="replace")
+        if self.dropped:
+            return f"{head}\n[... {self.dropped} bytes truncated ...]\n{tail}"
+        return head + tail
+
+
+def _kill_process_group(process: subprocess.Popen):
+    """Kill a shell and every process it started."""
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except (ProcessLookupError, PermissionError):
+        pass  # Already exited
+
+
+def _pump(pipe, buffer: OutputBuffer, stream: str, on_output: Optional[Callable[[str, str], None]]):
+    """Copy a pipe into a buffer, forwarding decoded chunks to the callback."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    try:
+        while True:
+            chunk = pipe.read1(_READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            buffer.write(chunk)
+            if on_output is not None:
+                on_output(stream, decoder.decode(chunk))
+    finally:
+        pipe.close()
+
+
+def _run_in_shell_pool(command: str, timeout: int, max_output_bytes: Optional[int]) -> Optional[Dict[str, Any]]:
+    """
+    Run a command in the calling session's persistent shell worker.
+    
+    Returns:
+        The result dict, or None when the shell pool is disabled, no session
+        is set or no worker is free
+    """
+    session_id = tool_session.get()
+    if session_id is None:
+        return None
+    from core.shell_pool import get_shell_pool  # Imported here, it builds on this module
+    pool = get_shell_pool()
+    if pool is None:
+        return None
+    return pool.run(session_id, command, timeout=timeout, max_output_bytes=max_output_bytes)
+
+
+@tool(description="Execute shell commands and return the output", exclude=("max_output_bytes", "on_output"))
+def run_shell(command: str, timeout: int = 30, max_output_bytes: Optional[int] = None,
+              on_output: Optional[Callable[[str, str], None]] = None) -> Dict[str, Any]:
     """
     Execute a shell command and return the result.
     
+    Output is read incrementally and capped per stream, keeping the head and
+    tail around a truncation marker. On timeout the whole process group is
+    killed. Appends buffered by the write engine are written out first, so
+    the command sees them.
+    
+    With SHELL_POOL_ENABLED, commands run by an agent go to the session's
+    persistent shell worker instead, so ``cd`` and ``export`` carry over
+    between calls. ``on_output`` always uses a one-shot process.
+    
     Args:
         command: The shell command to execute
         timeout: Maximum time to wait for command execution (seconds)
+        max_output_bytes: Bytes kept per stream (defaults to SHELL_MAX_OUTPUT_BYTES)
+        on_output: Optional callback receiving ("stdout" or "stderr", text) as output arrives
         
     Returns:
         Dict containing status, output, and error information
     """
+    flush_pending_writes()
+    if on_output is None:
+        result = _run_in_shell_pool(command, timeout, max_output_bytes)
+        if result is not None:
+            return result
+    
+    max_output_bytes = max_output_bytes or SHELL_MAX_OUTPUT_BYTES
+    stdout, stderr = OutputBuffer(max_output_bytes), OutputBuffer(max_output_bytes)
     try:
-        result = subprocess.run(
+        process = subprocess.Popen(
             command,
             shell=True,
-            capture_output=True,
-            text=True,
-            timeout=timeout
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True
         )
-        return {
-            "success": result.returncode == 0,
-            "output": result.stdout,
-            "error": result.stderr,
-            "returncode": result.returncode
-        }
-    except subprocess.TimeoutExpired:
-        return {
-            "success": False,
-            "output": "",
-            "error": f"Command timed out after {timeout} seconds",
-            "returncode": -1
-        }
+        readers = [
+            threading.Thread(target=_pump, args=(process.stdout, stdout, "stdout", on_output), daemon=True),
+            threading.Thread(target=_pump, args=(process.stderr, stderr, "stderr", on_output), daemon=True)
+        ]
+        for reader in readers:
+            reader.start()
+        deadline = time.monotonic() + timeout
+        try:
+            returncode = process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            returncode = None
+        if returncode is not None:
+            # A background child can hold the pipes open after the shell exits
+            for reader in readers:
+                reader.join(timeout=max(0, deadline - time.monotonic()))
+        if returncode is None or any(reader.is_alive() for reader in readers):
+            _kill_process_group(process)
+            process.wait()
+            for reader in readers:
+                reader.join(timeout=1)
+            return _shell_result(-1, stdout.getvalue(), f"Command timed out after {timeout} seconds")
+        return _shell_result(returncode, stdout.getvalue(), stderr.getvalue())
     except Exception as e:
-        return {
-            "success": False,
-            "output": "",
-            "error": str(e),
-            "returncode": -1
-        }
+        return _shell_result(-1, error=str(e))
 
 
+# DuckDuckGo Instant Answer API (free, no API key required)
+SEARCH_URL = os.getenv("SEARCH_URL", "https://api.duckduckgo.com/")
+
+
+def _search_params(query: str) -> Dict[str, Any]:
+    """Build the query string for a DuckDuckGo Instant Answer request."""
+    return {
+        "q": query,
+        "format": "json",
+        "no_html": 1,
+        "skip_disambig": 1
+    }
+
+
+def _parse_search_results(data: Dict[str, Any], query: str, num_results: int) -> Dict[str, Any]:
+    """Convert a DuckDuckGo Instant Answer response into the search result dict."""
+    results = []
+    
+    # Add abstract if available
+    if data.get("Abstract"):
+        results.append({
+            "title": data.get("Heading", ""),
+            "snippet": data.get("Abstract", ""),
+            "url": data.get("AbstractURL", "")
+        })
+    
+    # Add related topics
+    for topic in data.get("RelatedTopics", [])[:num_results]:
+        if isinstance(topic, dict) and "Text" in topic:
+            results.append({
+                "title": topic.get("Text", "").split(" - ")[0] if " - " in topic.get("Text", "") else "",
+                "snippet": topic.get("Text", ""),
+                "url": topic.get("FirstURL", "")
+            })
+    
+    return {
+        "success": True,
+        "query": query,
+        "results": results[:num_results],
+        "count": len(results[:num_results])
+    }
+
+
+def _search_error(query: str, error: Exception) -> Dict[str, Any]:
+    """Build the result dict for a failed search."""
+    return {
+        "success": False,
+        "query": query,
+        "results": [],
+        "count": 0,
+        "error": str(error)
+    }
+
+
+@tool(description="Search the web and return relevant results", read_only=True)
 def run_web_search(query: str, num_results: int = 5) -> Dict[str, Any]:
     """
     Perform a web search and return results.
     
+    Results are served from the shared search cache when possible, and
+    concurrent identical searches share one upstream request.
+    
     Args:
         query: The search query
         num_results: Number of results to return
         
     Returns:
-        Dict containing search results and metadata
+        Dict containing search results and metadata, with ``cached`` set when
+        the result did not come from a fresh upstream request
     """
+    cache = get_search_cache()
+    if cache is None:
+        return dict(_fetch_search(query, num_results), cached=False)
+    return cache.get_or_fetch(query, num_results, _fetch_search)
+
+
+def _fetch_search(query: str, num_results: int) -> Dict[str, Any]:
+    """Run a search against the upstream API."""
     # This is a placeholder implementation
     # In production, you would integrate with a real search API
     # (e.g., Google Custom Search, Bing Search API, DuckDuckGo, etc.)
     
+    import requests  # Only needed once a search actually runs
+    
     try:
-        # Example: Using DuckDuckGo Instant Answer API (free, no API key required)
-        url = "https://api.duckduckgo.com/"
-        params = {
-            "q": query,
-            "format": "json",
-            "no_html": 1,
-            "skip_disambig": 1
-        }
-        
-        response = requests.get(url, params=params, timeout=10)
+        response = requests.get(SEARCH_URL, params=_search_params(query), timeout=10)
         response.raise_for_status()
-        data = response.json()
-        
-        results = []
-        
-        # Add abstract if available
-        if data.get("Abstract"):
-            results.append({
-                "title": data.get("Heading", ""),
-                "snippet": data.get("Abstract", ""),
-                "url": data.get("AbstractURL", "")
-            })
-        
-        # Add related topics
-        for topic in data.get("RelatedTopics", [])[:num_results]:
-            if isinstance(topic, dict) and "Text" in topic:
-                results.append({
-                    "title": topic.get("Text", "").split(" - ")[0] if " - " in topic.get("Text", "") else "",
-                    "snippet": topic.get("Text", ""),
-                    "url": topic.get("FirstURL", "")
-                })
-        
-        return {
-            "success": True,
-            "query": query,
-            "results": results[:num_results],
-            "count": len(results[:num_results])
-        }
+        return _parse_search_results(response.json(), query, num_results)
         
     except Exception as e:
-        return {
-            "success": False,
-            "query": query,
-            "results": [],
-            "count": 0,
-            "error": str(e)
-        }
+        return _search_error(query, e)
 
 
+@tool(description="Write content to a file")
 def write_to_file(filepath: str, content: str, mode: str = "w") -> Dict[str, Any]:
     """
     Write content to a file.
     
+    With WRITE_ENGINE_ENABLED, whole-file writes are atomic and appends are
+    buffered and coalesced (see core.write_engine).
+    
     Args:
         filepath: Path to the file
         content: Content to write
@@ -128,6 +500,18 @@ def write_to_file(filepath: str, content: str, mode: str = "w") -> Dict[str, Any
     Returns:
         Dict containing operation status and metadata
     """
+    engine = get_write_engine()
+    if engine is not None and mode in ("w", "a"):
+        try:
+            return engine.write(filepath, content, mode)
+        except Exception as e:
+            return {
+                "success": False,
+                "filepath": filepath,
+                "mode": mode,
+                "error": str(e)
+            }
+    
     try:
         # Create directory if it doesn't exist
         directory = os.path.dirname(filepath)
@@ -156,35 +540,235 @@ def write_to_file(filepath: str, content: str, mode: str = "w") -> Dict[str, Any
         }
 
 
-# Tool registry for easy access
-TOOLS = {
-    "run_shell": run_shell,
-    "run_web_search": run_web_search,
-    "write_to_file": write_to_file
-}
+@tool
+def write_files(files: list) -> Dict[str, Any]:
+    """
+    Write several files in one call.
+    
+    Args:
+        files: Objects with "filepath", "content" and an optional "mode" ('w' or 'a')
+        
+    Returns:
+        Dict with "success" (true when every write succeeded), "count" and
+        the write_to_file result for each file, in order, under "results"
+    """
+    results = []
+    for index, item in enumerate(files):
+        if not isinstance(item, dict) or not isinstance(item.get("filepath"), str) \
+                or not isinstance(item.get("content"), str):
+            results.append({"success": False, "error": f"File {index} needs a string 'filepath' and 'content'"})
+            continue
+        results.append(write_to_file(item["filepath"], item["content"], item.get("mode", "w")))
+    return {
+        "success": all(result["success"] for result in results),
+        "count": len(results),
+        "results": results
+    }
+
+
+def register_tool(func: Callable[..., Dict[str, Any]], description: Optional[str] = None,
+                  parameters: Optional[str] = None, name: Optional[str] = None, read_only: bool = False):
+    """
+    Add a tool to the registry.
+    
+    Anything not given is derived from the function, as with ``@tool``.
+    
+    Args:
+        func: The tool implementation
+        description: What the tool does, as shown to the model
+        parameters: Human-readable parameter summary
+        name: Tool name (defaults to the function name)
+        read_only: The tool has no side effects and may be run speculatively
+    """
+    spec = describe_tool(func, name, description)
+    if parameters is not None:
+        spec["parameters"] = parameters
+        spec["schema"] = parameters_schema(parameters)
+    if read_only:
+        spec["read_only"] = True
+    _add_tool(func, spec)
+
+
+def unregister_tool(name: str):
+    """
+    Remove a tool from the registry.
+    
+    Args:
+        name: Tool name
+    """
+    TOOL_DESCRIPTIONS.pop(name, None)
+    TOOLS.pop(name, None)
 
 
-def get_tool_description() -> Dict[str, Dict[str, str]]:
+def is_read_only(name: str) -> bool:
+    """
+    Check whether a tool was registered as free of side effects.
+    
+    Only such tools are ever started before the model has finished asking
+    for them; anything else (writing files, running commands) runs only once
+    the call is confirmed.
+    """
+    return bool(TOOL_DESCRIPTIONS.get(name, {}).get("read_only"))
+
+
+def get_tool_description() -> Dict[str, Dict[str, Any]]:
     """
     Get descriptions of all available tools.
     
     Returns:
         Dict mapping tool names to their descriptions
     """
-    return {
-        "run_shell": {
-            "name": "run_shell",
-            "description": "Execute shell commands and return the output",
-            "parameters": "command (str), timeout (int, optional)"
-        },
-        "run_web_search": {
-            "name": "run_web_search",
-            "description": "Search the web and return relevant results",
-            "parameters": "query (str), num_results (int, optional)"
-        },
-        "write_to_file": {
-            "name": "write_to_file",
-            "description": "Write content to a file",
-            "parameters": "filepath (str), content (str), mode (str, optional)"
-        }
-    }
+    ensure_plugins()
+    return {name: _public_description(description) for name, description in TOOL_DESCRIPTIONS.items()}
+
+
+def _public_description(description: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy a tool's metadata without its JSON schema, which only native tool calling uses."""
+    return {key: value for key, value in description.items() if key != "schema"}
+
+
+# (registry version, tool listing)
+_tool_list_cache: Tuple[int, List[Dict[str, Any]]] = (0, [])
+
+
+def get_tool_list() -> List[Dict[str, Any]]:
+    """
+    Get the tool listing served by ``/tools``.
+    
+    Built once per tool registry version; callers must not modify it.
+    """
+    global _tool_list_cache
+    cache = _tool_list_cache
+    if cache[0] != TOOLS.version:
+        ensure_plugins()
+        version = TOOLS.version
+        listing = [_public_description(description) for description in TOOL_DESCRIPTIONS.values()]
+        cache = _tool_list_cache = (version, listing)
+    return cache[1]
+
+
+# Entry-point group that plugin distributions advertise tools under
+PLUGIN_GROUP = "ai_agent.tools"
+
+# Where plugin tool metadata is kept between runs, so plugins needn't be imported to describe them
+TOOL_METADATA_CACHE = os.getenv(
+    "TOOL_METADATA_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "ai-agent", "tool_metadata.json")
+)
+
+
+class LazyTool:
+    """
+    Stand-in for a plugin tool whose module hasn't been imported yet.
+    
+    The first call loads the entry point; later calls go straight to it.
+    """
+    
+    def __init__(self, entry_point: Any, spec: Dict[str, Any]):
+        self.entry_point = entry_point
+        self.tool_spec = spec
+        self.__name__ = spec["name"]
+        self._func: Optional[Callable[..., Any]] = None
+        self._lock = threading.Lock()
+    
+    def load(self) -> Callable[..., Any]:
+        """Import the plugin module, once."""
+        if self._func is None:
+            with self._lock:
+                if self._func is None:
+                    self._func = self.entry_point.load()
+        return self._func
+    
+    def __call__(self, **kwargs):
+        return self.load()(**kwargs)
+
+
+def _entry_points(group: str) -> List[Any]:
+    from importlib.metadata import entry_points
+    discovered = entry_points()
+    if hasattr(discovered, "select"):
+        return list(discovered.select(group=group))
+    return list(discovered.get(group, []))  # Python < 3.10
+
+
+def _read_metadata_cache(path: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    if not path:
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_metadata_cache(path: Optional[str], metadata: Dict[str, Dict[str, Any]]):
+    if not path:
+        return
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(metadata, f)
+        os.replace(temporary, path)
+    except OSError as e:
+        logger.warning(f"Could not write tool metadata cache {path}: {e}")
+
+
+def load_plugins(group: str = PLUGIN_GROUP, cache_path: Optional[str] = TOOL_METADATA_CACHE) -> List[str]:
+    """
+    Register the tools that installed plugins advertise under an entry-point group.
+    
+    Each entry point names a tool and points at its function. Metadata for a
+    plugin version seen before comes from the cache and the tool is
+    registered as a LazyTool, so its module (and its dependencies) load on
+    first call. New plugins are imported once to describe them.
+    
+    Args:
+        group: Entry-point group to scan
+        cache_path: JSON file caching plugin metadata (None disables the cache)
+        
+    Returns:
+        Names of the tools registered
+    """
+    cached = _read_metadata_cache(cache_path)
+    metadata = {}
+    registered = []
+    for entry_point in _entry_points(group):
+        dist = getattr(entry_point, "dist", None)
+        key = f"{entry_point.name}={entry_point.value}@{dist.version if dist else ''}"
+        spec = cached.get(key)
+        try:
+            if spec is not None:
+                func = LazyTool(entry_point, spec)
+            else:
+                func = entry_point.load()
+                spec = dict(getattr(func, "tool_spec", None) or describe_tool(func), name=entry_point.name)
+        except Exception as e:
+            logger.warning(f"Skipping tool plugin {entry_point.name}: {e}")
+            continue
+        _add_tool(func, spec)
+        metadata[key] = spec
+        registered.append(entry_point.name)
+    if metadata != cached:
+        _write_metadata_cache(cache_path, metadata)
+    return registered
+
+
+_plugins_loaded = False
+_plugins_lock = threading.Lock()
+
+
+def ensure_plugins():
+    """
+    Load installed tool plugins the first time the registry is read.
+    
+    Deferred from import so that importing this module (e.g. in the
+    launcher's master before forking) scans no entry points and writes no
+    cache. Does nothing when TOOL_PLUGINS_ENABLED is set to "false".
+    """
+    global _plugins_loaded
+    if not _plugins_loaded:
+        with _plugins_lock:
+            if not _plugins_loaded:
+                if os.getenv("TOOL_PLUGINS_ENABLED", "true").lower() == "true":
+                    load_plugins()
+                _plugins_loaded = True
@@ -0,0 +1,116 @@
+"""
+Startup warmup.
+Does the one-off work of a process's first chat in the background as soon
+as the server starts: resolving and connecting to the upstream, loading the
+tokenizer, compiling the system prompt and tool schemas, and building agents
+for the first sessions.
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from core.agent import get_system_prompt
+from core.context import count_tokens
+from core.function_calling import get_tool_schemas
+from core.sessions import AgentPool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_UPSTREAM_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+_last_report: Optional[Dict[str, Any]] = None
+
+
+def resolve_host(url: str) -> int:
+    """
+    Look up a URL's host, so a caching resolver has the answer ready for the first request.
+
+    Args:
+        url: Any URL on the host
+
+    Returns:
+        Number of addresses found
+
+    Raises:
+        OSError: If the host can't be resolved
+    """
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    return len(socket.getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM))
+
+
+def warmup(url: Optional[str] = None, connect: Optional[Callable[[str], Any]] = None,
+           agent_pool: Optional[AgentPool] = None) -> Dict[str, Any]:
+    """
+    Run every warmup step, timing each.
+
+    A step that fails is logged and reported; the rest still run.
+
+    Args:
+        url: Upstream URL (defaults to the OPENROUTER_BASE_URL environment variable)
+        connect: Opens a kept-alive connection to the upstream URL (None only
+            resolves its host)
+        agent_pool: Pool to fill with agents for the first sessions
+
+    Returns:
+        Report with each step's milliseconds under "steps", failed steps'
+        errors under "errors" and the total under "total_ms"
+    """
+    global _last_report
+    url = url or os.getenv("OPENROUTER_BASE_URL", DEFAULT_UPSTREAM_URL)
+    steps: List[Tuple[str, Callable[[], Any]]] = [("resolve", lambda: resolve_host(url))]
+    if connect is not None:
+        steps.append(("connect", lambda: connect(url)))
+    steps += [
+        ("tokenizer", lambda: count_tokens("warmup")),
+        ("system_prompt", get_system_prompt),
+        ("tool_schemas", get_tool_schemas)
+    ]
+    if agent_pool is not None:
+        steps.append(("agents", agent_pool.fill))
+
+    report: Dict[str, Any] = {"steps": {}, "errors": {}}
+    started = time.perf_counter()
+    for name, step in steps:
+        step_started = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            logger.warning(f"Warmup step '{name}' failed: {e}")
+            report["errors"][name] = str(e)
+        report["steps"][name] = round((time.perf_counter() - step_started) * 1000, 2)
+    report["total_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    _last_report = report
+    return report
+
+
+def start_warmup(url: Optional[str] = None, connect: Optional[Callable[[str], Any]] = None,
+                 agent_pool: Optional[AgentPool] = None) -> Optional[threading.Thread]:
+    """
+    Run the warmup in a background thread, so the server can accept requests meanwhile.
+
+    Takes the same arguments as ``warmup``.
+
+    Returns:
+        The warmup thread, or None when WARMUP_ENABLED is set to "false"
+    """
+    if os.getenv("WARMUP_ENABLED", "true").lower() != "true":
+        return None
+
+    def run():
+        report = warmup(url, connect, agent_pool)
+        logger.info(f"Warmed up in {report['total_ms']} ms: {report['steps']}")
+
+    thread = threading.Thread(target=run, name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def get_warmup_report() -> Optional[Dict[str, Any]]:
+    """Get the report of the last finished warmup, or None if none has finished."""
+    return _last_report
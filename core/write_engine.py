@@ -0,0 +1,352 @@
+"""
+Buffered, atomic file writes for write_to_file.
+Coalesces appends to the same file into one write per flush, replaces whole
+files through a temporary file and a rename, and remembers which
+directories already exist.
+"""
+
+import atexit
+import itertools
+import logging
+import os
+import stat
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingAppends:
+    """Appends to one file waiting for the next flush."""
+
+    __slots__ = ("chunks", "bytes", "base_size")
+
+    def __init__(self, base_size: int):
+        self.chunks: List[bytes] = []
+        self.bytes = 0
+        self.base_size = base_size  # Size of the file before these appends
+
+
+class WriteEngine:
+    """
+    Write path for write_to_file that makes far fewer system calls.
+
+    Appends are buffered per file and written out with one open and one
+    write per file. That happens when the buffer holds ``max_buffer_bytes``,
+    ``flush_interval`` seconds after the first buffered append, before a
+    full write of the same file, before a shell command runs and at exit.
+    A crash loses at most the buffered appends. Full writes go to a
+    temporary file beside the target that is renamed over it, so the file
+    holds either its old or its new content, never a truncated mix.
+    """
+
+    def __init__(self, max_buffer_bytes: int = 1024 * 1024, flush_interval: float = 1.0,
+                 fsync: bool = False, max_known_dirs: int = 1024):
+        """
+        Initialize the engine.
+
+        Args:
+            max_buffer_bytes: Buffered append bytes, across files, that trigger a flush
+            flush_interval: Seconds an append may wait in the buffer (0 writes every
+                append straight away)
+            fsync: Sync each write to disk before reporting it done
+            max_known_dirs: Directories remembered to exist
+        """
+        self.max_buffer_bytes = max_buffer_bytes
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_known_dirs = max_known_dirs
+        self._lock = threading.Lock()
+        # Held while writing to disk, so appends reach a file in order and a
+        # full write never races a flush of the same file
+        self._flush_lock = threading.Lock()
+        self._pending: "OrderedDict[str, _PendingAppends]" = OrderedDict()
+        self._buffered_bytes = 0
+        self._errors: Dict[str, str] = {}
+        self._known_dirs: "OrderedDict[str, None]" = OrderedDict()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self._temporary_ids = itertools.count()
+        self._stats = {
+            "appends": 0, "flushes": 0, "files_flushed": 0, "atomic_writes": 0,
+            "superseded": 0, "dir_cache_hits": 0, "errors": 0
+        }
+
+    @classmethod
+    def from_env(cls) -> "WriteEngine":
+        """Create an engine configured from WRITE_ENGINE_* environment variables."""
+        return cls(
+            max_buffer_bytes=int(os.getenv("WRITE_ENGINE_MAX_BUFFER_BYTES", 1024 * 1024)),
+            flush_interval=float(os.getenv("WRITE_ENGINE_FLUSH_INTERVAL", 1.0)),
+            fsync=os.getenv("WRITE_ENGINE_FSYNC", "false").lower() == "true",
+            max_known_dirs=int(os.getenv("WRITE_ENGINE_MAX_KNOWN_DIRS", 1024))
+        )
+
+    @property
+    def buffered_bytes(self) -> int:
+        return self._buffered_bytes
+
+    def write(self, filepath: str, content: str, mode: str = "w") -> Dict[str, Any]:
+        """
+        Write or append to a file.
+
+        Args:
+            filepath: Path to the file
+            content: Text to write
+            mode: 'w' to replace the file atomically, 'a' to append (buffered)
+
+        Returns:
+            The write_to_file result; appends carry ``buffered``
+
+        Raises:
+            OSError: If the file can't be written (for appends, also when an
+                earlier buffered append to it failed to flush)
+            ValueError: For any other mode
+        """
+        path = os.path.abspath(filepath)
+        data = content.encode("utf-8")
+        if os.linesep != "\n":
+            data = data.replace(b"\n", os.linesep.encode())  # Match text-mode files
+        if mode == "a":
+            file_size = self._append(path, data)
+            return {"success": True, "filepath": filepath, "mode": mode, "bytes_written": len(content),
+                    "file_size": file_size, "buffered": self.flush_interval > 0}
+        if mode != "w":
+            raise ValueError(f"Unsupported write mode '{mode}'")
+        with self._flush_lock if self._has_appends(path) else nullcontext():
+            self._discard_appends(path)
+            self._in_directory(path, lambda: self._replace(path, data))
+        return {"success": True, "filepath": filepath, "mode": mode, "bytes_written": len(content),
+                "file_size": len(data)}
+
+    def flush(self, filepath: Optional[str] = None):
+        """
+        Write buffered appends to disk.
+
+        Args:
+            filepath: Only flush this file (default: every file)
+        """
+        with self._flush_lock:
+            with self._lock:
+                if filepath is None:
+                    batches = list(self._pending.items())
+                    self._pending.clear()
+                else:
+                    path = os.path.abspath(filepath)
+                    pending = self._pending.pop(path, None)
+                    batches = [(path, pending)] if pending is not None else []
+                self._buffered_bytes -= sum(pending.bytes for _, pending in batches)
+                if batches:
+                    self._stats["flushes"] += 1
+            for path, pending in batches:
+                try:
+                    self._in_directory(path, lambda: self._append_to_disk(path, b"".join(pending.chunks)))
+                except OSError as e:
+                    logger.warning(f"Could not flush buffered appends to {path}: {e}")
+                    with self._lock:
+                        self._errors[path] = str(e)
+                        self._stats["errors"] += 1
+                    continue
+                with self._lock:
+                    self._stats["files_flushed"] += 1
+
+    def close(self):
+        """Stop the background flusher and write out everything buffered."""
+        self._stopped.set()
+        self._wake.set()
+        self.flush()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(
+                self._stats,
+                buffered_files=len(self._pending),
+                buffered_bytes=self._buffered_bytes,
+                known_dirs=len(self._known_dirs)
+            )
+
+    def _append(self, path: str, data: bytes) -> int:
+        """Buffer an append, returning the file's size once it is written."""
+        with self._lock:
+            error = self._errors.pop(path, None)
+        if error is not None:
+            raise OSError(f"An earlier buffered append to this file failed: {error}")
+        base_size: Optional[int] = None
+        while True:
+            with self._lock:
+                pending = self._pending.get(path)
+                if pending is None and base_size is not None:
+                    pending = self._pending[path] = _PendingAppends(base_size)
+                if pending is not None:
+                    pending.chunks.append(data)
+                    pending.bytes += len(data)
+                    self._buffered_bytes += len(data)
+                    self._stats["appends"] += 1
+                    file_size = pending.base_size + pending.bytes
+                    flush_now = (
+                        self.flush_interval <= 0 or self._stopped.is_set()
+                        or self._buffered_bytes >= self.max_buffer_bytes
+                    )
+                    break
+            # First append since the last flush: make sure the file can be
+            # reached now, so a bad path fails this call rather than a flush
+            base_size = self._in_directory(path, lambda: self._size(path))
+        if flush_now:
+            self.flush()
+        else:
+            self._start_flusher()
+        return file_size
+
+    def _has_appends(self, path: str) -> bool:
+        with self._lock:
+            return path in self._pending
+
+    def _discard_appends(self, path: str):
+        """Drop buffered appends to a file that is about to be replaced."""
+        with self._lock:
+            pending = self._pending.pop(path, None)
+            self._errors.pop(path, None)
+            if pending is not None:
+                self._buffered_bytes -= pending.bytes
+                self._stats["superseded"] += len(pending.chunks)
+
+    @staticmethod
+    def _size(path: str) -> int:
+        try:
+            return os.stat(path).st_size
+        except FileNotFoundError:
+            return 0
+
+    def _append_to_disk(self, path: str, data: bytes):
+        with open(path, "ab") as f:
+            f.write(data)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _replace(self, path: str, data: bytes):
+        """Write a file through a temporary file renamed over it, keeping its permissions."""
+        try:
+            info = os.lstat(path)
+            if stat.S_ISLNK(info.st_mode):
+                path = os.path.realpath(path)  # Replace the link's target, not the link
+                info = os.stat(path)
+        except FileNotFoundError:
+            info = None
+        temporary = os.path.join(
+            os.path.dirname(path), f".{os.path.basename(path)}.{os.getpid()}.{next(self._temporary_ids)}.tmp"
+        )
+        # Created like open() would create the file, so the umask applies
+        fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            if info is not None:
+                os.chmod(temporary, stat.S_IMODE(info.st_mode))
+            os.replace(temporary, path)
+        except BaseException:
+            try:
+                os.unlink(temporary)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            self._stats["atomic_writes"] += 1
+
+    def _in_directory(self, path: str, action: Callable[[], Any]) -> Any:
+        """
+        Run a file operation once the file's directory exists.
+
+        Directories seen before aren't checked again; if one has since been
+        removed, it is created and the operation retried once.
+        """
+        directory = os.path.dirname(path)
+        known = self._ensure_directory(directory)
+        try:
+            return action()
+        except FileNotFoundError:
+            if not known:
+                raise
+            with self._lock:
+                self._known_dirs.pop(directory, None)
+            self._ensure_directory(directory)
+            return action()
+
+    def _ensure_directory(self, directory: str) -> bool:
+        """Create a directory unless it is known to exist; returns whether it was known."""
+        with self._lock:
+            if directory in self._known_dirs:
+                self._known_dirs.move_to_end(directory)
+                self._stats["dir_cache_hits"] += 1
+                return True
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            self._known_dirs[directory] = None
+            while len(self._known_dirs) > self.max_known_dirs:
+                self._known_dirs.popitem(last=False)
+        return False
+
+    def _start_flusher(self):
+        """Wake the background flusher, starting it on first use."""
+        self._wake.set()
+        if self._flusher is None:
+            with self._lock:
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self._run_flusher, name="write-engine", daemon=True)
+                    self._flusher.start()
+
+    def _run_flusher(self):
+        while not self._stopped.is_set():
+            self._wake.wait()
+            if self._stopped.wait(self.flush_interval):
+                return
+            self._wake.clear()
+            self.flush()
+
+
+_write_engine: Optional[WriteEngine] = None
+_write_engine_lock = threading.Lock()
+
+
+def get_write_engine() -> Optional[WriteEngine]:
+    """
+    Get the process-wide write engine.
+
+    Returns None unless WRITE_ENGINE_ENABLED is set to "true". Buffered
+    appends are flushed when the interpreter exits.
+    """
+    global _write_engine
+    if _write_engine is None and os.getenv("WRITE_ENGINE_ENABLED", "false").lower() == "true":
+        with _write_engine_lock:
+            if _write_engine is None:
+                _write_engine = WriteEngine.from_env()
+                atexit.register(_write_engine.close)
+    return _write_engine
+
+
+def has_pending_writes() -> bool:
+    """Check whether the write engine holds appends not yet on disk."""
+    engine = _write_engine
+    return engine is not None and engine.buffered_bytes > 0
+
+
+def flush_pending_writes():
+    """Write out buffered appends, if any, so other readers (like shell commands) see them."""
+    if has_pending_writes():
+        _write_engine.flush()
+
+
+def close_write_engine():
+    """Write out and drop the process-wide write engine; the next get_write_engine call starts a new one."""
+    global _write_engine
+    with _write_engine_lock:
+        engine, _write_engine = _write_engine, None
+    if engine is not None:
+        atexit.unregister(engine.close)
+        engine.close()
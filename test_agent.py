@@ -0,0 +1,1301 @@
+"""
+Test script to validate agent functionality.
+Runs the agent against a local stand-in for the OpenRouter API, so no API key
+or network access is required.
+"""
+
+import sys
+import os
+import json
+import asyncio
+import signal
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from api.launcher import BoundedQueueMiddleware
+from benchmarks.history import measure_serialization
+from benchmarks.load import compare_reports, run_benchmark
+from core.agent import AIAgent, get_system_prompt
+from core.async_agent import AsyncAIAgent
+from core.batch import BatchOptions, arun_batch, run_batch
+from core.completion_cache import CompletionCache
+from core.context import ContextManager, count_message_tokens
+from core.function_calling import ToolCallAccumulator, extract_tool_calls, parameters_schema, validate_parameters
+from core.http import AsyncPooledHTTPClient, PooledHTTPClient
+from core.jobs import InMemoryJobBroker, JobManager, SQLiteJobBroker
+from core.messages import HistoryView, Message, compact_json, encode_json
+from core.metrics import METRICS, SPECULATIVE_TOOLS
+from core.ratelimit import FairLock, RateLimiter, SQLiteBucketStore
+from core.router import ModelEndpoint, ModelRouter
+from core import shell_pool
+from core.sessions import AgentPool, InMemorySessionStore
+from core.speculation import predict_tool_calls
+from core.storage import JSONLConversationStore, SQLiteConversationStore
+from core.streaming import StreamingReplyParser
+from core.tools import register_tool, unregister_tool
+from core.warmup import get_warmup_report, warmup
+
+
+class FakeOpenRouterHandler(BaseHTTPRequestHandler):
+    """Answers chat completion requests with the next queued reply (a string, or a full message dict)."""
+
+    protocol_version = "HTTP/1.1"
+    replies = []
+    payloads = []
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length))
+        FakeOpenRouterHandler.payloads.append(payload)
+        reply = FakeOpenRouterHandler.replies.pop(0) if FakeOpenRouterHandler.replies else "OK"
+        message = reply if isinstance(reply, dict) else {"role": "assistant", "content": reply}
+        if payload.get("stream"):
+            self._stream_reply(message.get("content") or "", message.get("tool_calls"))
+            return
+        body = json.dumps({
+            "choices": [{"message": message}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5}
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream_reply(self, content, tool_calls=None):
+        """Send the reply as chunked SSE deltas of a few characters each, tool call arguments in halves."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        deltas = [{"content": content[i:i + 4]} for i in range(0, len(content), 4)]
+        for index, call in enumerate(tool_calls or []):
+            arguments = call["function"]["arguments"]
+            half = len(arguments) // 2
+            deltas.append({"tool_calls": [{"index": index, "id": call["id"], "function": {
+                "name": call["function"]["name"], "arguments": arguments[:half]}}]})
+            deltas.append({"tool_calls": [{"index": index, "function": {"arguments": arguments[half:]}}]})
+        lines = [
+            "data: " + json.dumps({"choices": [{"delta": delta}]})
+            for delta in deltas
+        ] + ["data: [DONE]"]
+        for line in lines:
+            data = (line + "\n\n").encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_server():
+    """Start the fake OpenRouter server on a free local port."""
+    FakeOpenRouterHandler.replies = []
+    FakeOpenRouterHandler.payloads = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOpenRouterHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_agent(server, **kwargs):
+    """Create an agent pointed at the fake server."""
+    kwargs.setdefault("http_client", PooledHTTPClient(max_retries=0))
+    agent = AIAgent(api_key="test-key", **kwargs)
+    agent.base_url = f"http://127.0.0.1:{server.server_address[1]}/api/v1/chat/completions"
+    return agent
+
+
+def test_connection_reuse():
+    """Consecutive calls should reuse one pooled connection."""
+    print("\n" + "=" * 60)
+    print("Testing pooled connection reuse")
+    print("=" * 60)
+
+    server = start_fake_server()
+    try:
+        agent = make_agent(server)
+        agent.process_message("Hello")
+        agent.process_message("Hello again")
+        stats = agent.http_client.get_stats()
+        print(f"Pool stats: {stats}")
+
+        assert stats["requests"] == 2, "Both calls should go through the pool"
+        assert stats["connection_misses"] == 1, "Only the first call should open a connection"
+        assert stats["connection_hits"] == 1, "The second call should reuse the connection"
+    finally:
+        server.shutdown()
+
+    print("✓ Connection reuse test passed!")
+
+
+def test_async_agent_tool_call():
+    """AsyncAIAgent should run a tool call and its follow-up without threads."""
+    print("\n" + "=" * 60)
+    print("Testing AsyncAIAgent tool call")
+    print("=" * 60)
+
+    server = start_fake_server()
+    FakeOpenRouterHandler.replies = [
+        json.dumps({"reasoning": "Need to echo", "tool": "run_shell",
+                    "parameters": {"command": "echo async-hello"}}),
+        "The command printed async-hello"
+    ]
+
+    async def run():
+        client = AsyncPooledHTTPClient(max_retries=0)
+        try:
+            agent = AsyncAIAgent(api_key="test-key", http_client=client)
+            agent.base_url = f"http://127.0.0.1:{server.server_address[1]}/api/v1/chat/completions"
+            return await agent.process_message("Echo something"), agent
+        finally:
+            await client.aclose()
+
+    try:
+        result, agent = asyncio.run(run())
+        print(f"Result: {result}")
+
+        assert result["tool_used"] == "run_shell", "Tool call should be executed"
+        assert "async-hello" in result["tool_result"]["output"], "Tool output should be captured"
+        assert result["response"] == "The command printed async-hello", "Follow-up reply should be returned"
+        assert len(agent.get_conversation_history()) == 4, "History should hold all four turns"
+
+        async def reset_during_turn(store):
+            fresh = AsyncAIAgent(api_key="test-key", conversation_store=store, session_id="reset")
+            fresh._add_message("user", "stored")
+            async with fresh._async_turn_lock:
+                reset = asyncio.ensure_future(fresh.areset_conversation())
+                await asyncio.sleep(0.05)
+                assert not reset.done() and len(fresh.conversation_history) == 1, \
+                    "A reset should wait for the turn in progress"
+            await reset
+            return fresh
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = SQLiteConversationStore(os.path.join(tmpdir, "chat.db"))
+            fresh = asyncio.run(reset_during_turn(store))
+            assert fresh.get_conversation_history() == [] and store.load("reset") == [], "Reset should clear both"
+    finally:
+        server.shutdown()
+
+    print("✓ AsyncAIAgent tool call test passed!")
+
+
+def test_streaming_parser():
+    """The parser should spot a tool call before the reply is complete."""
+    print("\n" + "=" * 60)
+    print("Testing incremental tool call detection")
+    print("=" * 60)
+
+    reply = '{"reasoning": "List the \\"files\\"", "tool": "run_shell", "parameters": {"command": "ls"}} trailing'
+    parser = StreamingReplyParser(["run_shell"])
+    events = []
+    for i in range(0, len(reply), 3):
+        events.extend(parser.feed(reply[i:i + 3]))
+        if parser.complete:
+            break
+    reasoning = "".join(text for event, text in events if event == "reasoning")
+    print(f"Reasoning: {reasoning}")
+    print(f"Tool calls: {parser.tool_calls}")
+
+    assert reasoning == 'List the "files"', "Reasoning should be streamed and decoded"
+    assert parser.tool_calls[0]["parameters"] == {"command": "ls"}, "Tool call should be parsed"
+    assert "trailing" not in parser.text, "Parsing should stop when the object closes"
+
+    text_parser = StreamingReplyParser(["run_shell"])
+    tokens = text_parser.feed("Hello") + text_parser.feed(" there")
+    assert tokens == [("token", "Hello"), ("token", " there")], "Text replies should pass straight through"
+
+    for chunks in (["[Note]", " this is", " the rest of the answer"],
+                   ['{"answer": 42}', " is what", " the rest of the answer says"]):
+        prose_parser = StreamingReplyParser(["run_shell"])
+        events = [event for chunk in chunks for event in prose_parser.feed(chunk)] + prose_parser.finish()
+        assert not prose_parser.complete and prose_parser.tool_calls == [], "Only tool calls end the stream early"
+        assert "".join(text for _, text in events) == "".join(chunks) == prose_parser.text, \
+            "A reply that merely starts with a bracket should stream on as text"
+
+    print("✓ Incremental tool call detection test passed!")
+
+
+def test_stream_message():
+    """stream_message should emit tool and follow-up events in order."""
+    print("\n" + "=" * 60)
+    print("Testing streamed tool call")
+    print("=" * 60)
+
+    server = start_fake_server()
+    FakeOpenRouterHandler.replies = [
+        json.dumps({"reasoning": "Need to echo", "tool": "run_shell",
+                    "parameters": {"command": "echo streamed"}}),
+        "Done streaming"
+    ]
+    try:
+        agent = make_agent(server)
+        events = list(agent.stream_message("Echo something"))
+        names = [event["event"] for event in events]
+        print(f"Events: {names}")
+
+        assert FakeOpenRouterHandler.payloads[0]["stream"] is True, "Payload should request streaming"
+        assert "reasoning" in names, "Reasoning should be streamed"
+        assert names.index("tool_call_start") < names.index("tool_call_finish") < names.index("follow_up")
+        done = events[-1]
+        assert done["event"] == "done", "Stream should end with a done event"
+        assert done["data"]["response"] == "Done streaming", "Follow-up should be assembled"
+        assert "streamed" in done["data"]["tool_result"]["output"], "Tool should run"
+    finally:
+        server.shutdown()
+
+    print("✓ Streamed tool call test passed!")
+
+
+def test_system_prompt_cache():
+    """The system prompt should be shared and rebuilt only when tools change."""
+    print("\n" + "=" * 60)
+    print("Testing system prompt cache")
+    print("=" * 60)
+
+    first = AIAgent(api_key="test-key")._build_system_prompt()
+    second = AIAgent(api_key="test-key")._build_system_prompt()
+    assert first is second, "Agents should share one compiled prompt"
+
+    def echo(text: str):
+        return {"success": True, "output": text}
+
+    register_tool(echo, "Echo text back", "text (str)")
+    try:
+        assert "- echo: Echo text back (Parameters: text (str))" in get_system_prompt(), \
+            "Registering a tool should rebuild the prompt"
+    finally:
+        unregister_tool("echo")
+    assert get_system_prompt() == first, "Removing the tool should restore the original prompt"
+
+    print("✓ System prompt cache test passed!")
+
+
+def test_session_store_eviction():
+    """The session store should enforce its count, TTL and byte limits."""
+    print("\n" + "=" * 60)
+    print("Testing bounded session store")
+    print("=" * 60)
+
+    pool = shell_pool._shell_pool = shell_pool.ShellWorkerPool(max_workers=4)
+    try:
+        store = InMemorySessionStore(max_sessions=2, ttl=0.05, max_session_bytes=2000)
+        factory = lambda: AIAgent(api_key="test-key")
+        first = store.get_or_create("a", factory)
+        store.get_or_create("b", factory)
+        pool.run("b", "true")
+        store.get("a")
+        store.get_or_create("c", factory)
+        assert "b" not in store and "a" in store, "The least recently used session should be evicted"
+        assert pool.get_stats()["workers"] == 0, "An evicted session should release its shell worker"
+
+        built = []
+
+        def slow_factory():
+            built.append(1)
+            time.sleep(0.1)
+            return AIAgent(api_key="test-key")
+
+        racing = InMemorySessionStore()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            created = list(executor.map(lambda _: racing.get_or_create("r", slow_factory), range(4)))
+        assert len(built) == 1 and all(agent is created[0] for agent in created), \
+            "Concurrent requests for a new session should share one agent"
+
+        first.conversation_history.extend({"role": "user", "content": "x" * 300} for _ in range(20))
+        held, done = threading.Event(), threading.Event()
+
+        def hold_turn():
+            with first._turn_lock:
+                held.set()
+                done.wait()
+
+        thread = threading.Thread(target=hold_turn)
+        thread.start()
+        held.wait()
+        store.record_usage("a")
+        assert len(first.conversation_history) == 20, "A turn in progress should not be trimmed"
+        done.set()
+        thread.join()
+
+        store.record_usage("a")
+        stats = store.get_stats()
+        print(f"Stats after trimming: {stats}")
+        assert stats["approx_bytes"] <= 2000, "History should be trimmed to the byte budget"
+        assert len(first.conversation_history) < 20, "Oldest messages should be dropped"
+
+        pool.run("a", "true")
+        time.sleep(0.1)
+        assert store.sweep() == 2, "Idle sessions should be swept"
+        assert store.get_stats()["evictions"] == {"lru": 1, "ttl": 2}
+        assert pool.get_stats()["workers"] == 0, "Swept sessions should release their shell workers"
+    finally:
+        shell_pool._shell_pool = None
+        pool.close()
+
+    print("✓ Bounded session store test passed!")
+
+
+def test_context_budget():
+    """Requests should stay within the token budget as the session grows."""
+    print("\n" + "=" * 60)
+    print("Testing context-window management")
+    print("=" * 60)
+
+    server = start_fake_server()
+    try:
+        agent = make_agent(server, context_manager=ContextManager(max_tokens=1500, keep_recent=2))
+        for i in range(20):
+            FakeOpenRouterHandler.replies.append(json.dumps({
+                "tool": "run_shell", "parameters": {"command": f"printf '%0400d' {i}"}
+            }))
+            FakeOpenRouterHandler.replies.append(f"Step {i} done")
+            agent.process_message(f"Run step {i}")
+
+        sent = FakeOpenRouterHandler.payloads[-1]["messages"]
+        sent_tokens = sum(count_message_tokens(message) for message in sent)
+        print(f"History: {len(agent.conversation_history)} messages, last request: {len(sent)} messages / {sent_tokens} tokens")
+        assert sent_tokens <= 1500, "Request should fit the budget"
+        assert len(agent.conversation_history) == 80, "Full history should be kept"
+        assert any("Result omitted" in message["content"] for message in sent), "Old tool outputs should be dropped"
+
+        native = [
+            {"role": "user", "content": "List the files"},
+            {"role": "assistant", "content": "", "tool_calls": [{
+                "id": "c1", "type": "function", "function": {"name": "run_shell", "arguments": '{"command": "ls"}'}
+            }]},
+            {"role": "tool", "tool_call_id": "c1", "content": "x " * 2000},
+            {"role": "assistant", "content": "Here they are"}
+        ] + [{"role": role, "content": "Next"} for role in ("user", "assistant", "user", "assistant", "user")]
+        fitted = ContextManager(max_tokens=700, keep_recent=2).fit(native, "You are helpful.")
+        assert len(fitted) == 9 and "Result omitted" in fitted[2]["content"], \
+            "Dropping a native tool output should free its tokens, so nothing else is trimmed"
+
+        FakeOpenRouterHandler.replies = ["The user ran many steps.", "Hi"]
+        summarizing = make_agent(server, context_manager=ContextManager(
+            max_tokens=1500, strategy="summarize", keep_recent=2
+        ))
+        summarizing.conversation_history = [dict(message) for message in agent.conversation_history]
+        summarizing.process_message("Anything else?")
+        history = summarizing.get_conversation_history()
+        assert history[0]["content"].endswith("The user ran many steps."), "Old turns should be summarized"
+        assert len(history) == 4, "Summary, the two recent messages and the reply should remain"
+    finally:
+        server.shutdown()
+
+    print("✓ Context-window management test passed!")
+
+
+def test_parallel_tool_loop():
+    """Several tool calls in one reply should run concurrently, then the loop continues."""
+    print("\n" + "=" * 60)
+    print("Testing multi-step parallel tool loop")
+    print("=" * 60)
+
+    server = start_fake_server()
+    FakeOpenRouterHandler.replies = [
+        json.dumps([
+            {"tool": "run_shell", "parameters": {"command": "sleep 0.5; echo first"}},
+            {"tool": "run_shell", "parameters": {"command": "sleep 0.5; echo second"}}
+        ]),
+        json.dumps({"tool": "run_shell", "parameters": {"command": "echo third"}}),
+        "All three done"
+    ]
+    try:
+        agent = make_agent(server, max_steps=3)
+        started = time.perf_counter()
+        result = agent.process_message("Run three commands")
+        elapsed = time.perf_counter() - started
+        print(f"Steps: {result['steps']}")
+
+        outputs = [call["result"]["output"].strip() for call in result["tool_calls"]]
+        assert outputs == ["first", "second", "third"], "Results should keep request order"
+        assert elapsed < 0.9, "Calls in one step should run concurrently"
+        assert result["response"] == "All three done", "Loop should end on a text reply"
+        assert len(result["steps"]) == 3 and result["steps"][0]["tools_ms"] > 0, "Steps should be timed"
+
+        FakeOpenRouterHandler.replies = [
+            json.dumps({"tool": "run_shell", "parameters": {"command": "echo once"}}),
+            json.dumps({"tool": "run_shell", "parameters": {"command": "echo twice"}})
+        ]
+        limited = make_agent(server, max_steps=1)
+        result = limited.process_message("Run until told to stop")
+        assert result["tool_used"] == "run_shell" and len(result["tool_calls"]) == 1, \
+            "Only max_steps tool steps should run"
+        assert result["response"].startswith("{"), "The reply after the last step is returned as is"
+    finally:
+        server.shutdown()
+
+    print("✓ Multi-step parallel tool loop test passed!")
+
+
+def test_conversation_store():
+    """Sessions should persist, resume windowed and be shared between agents."""
+    print("\n" + "=" * 60)
+    print("Testing persistent conversation stores")
+    print("=" * 60)
+
+    server = start_fake_server()
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for store in (SQLiteConversationStore(os.path.join(tmpdir, "chat.db")),
+                          JSONLConversationStore(os.path.join(tmpdir, "logs"))):
+                first = make_agent(server, session_id="s1", conversation_store=store)
+                FakeOpenRouterHandler.replies = ["one", "two"]
+                first.process_message("Hello")
+                first.process_message("Again")
+
+                # A second worker process resumes the session from the store
+                second = make_agent(server, session_id="s1", conversation_store=store, history_window=3)
+                FakeOpenRouterHandler.replies = ["three"]
+                second.process_message("Third")
+                sent = FakeOpenRouterHandler.payloads[-1]["messages"]
+                print(f"{type(store).__name__}: resumed request carried {len(sent)} messages")
+                assert [m["content"] for m in sent[1:]] == ["one", "Again", "two", "Third"], \
+                    "Resumed agent should load the latest window"
+
+                first.process_message("Fourth")
+                assert FakeOpenRouterHandler.payloads[-1]["messages"][-2]["content"] == "three", \
+                    "Agent should pick up turns served elsewhere"
+
+                history, total = first.get_history_page(offset=2, limit=3)
+                assert total == 8, "Store should hold every turn"
+                assert [m["content"] for m in history] == ["Again", "two", "Third"], "Page should slice the transcript"
+                assert store.load("s1", limit=2) == [
+                    {"role": "user", "content": "Fourth"}, {"role": "assistant", "content": "OK"}
+                ], "Windowed load should return the latest messages"
+
+                second.reset_conversation()
+                assert store.page("s1") == ([], 0), "Reset should clear the stored transcript"
+                first.process_message("Fresh")
+                assert len(FakeOpenRouterHandler.payloads[-1]["messages"]) == 2, "Other agents should see the reset"
+    finally:
+        server.shutdown()
+
+    print("✓ Conversation store test passed!")
+
+
+def test_prefork_launcher():
+    """Workers should share the socket, report health, shed load and drain on SIGTERM."""
+    print("\n" + "=" * 60)
+    print("Testing prefork launcher")
+    print("=" * 60)
+
+    def slow_app(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        time.sleep(0.3)
+        return [b"ok"]
+
+    middleware = BoundedQueueMiddleware(slow_app, max_concurrency=1, max_queue=1, queue_timeout=2)
+    statuses = []
+
+    def call():
+        response = {}
+        body = middleware({"PATH_INFO": "/chat", "REQUEST_METHOD": "POST"},
+                          lambda status, headers: response.update(status=status, headers=dict(headers)))
+        b"".join(body)
+        getattr(body, "close", lambda: None)()
+        statuses.append((response["status"][:3], response["headers"].get("Retry-After")))
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    for thread in threads:
+        thread.join()
+    print(f"Statuses: {statuses}")
+    assert sorted(statuses) == [("200", None), ("200", None), ("503", "1")], \
+        "One request runs, one queues and the third is rejected with Retry-After"
+    assert middleware.in_flight == 0, "Slots should be released after each response"
+
+    env = dict(os.environ, OPENROUTER_API_KEY="test-key", PORT="0", WEB_CONCURRENCY="2")
+    master = subprocess.Popen([sys.executable, "-m", "api.launcher"], env=env,
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stderr=subprocess.PIPE, text=True)
+    try:
+        port = int(master.stderr.readline().split(" with ")[0].rsplit(":", 1)[1])
+        time.sleep(1.5)
+        health = json.loads(urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=5).read())
+        print(f"Workers: {health['workers']}")
+        assert len(health["workers"]["workers"]) == 2, "Health should list every worker"
+        assert all(worker["pid"] for worker in health["workers"]["workers"]), "Every worker should be running"
+
+        master.send_signal(signal.SIGTERM)
+        assert master.wait(timeout=10) == 0, "Launcher should drain and exit cleanly"
+    finally:
+        if master.poll() is None:
+            master.kill()
+        master.stderr.close()
+
+    print("✓ Prefork launcher test passed!")
+
+
+def test_metrics():
+    """Agent phases, tools and token usage should land in the metrics registry."""
+    print("\n" + "=" * 60)
+    print("Testing latency histograms and token counters")
+    print("=" * 60)
+
+    server = start_fake_server()
+    FakeOpenRouterHandler.replies = [
+        json.dumps({"tool": "run_shell", "parameters": {"command": "true"}}),
+        "Done"
+    ]
+    try:
+        agent = make_agent(server, model="test/metrics-model")
+        result = agent.process_message("Run it")
+        assert result["response"] == "Done", "Tool loop should finish"
+        agent._run_tool({"tool": "made_up_tool", "parameters": {}})
+
+        snapshot = METRICS.snapshot()
+        llm = [s for s in snapshot["agent_llm_seconds"] if s["labels"]["model"] == "test/metrics-model"]
+        print(f"LLM series: {llm}")
+        assert sorted(s["labels"]["step"] for s in llm) == ["1", "2"], "Each round trip should be labelled by step"
+        assert all(s["p50"] is not None and s["p99"] >= s["p50"] for s in llm), "Quantiles should be reported"
+        tokens = {s["labels"]["direction"]: s["value"] for s in snapshot["llm_tokens_total"]
+                  if s["labels"]["model"] == "test/metrics-model"}
+        assert tokens == {"in": 20, "out": 10}, "Usage from both responses should be counted"
+
+        text = METRICS.render_prometheus()
+        assert 'agent_tool_seconds_count{tool="run_shell"}' in text, "Tool latency should be exposed"
+        assert "made_up_tool" not in text and 'agent_tool_seconds_count{tool="unknown"}' in text, \
+            "Unregistered tool names should share one label"
+        assert ('agent_phase_seconds_bucket{phase="build_messages",model="test/metrics-model",le="+Inf"} 2'
+                in text), "Histogram buckets should be cumulative up to +Inf"
+    finally:
+        server.shutdown()
+
+    print("✓ Metrics test passed!")
+
+
+def test_benchmark_smoke():
+    """Test the offline benchmark end to end at a low request rate."""
+    print("\n" + "=" * 60)
+    print("Testing Offline Benchmark")
+    print("=" * 60)
+
+    report = run_benchmark(rps=4, duration=1.5, sessions=3, llm_latency=0.01, tool_call_rate=0.5)
+    print(f"Report: {report['ok']} ok, {report['errors']} errors, p50 {report['latency_p50_ms']} ms")
+    assert report["requests"] == 6, "One request should be scheduled per 1/rps seconds"
+    assert report["errors"] == 0, f"Mocked requests should succeed: {report['error_kinds']}"
+    assert report["latency_p50_ms"] <= report["latency_p99_ms"], "Percentiles should be ordered"
+    assert json.loads(json.dumps(report)) == report, "Report should be JSON serializable"
+
+    worse = dict(report, throughput_rps=report["throughput_rps"] / 2)
+    lines = compare_reports(report, worse)
+    assert any(line.startswith("  throughput_rps") and line.endswith("worse") for line in lines), \
+        "Lower throughput should be reported as worse"
+
+    print("✓ Offline benchmark test passed!")
+
+
+class RateLimitedHandler(BaseHTTPRequestHandler):
+    """Answers every request with 429 Too Many Requests."""
+
+    protocol_version = "HTTP/1.1"
+    requests = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        RateLimitedHandler.requests += 1
+        self.send_response(429)
+        self.send_header("Retry-After", "30")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_model_router():
+    """The router should fall back on 429s and hedge calls slower than their p95."""
+    print("\n" + "=" * 60)
+    print("Testing Model Router")
+    print("=" * 60)
+
+    server = start_fake_server()
+    limited = ThreadingHTTPServer(("127.0.0.1", 0), RateLimitedHandler)
+    threading.Thread(target=limited.serve_forever, daemon=True).start()
+    try:
+        router = ModelRouter([
+            ModelEndpoint("test/limited", f"http://127.0.0.1:{limited.server_address[1]}/"),
+            ModelEndpoint("test/healthy", f"http://127.0.0.1:{server.server_address[1]}/")
+        ])
+        # The default client, so its own 429 retries would show
+        agent = make_agent(server, router=router, http_client=None)
+        FakeOpenRouterHandler.replies = ["Served"]
+        RateLimitedHandler.requests = 0
+        started = time.perf_counter()
+        result = agent.process_message("Hello")
+        assert time.perf_counter() - started < 2 and RateLimitedHandler.requests == 1, \
+            "A routed 429 should fall back at once instead of being retried by the HTTP client"
+        stats = router.get_stats()
+        print(f"Router stats: {stats}")
+        assert result["response"] == "Served" and result["model"] == "test/healthy", "Should fall back on 429"
+        assert result["steps"][0]["model"] == "test/healthy", "Each step should report its model"
+        assert FakeOpenRouterHandler.payloads[-1]["model"] == "test/healthy", "Request should name the fallback model"
+        assert stats["fallbacks"] == 1 and stats["endpoints"][0]["cooling_down"], "Rate-limited model should sit out"
+        assert router.ranked()[0].endpoint.model == "test/healthy", "Cooling-down model should rank last"
+
+        async def routed_async():
+            client = AsyncPooledHTTPClient()
+            try:
+                async_router = ModelRouter([
+                    ModelEndpoint("test/limited", f"http://127.0.0.1:{limited.server_address[1]}/"),
+                    ModelEndpoint("test/healthy", f"http://127.0.0.1:{server.server_address[1]}/")
+                ])
+                async_agent = AsyncAIAgent(api_key="test-key", http_client=client, router=async_router)
+                return await async_agent.process_message("Hello")
+            finally:
+                await client.aclose()
+
+        RateLimitedHandler.requests = 0
+        FakeOpenRouterHandler.replies = ["Served async"]
+        result = asyncio.run(routed_async())
+        assert result["response"] == "Served async" and RateLimitedHandler.requests == 1, \
+            "The async client should leave routed 429s to the router too"
+    finally:
+        server.shutdown()
+        limited.shutdown()
+
+    # The fast model stalls; after its p95 the slower one is asked too and wins
+    delays = {"fast": 1.0, "slow": 0.02}
+    router = ModelRouter([ModelEndpoint("fast", ""), ModelEndpoint("slow", "")], min_samples=3)
+    router.endpoints[0].latencies.extend([0.01] * 3)
+    router.endpoints[1].latencies.extend([0.02] * 3)
+
+    def send(endpoint):
+        time.sleep(delays[endpoint.model])
+        return endpoint.model
+
+    started = time.perf_counter()
+    result, endpoint = router.call(send)
+    elapsed = time.perf_counter() - started
+    print(f"Hedged call served by {endpoint.model} in {elapsed * 1000:.0f}ms")
+    assert result == "slow" and elapsed < 0.5, "Hedged request should answer first"
+    assert router.hedges == 1 and router.hedge_wins == 1, "Hedge should be counted"
+
+    async def send_async(endpoint):
+        await asyncio.sleep(delays[endpoint.model])
+        return endpoint.model
+
+    router.endpoints[0].latencies.clear()
+    router.endpoints[0].latencies.extend([0.01] * 3)
+    started = time.perf_counter()
+    result, endpoint = asyncio.run(router.acall(send_async))
+    assert result == "slow" and time.perf_counter() - started < 0.5, "Async hedge should answer first"
+
+    print("✓ Model router test passed!")
+
+
+def test_completion_cache():
+    """Repeated first messages should be answered from the completion cache."""
+    print("\n" + "=" * 60)
+    print("Testing Completion Cache")
+    print("=" * 60)
+
+    server = start_fake_server()
+    try:
+        cache = CompletionCache(similarity_threshold=0.8)
+        FakeOpenRouterHandler.replies = ["Hi there"]
+        first = make_agent(server, completion_cache=cache, session_id="first", temperature=0)
+        assert first.process_message("Hello! What can you help me with?")["response"] == "Hi there"
+
+        second = make_agent(server, completion_cache=cache, session_id="second", temperature=0)
+        assert second.process_message("Hello! What can you help me with?")["response"] == "Hi there"
+        third = make_agent(server, completion_cache=cache, session_id="third", temperature=0)
+        assert third.process_message("hello, what can you help me with")["response"] == "Hi there"
+        assert len(FakeOpenRouterHandler.payloads) == 1, "Repeats should not reach the API"
+        session = cache.get_session_stats("second")
+        print(f"Session stats: {session}")
+        assert session["hits"] == 1 and session["saved_tokens"] == 15, "Hits and savings should be per session"
+        assert cache.get_session_stats("third")["similar_hits"] == 1, "Near-identical message should match"
+
+        # Turns with tool results and sampled requests (by default too) always go upstream
+        FakeOpenRouterHandler.replies = [
+            '{"tool": "run_shell", "parameters": {"command": "echo cached"}}', "Ran it"
+        ]
+        tools_agent = make_agent(server, completion_cache=cache, session_id="tools", temperature=0)
+        assert tools_agent.process_message("Run echo")["response"] == "Ran it"
+        sampled = make_agent(server, completion_cache=cache, session_id="sampled", temperature=0.7)
+        sampled.process_message("Hello! What can you help me with?")
+        assert FakeOpenRouterHandler.payloads[-1]["temperature"] == 0.7, "Temperature should be sent"
+        default = make_agent(server, completion_cache=cache, session_id="default")
+        default.process_message("Hello! What can you help me with?")
+        assert "temperature" not in FakeOpenRouterHandler.payloads[-1]
+        assert len(FakeOpenRouterHandler.payloads) == 5, "Tool follow-up and sampled requests should miss"
+        assert cache.get_session_stats("tools")["skipped"] == 1, "Tool-result turn should skip the cache"
+        assert cache.get_session_stats("sampled")["skipped"] == 1, "Sampled request should skip the cache"
+        assert cache.get_session_stats("default")["skipped"] == 1, "Provider-default sampling should skip the cache"
+    finally:
+        server.shutdown()
+
+    print("✓ Completion cache test passed!")
+
+
+def test_function_calling():
+    """Tool calls should be found in wrapped text, read from native tool_calls and validated."""
+    print("\n" + "=" * 60)
+    print("Testing structured tool calling")
+    print("=" * 60)
+
+    tools = {"run_shell": None, "write_to_file": None}
+    wrapped = 'Sure, running it now:\n```json\n{"tool": "run_shell", "parameters": {"command": "echo \\"}\\""}}\n```'
+    assert extract_tool_calls(wrapped, tools) == [
+        {"tool": "run_shell", "parameters": {"command": 'echo "}"'}}
+    ], "Call inside prose and a code fence should be found"
+    assert extract_tool_calls("Use {braces} or [1, 2] freely.", tools) == [], "Plain text has no calls"
+
+    schema = parameters_schema("command (str), timeout (int, optional)")
+    assert schema["required"] == ["command"] and schema["properties"]["timeout"] == {"type": "integer"}
+    assert validate_parameters("run_shell", {"command": "ls"}) is None
+    assert "missing" in validate_parameters("run_shell", {}), "Missing parameter should be reported"
+    assert "type integer" in validate_parameters("run_shell", {"command": "ls", "timeout": "soon"})
+
+    server = start_fake_server()
+    try:
+        call = {"id": "call_1", "type": "function",
+                "function": {"name": "run_shell", "arguments": json.dumps({"command": "echo native"})}}
+        FakeOpenRouterHandler.replies = [
+            {"role": "assistant", "content": None, "tool_calls": [call]}, "Done natively"
+        ]
+        agent = make_agent(server, tool_calling="native")
+        result = agent.process_message("Run echo")
+        assert result["response"] == "Done natively"
+        assert result["tool_calls"][0]["result"]["output"].strip() == "native"
+        first, second = FakeOpenRouterHandler.payloads
+        assert first["tools"][0]["type"] == "function", "Native mode should send function schemas"
+        tool_message = second["messages"][-1]
+        assert tool_message["role"] == "tool" and tool_message["tool_call_id"] == "call_1", \
+            "Native results should go back as tool messages"
+        assert second["messages"][-2]["tool_calls"][0]["id"] == "call_1"
+
+        FakeOpenRouterHandler.replies = [
+            {"role": "assistant", "content": "", "tool_calls": [call]}, "Streamed natively"
+        ]
+        events = list(make_agent(server, tool_calling="native").stream_message("Run echo"))
+        assert events[-1]["data"]["tool_calls"][0]["result"]["output"].strip() == "native", \
+            "Streamed tool call fragments should be reassembled"
+
+        FakeOpenRouterHandler.replies = [
+            'Running: {"tool": "run_shell", "parameters": {"cmd": "echo bad"}}', "Gave up"
+        ]
+        result = make_agent(server).process_message("Run echo")
+        rejected = result["tool_calls"][0]["result"]
+        print(f"Rejected call: {rejected}")
+        assert rejected["success"] is False and "Invalid parameters" in rejected["error"], \
+            "Invalid parameters should be rejected before dispatch"
+    finally:
+        server.shutdown()
+
+    print("✓ Structured tool calling test passed!")
+
+
+def test_background_jobs():
+    """Long tool calls should run as jobs and the agent should resume when they finish."""
+    print("\n" + "=" * 60)
+    print("Testing background jobs")
+    print("=" * 60)
+
+    server = start_fake_server()
+    manager = JobManager(threshold=1, max_workers=2, max_per_session=1)
+    try:
+        FakeOpenRouterHandler.replies = [
+            json.dumps({"tool": "run_shell", "parameters": {
+                "command": "echo start; sleep 0.5; echo end", "timeout": 5
+            }}),
+            "Started it in the background",
+            "The job printed start and end"
+        ]
+        agent = make_agent(server, job_manager=manager)
+        started = time.perf_counter()
+        result = agent.process_message("Run the long command")
+        elapsed = time.perf_counter() - started
+        assert result["response"] == "Started it in the background"
+        assert elapsed < 0.4, "The chat request should not wait for the job"
+        job_id = result["tool_result"]["job_id"]
+
+        events = list(manager.stream(job_id, timeout=10))
+        print(f"Job events: {[event['event'] for event in events]}")
+        output = "".join(event["data"]["text"] for event in events if event["event"] == "output")
+        assert "start" in output and "end" in output, "Job output should be streamed"
+        done = events[-1]["data"]
+        assert done["status"] == "succeeded" and done["follow_up"]["response"] == "The job printed start and end", \
+            "The agent should resume with the job's result"
+        assert job_id in FakeOpenRouterHandler.payloads[-1]["messages"][-1]["content"], \
+            "The job result should be sent to the model"
+        assert agent.get_conversation_history()[-1]["content"] == "The job printed start and end"
+    finally:
+        server.shutdown()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        limited = JobManager(SQLiteJobBroker(os.path.join(tmpdir, "jobs.db")), max_per_session=1, max_queued=1)
+        release = threading.Event()
+        first = limited.submit("s", "run_shell", {}, lambda on_output: release.wait(5) and {"success": True})
+        second = limited.submit("s", "run_shell", {}, lambda on_output: {"success": True})
+        try:
+            limited.submit("s", "run_shell", {}, lambda on_output: {"success": True})
+            assert False, "A full queue should reject new jobs"
+        except RuntimeError:
+            pass
+        time.sleep(0.1)
+        stats = limited.get_stats()
+        print(f"Job stats: {stats}")
+        assert stats["running"] == 1 and stats["queued"] == 1, "Per-session bound should hold the second job"
+        assert limited.get(second["id"])["status"] == "queued"
+        release.set()
+        assert list(limited.stream(second["id"], timeout=5))[-1]["data"]["status"] == "succeeded"
+        assert [job["id"] for job in limited.list("s")] == [first["id"], second["id"]]
+
+    class FlakyBroker(InMemoryJobBroker):
+        def update(self, job_id, **fields):
+            if fields.get("status") == "succeeded":
+                raise sqlite3.OperationalError("database is locked")
+            super().update(job_id, **fields)
+
+    flaky = JobManager(FlakyBroker())
+    job = flaky.submit("s", "run_shell", {}, lambda on_output: {"success": True})
+    finished = list(flaky.stream(job["id"], timeout=5))[-1]["data"]
+    assert finished["status"] == "failed" and "database is locked" in finished["result"]["error"], \
+        "A job whose result can't be stored should end up failed, not running"
+    assert flaky.get_stats()["running"] == 0
+
+    print("✓ Background jobs test passed!")
+
+
+def test_batch_processing():
+    """Batches should run concurrently, retry failed items and keep each session's messages in order."""
+    print("\n" + "=" * 60)
+    print("Testing batch processing")
+    print("=" * 60)
+
+    def slow(session_id, message):
+        time.sleep(0.1)
+        return {"response": message}
+
+    items = [(None, f"m{i}") for i in range(8)]
+    timings = {}
+    for concurrency in (1, 4):
+        started = time.perf_counter()
+        outcomes = list(run_batch(items, slow, BatchOptions(max_concurrency=concurrency)))
+        timings[concurrency] = time.perf_counter() - started
+        assert sorted(outcome["index"] for outcome in outcomes) == list(range(8)), "Every item should be reported"
+    print(f"Batch of 8 at concurrency 1 vs 4: {timings[1]:.2f}s vs {timings[4]:.2f}s")
+    assert timings[4] < timings[1] / 2, "Throughput should scale with the concurrency limit"
+
+    attempts = {}
+
+    def flaky(session_id, message):
+        attempts[message] = attempts.get(message, 0) + 1
+        if message == "boom":
+            raise RuntimeError("upstream down")
+        if message == "flaky" and attempts[message] == 1:
+            return {"error": "try again"}
+        return {"response": message}
+
+    outcomes = {
+        outcome["result"].get("response", "boom"): outcome
+        for outcome in run_batch([(None, "ok"), (None, "flaky"), (None, "boom")], flaky,
+                                 BatchOptions(max_retries=1, retry_backoff=0))
+    }
+    assert outcomes["ok"]["status"] == "ok" and outcomes["ok"]["attempts"] == 1
+    assert outcomes["flaky"]["status"] == "ok" and outcomes["flaky"]["attempts"] == 2, "Errors should be retried"
+    assert outcomes["boom"]["status"] == "error" and outcomes["boom"]["attempts"] == 2, \
+        "A failing item should be reported without affecting the others"
+
+    started = time.perf_counter()
+    list(run_batch([(None, "x")] * 5, lambda session_id, message: {}, BatchOptions(max_concurrency=1, rate=20)))
+    assert time.perf_counter() - started >= 0.18, "The rate budget should pace item starts"
+
+    def broken_admit(session_id):
+        raise RuntimeError("rate store unavailable")
+
+    async def process_async(session_id, message):
+        return {"response": message}
+
+    async def collect_async(batch, options):
+        return [outcome async for outcome in arun_batch(batch, process_async, options)]
+
+    batch, options = [("s", "a"), ("s", "b"), (None, "c")], BatchOptions(admit=broken_admit)
+    for outcomes in (list(run_batch(batch, lambda session_id, message: {"response": message}, options)),
+                     asyncio.run(collect_async(batch, options))):
+        assert sorted(outcome["index"] for outcome in outcomes) == [0, 1, 2], "Every item should be reported"
+        assert all(outcome["status"] == "error" and outcome["attempts"] == 0 for outcome in outcomes), \
+            "An admission failure should be reported as the item's error"
+
+    server = start_fake_server()
+    base_url = os.environ.get("OPENROUTER_BASE_URL")
+    os.environ["OPENROUTER_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}/api/v1/chat/completions"
+    try:
+        sessions = {}
+
+        def factory(session_id):
+            return sessions.setdefault(session_id, make_agent(server, session_id=session_id))
+
+        batch = [("a", "first"), ("b", "other"), ("a", "second"), (None, "one-off")]
+        outcomes = list(AIAgent.process_batch(
+            batch, agent_factory=factory, options=BatchOptions(max_concurrency=4),
+            api_key="test-key", http_client=PooledHTTPClient(max_retries=0)
+        ))
+        assert all(outcome["status"] == "ok" for outcome in outcomes), f"Items should succeed: {outcomes}"
+        assert {outcome["session_id"] for outcome in outcomes} == {"a", "b", None}
+        history = [message["content"] for message in sessions["a"].get_conversation_history()]
+        assert history == ["first", "OK", "second", "OK"], "A session's messages should run in order"
+        assert set(sessions) == {"a", "b"}, "Items without a session should not use the factory"
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = JSONLConversationStore(tmpdir)
+            agent = make_agent(server, session_id="s", conversation_store=store)
+            make_api_call, calls = agent._make_api_call, []
+
+            def fail_once(*args, **kwargs):
+                calls.append(args)
+                if len(calls) == 1:
+                    raise RuntimeError("upstream down")
+                return make_api_call(*args, **kwargs)
+
+            agent._make_api_call = fail_once
+            outcomes = list(AIAgent.process_batch(
+                [("s", "retry me")], agent_factory=lambda session_id: agent,
+                options=BatchOptions(max_retries=1, retry_backoff=0)
+            ))
+            assert outcomes[0]["status"] == "ok" and outcomes[0]["attempts"] == 2, f"Should be retried: {outcomes}"
+            stored = [message["content"] for message in store.load("s")]
+            assert stored == ["retry me", "OK"], f"A failed attempt should not reach the store: {stored}"
+            agent._sync_history()
+            assert [message["content"] for message in agent.get_conversation_history()] == stored
+
+        async def run_async():
+            client = AsyncPooledHTTPClient(max_retries=0)
+            try:
+                return [outcome async for outcome in AsyncAIAgent.process_batch(
+                    [(None, "hi"), (None, "there")], options=BatchOptions(max_concurrency=2),
+                    api_key="test-key", http_client=client
+                )]
+            finally:
+                await client.aclose()
+
+        async_outcomes = asyncio.run(run_async())
+        assert [outcome["status"] for outcome in async_outcomes] == ["ok", "ok"], "Async batches should run too"
+    finally:
+        if base_url is None:
+            os.environ.pop("OPENROUTER_BASE_URL")
+        else:
+            os.environ["OPENROUTER_BASE_URL"] = base_url
+        server.shutdown()
+
+    print("✓ Batch processing test passed!")
+
+
+def test_rate_limits():
+    """Turns should queue in arrival order and budgets should hold per session, IP and globally."""
+    print("\n" + "=" * 60)
+    print("Testing rate limits and session serialization")
+    print("=" * 60)
+
+    lock = FairLock()
+    order = []
+
+    def waiter(name):
+        with lock:
+            order.append(name)
+
+    with lock:
+        with lock:
+            pass  # Reentrant
+        threads = []
+        for name in range(5):
+            thread = threading.Thread(target=waiter, args=(name,))
+            thread.start()
+            threads.append(thread)
+            while lock.waiting < name + 1:
+                time.sleep(0.001)
+    for thread in threads:
+        thread.join()
+    assert order == [0, 1, 2, 3, 4], "Waiters should be served in arrival order"
+
+    with lock:
+        tried = []
+        thread = threading.Thread(target=lambda: tried.append(lock.acquire(blocking=False)))
+        thread.start()
+        thread.join()
+        assert tried == [False] and lock.waiting == 0, "A non-blocking acquire should not queue"
+
+    limiter = RateLimiter({("session", "requests"): 2, ("ip", "requests"): 3, ("global", "tokens"): 100})
+    assert limiter.check("a", "10.0.0.1") == (0, None)
+    assert limiter.check("a", "10.0.0.1") == (0, None)
+    wait, scope = limiter.check("a", "10.0.0.1")
+    assert scope == "session" and 0 < wait <= 30, "A session's third request in a minute should wait"
+    assert limiter.check("b", "10.0.0.1") == (0, None), "A refused request should not be charged"
+    assert limiter.check("c", "10.0.0.1")[1] == "ip", "The client's fourth request should hit the IP budget"
+    limiter.charge_tokens("b", "10.0.0.2", 150)
+    wait, scope = limiter.check("d", "10.0.0.2")
+    assert scope == "global" and wait > 0, "Upstream token debt should hold back the next request"
+    stats = limiter.get_stats()
+    print(f"Limiter stats: {stats}")
+    assert stats["admitted"] == 3 and stats["limited"] == {"session": 1, "ip": 1, "global": 1}
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "ratelimit.db")
+        first = RateLimiter({("ip", "requests"): 1}, SQLiteBucketStore(path))
+        second = RateLimiter({("ip", "requests"): 1}, SQLiteBucketStore(path))
+        assert first.check(None, "10.0.0.3")[1] is None
+        assert second.check(None, "10.0.0.3")[1] == "ip", "Workers sharing the database should share budgets"
+
+    server = start_fake_server()
+    try:
+        agent = make_agent(server)
+        threads = [threading.Thread(target=agent.process_message, args=(f"m{i}",)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        roles = [message["role"] for message in agent.get_conversation_history()]
+        assert roles == ["user", "assistant"] * 4, "Concurrent turns on one session should not interleave"
+        result = agent.process_message("count")
+        assert result["steps"][0]["tokens"] == 15, "Steps should report the upstream tokens they used"
+        assert agent.tokens_used == 75
+    finally:
+        server.shutdown()
+
+    print("✓ Rate limits test passed!")
+
+
+def test_compact_messages():
+    """History messages should be compact mappings that encode like the dicts they replace."""
+    print("\n" + "=" * 60)
+    print("Testing compact history messages")
+    print("=" * 60)
+
+    message = Message.from_dict(json.loads('{"role": "tool", "content": "{}", "tool_call_id": "call_1"}'))
+    assert message == {"role": "tool", "content": "{}", "tool_call_id": "call_1"}, "Messages should equal their dicts"
+    assert message["tool_call_id"] == "call_1" and message.get("tool_calls") is None
+    assert message.role is sys.intern("tool"), "Roles should be interned"
+    assert not hasattr(message, "__dict__"), "Messages should not carry a per-instance dict"
+    assert json.loads(encode_json([message])) == [message.to_dict()]
+    assert json.loads(compact_json({"history": [message]})) == {"history": [message.to_dict()]}
+
+    server = start_fake_server()
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = SQLiteConversationStore(os.path.join(tmpdir, "history.db"))
+            FakeOpenRouterHandler.replies = [
+                json.dumps({"tool": "run_shell", "parameters": {"command": "echo compact"}}),
+                "Done"
+            ]
+            agent = make_agent(server, session_id="compact", conversation_store=store)
+            agent.process_message("Run it")
+            tool_result = agent.conversation_history[2]["content"]
+            assert "\n" not in tool_result and '"success":true' in tool_result, "Tool results should be compact JSON"
+            history = agent.get_conversation_history()
+            assert isinstance(history, HistoryView) and len(history) == 4
+            agent.process_message("Again")
+            assert len(history) == 6, "The history view should reflect the live history without copying it"
+            loaded = store.load("compact")
+            assert all(isinstance(message, Message) for message in loaded) and loaded == list(history)
+    finally:
+        server.shutdown()
+
+    report = measure_serialization("compact", turns=2, repeat=5)
+    print(f"Serialization smoke run: {report}")
+    assert report["serialized_bytes"] > 0
+
+    print("✓ Compact history messages test passed!")
+
+
+def test_speculative_tools():
+    """Read-only tools should start early and be reused; tools with side effects never should."""
+    print("\n" + "=" * 60)
+    print("Testing speculative tool execution")
+    print("=" * 60)
+
+    calls = []
+
+    def lookup(query: str) -> dict:
+        """Look something up."""
+        calls.append(("lookup", query))
+        return {"success": True, "answer": query.upper()}
+
+    def save(text: str) -> dict:
+        """Save some text."""
+        calls.append(("save", text))
+        return {"success": True}
+
+    register_tool(lookup, read_only=True)
+    register_tool(save)
+    used = SPECULATIVE_TOOLS.labels("lookup", "used")
+    discarded = SPECULATIVE_TOOLS.labels("lookup", "discarded")
+    server = start_fake_server()
+    try:
+        ready = []
+        parser = StreamingReplyParser(["lookup", "save"], ready.append)
+        reply = json.dumps([
+            {"tool": "lookup", "parameters": {"query": "a"}, "reasoning": "first"},
+            {"tool": "save", "parameters": {"text": "b"}, "reasoning": "second"}
+        ])
+        for i in range(0, len(reply), 5):
+            parser.feed(reply[i:i + 5])
+            if ready and len(ready) == 1:
+                assert not parser.complete, "A call should be ready before the reply is"
+        assert ready == [{"tool": "lookup", "parameters": {"query": "a"}}, {"tool": "save", "parameters": {"text": "b"}}]
+
+        native_ready = []
+        accumulator = ToolCallAccumulator(native_ready.append)
+        accumulator.feed([{"index": 0, "id": "call_1", "function": {"name": "lookup", "arguments": '{"query"'}}])
+        assert not native_ready, "Incomplete arguments aren't ready"
+        accumulator.feed([{"index": 0, "function": {"arguments": ': "a"}'}}])
+        assert native_ready[0]["parameters"] == {"query": "a"} and native_ready[0]["id"] == "call_1"
+
+        # Streaming: the lookup starts while the reply is still being parsed and runs once
+        FakeOpenRouterHandler.replies = [reply, "Saved"]
+        agent = make_agent(server)
+        before = used.value
+        events = list(agent.stream_message("Look up a and save b"))
+        print(f"Tool calls: {calls}")
+        assert events[-1]["event"] == "done", events[-1]
+        assert sorted(calls) == [("lookup", "a"), ("save", "b")], "Each tool should run exactly once"
+        assert used.value == before + 1, "The speculative lookup should be used"
+        assert SPECULATIVE_TOOLS.labels("save", "started").value == 0, "Side-effecting tools are never speculated"
+
+        # Prefetch: a right guess is reused, a wrong one is discarded, and only read-only guesses run
+        calls.clear()
+        guesses = lambda message: [
+            {"tool": "lookup", "parameters": {"query": message}},
+            {"tool": "save", "parameters": {"text": message}}
+        ]
+        FakeOpenRouterHandler.replies = [json.dumps({"tool": "lookup", "parameters": {"query": "x"}}), "Done"]
+        agent = make_agent(server, prefetch=guesses)
+        result = agent.process_message("x")
+        assert result["tool_result"] == {"success": True, "answer": "X"}
+        assert calls == [("lookup", "x")], "A matching prefetch should stand in for the tool call"
+        before = discarded.value
+        FakeOpenRouterHandler.replies = [json.dumps({"tool": "lookup", "parameters": {"query": "z"}}), "Done"]
+        agent.process_message("y")
+        assert sorted(calls) == [("lookup", "x"), ("lookup", "y"), ("lookup", "z")]
+        assert discarded.value == before + 1, "An unused prefetch should be discarded"
+
+        agent = make_agent(server, speculate=False)
+        assert agent._begin_speculation("x") is None, "Speculation can be turned off"
+    finally:
+        server.shutdown()
+        unregister_tool("lookup")
+        unregister_tool("save")
+
+    guess = predict_tool_calls("What is the capital of France?")
+    assert guess == [{"tool": "run_web_search", "parameters": {"query": "What is the capital of France"}}], guess
+    assert predict_tool_calls("Write hello to a file") == [], "Only lookups are prefetched"
+
+    print("✓ Speculative tool execution test passed!")
+
+
+def test_cold_start():
+    """Imports should skip requests, and the warmup should connect ahead and prebuild agents."""
+    print("\n" + "=" * 60)
+    print("Testing cold start")
+    print("=" * 60)
+
+    loaded = subprocess.run(
+        [sys.executable, "-c", "import sys, core.agent; print('requests' in sys.modules)"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+    ).stdout.strip()
+    assert loaded == "False", "requests should only be imported once a synchronous client is built"
+    loaded = subprocess.run(
+        [sys.executable, "-c", "import sys, api.asgi; print('flask' in sys.modules or 'api.server' in sys.modules)"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+    ).stdout.strip()
+    assert loaded == "False", "The ASGI app should not build the Flask app's state"
+    script = ("import api.server, core.http; api.server.app.test_client().get('/'); "
+              "print(core.http._shared_client is None)")
+    loaded = subprocess.run(
+        [sys.executable, "-c", script], cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=dict(os.environ, OPENROUTER_API_KEY="test-key", WARMUP_ENABLED="false"),
+        capture_output=True, text=True, check=True
+    ).stdout.strip()
+    assert loaded == "True", "The health check should not build the HTTP client"
+
+    server = start_fake_server()
+    try:
+        client = PooledHTTPClient(max_retries=0)
+        built = []
+        pool = AgentPool(lambda: built.append(1) or make_agent(server, http_client=client), size=2)
+        url = f"http://127.0.0.1:{server.server_address[1]}/api/v1/chat/completions"
+        report = warmup(url, connect=client.preconnect, agent_pool=pool)
+        print(f"Warmup: {report}")
+        assert report["errors"] == {}, "Every warmup step should succeed"
+        assert set(report["steps"]) == {"resolve", "connect", "tokenizer", "system_prompt", "tool_schemas", "agents"}
+        assert get_warmup_report() is report, "The last report should be kept for the health check"
+        assert client.preconnect(url) is False, "The warmup connection should already be pooled"
+        assert len(built) == 2 and pool.get_stats()["ready"] == 2, "The pool should be filled once"
+        assert pool.fill() == 0, "A filled pool isn't built again"
+
+        agent = pool.take("first")
+        assert agent.session_id == "first", "A prebuilt agent should be bound to its session"
+        agent.process_message("Hello")
+        stats = client.get_stats()
+        assert stats["connection_misses"] == 1 and stats["connection_hits"] == 2, \
+            "The first call should use the connection opened by the warmup"
+
+        pool.take("second")
+        assert pool.take("third").session_id == "third" and len(built) == 3, \
+            "An empty pool should build agents on demand"
+        assert pool.get_stats() == {"built_ahead": 2, "handed_out": 2, "built_on_demand": 1, "size": 2, "ready": 0}
+    finally:
+        server.shutdown()
+
+    report = warmup("http://cold-start.invalid/", agent_pool=None)
+    assert "resolve" in report["errors"] and "tokenizer" not in report["errors"], \
+        "A failed step should be reported without stopping the others"
+
+    print("✓ Cold start test passed!")
+
+
+def main():
+    """Run all tests."""
+    print("\n" + "=" * 60)
+    print("AI Agent Test Suite")
+    print("=" * 60)
+
+    try:
+        test_connection_reuse()
+        test_async_agent_tool_call()
+        test_streaming_parser()
+        test_stream_message()
+        test_system_prompt_cache()
+        test_session_store_eviction()
+        test_context_budget()
+        test_parallel_tool_loop()
+        test_conversation_store()
+        test_prefork_launcher()
+        test_metrics()
+        test_benchmark_smoke()
+        test_model_router()
+        test_completion_cache()
+        test_function_calling()
+        test_background_jobs()
+        test_batch_processing()
+        test_rate_limits()
+        test_compact_messages()
+        test_speculative_tools()
+        test_cold_start()
+
+        print("\n" + "=" * 60)
+        print("✓ All tests passed successfully!")
+        print("=" * 60 + "\n")
+        return 0
+
+    except AssertionError as e:
+        print(f"\n✗ Test failed: {e}")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,14 +3,23 @@ Test script to validate tools functionality.
 Tests each tool independently without requiring API key.
 """
 
+import asyncio
 import sys
 import os
+import subprocess
 import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
 # Add parent directory to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from core.tools import run_shell, run_web_search, write_to_file, get_tool_description
+from core.search_cache import SearchCache, normalize_query
+from core.shell_pool import ShellWorkerPool
+from core.write_engine import WriteEngine, close_write_engine
+from core.tools import run_shell, run_web_search, write_files, write_to_file, get_tool_description, tool_session
+from core.tools import TOOL_DESCRIPTIONS, TOOLS, LazyTool, describe_tool, get_tool_list, load_plugins, unregister_tool
 
 
 def test_run_shell():
@@ -32,6 +41,174 @@ def test_run_shell():
     print("✓ run_shell test passed!")
 
 
+def test_run_shell_output_cap():
+    """Test that run_shell bounds captured output and kills timed-out commands."""
+    print("\n" + "=" * 60)
+    print("Testing run_shell output cap and timeout")
+    print("=" * 60)
+    
+    chunks = []
+    result = run_shell(
+        "yes hello | head -c 1000000",
+        max_output_bytes=100,
+        on_output=lambda stream, text: chunks.append(text)
+    )
+    print(f"Captured: {len(result['output'])} chars")
+    
+    assert result['success'], "Command should succeed"
+    assert "[... 999900 bytes truncated ...]" in result['output'], "Output should carry a truncation marker"
+    assert result['output'].startswith("hello"), "Head of the output should be kept"
+    assert len(result['output']) < 200, "Captured output should stay within the cap"
+    assert sum(len(chunk) for chunk in chunks) == 1000000, "Callback should see the full stream"
+    
+    result = run_shell("sleep 30 & sleep 30", timeout=1)
+    print(f"Timeout error: {result['error']}")
+    assert not result['success'], "Timed out command should fail"
+    assert "timed out" in result['error'], "Error should mention the timeout"
+    
+    started = time.monotonic()
+    result = run_shell("sleep 6 & echo hi", timeout=1)
+    print(f"Background child: {result['error']} after {time.monotonic() - started:.1f}s")
+    assert not result['success'] and "timed out" in result['error'], \
+        "A background child holding stdout open should count against the timeout"
+    assert time.monotonic() - started < 3, "The call should return at the deadline"
+    
+    print("✓ run_shell output cap test passed!")
+
+
+def test_shell_pool():
+    """Test that pooled shell workers keep state and recycle."""
+    print("\n" + "=" * 60)
+    print("Testing persistent shell worker pool")
+    print("=" * 60)
+    
+    pool = ShellWorkerPool(max_workers=1, max_commands=3)
+    try:
+        pool.run("a", "cd /tmp && export POOL_VAR=kept")
+        result = pool.run("a", "pwd; echo $POOL_VAR; printf tail")
+        print(f"Output: {result['output']!r}")
+        assert result == {"success": True, "output": "/tmp\nkept\ntail", "error": "", "returncode": 0}, \
+            "Worker should keep cwd and env and frame output exactly"
+        
+        result = pool.run("a", "echo oops >&2; false")
+        assert result['returncode'] == 1 and result['error'] == "oops\n", "Exit status and stderr should be kept"
+        assert pool.get_stats()['recycled'] == 1, "Worker should be recycled after max_commands"
+        assert pool.run("a", "pwd")['output'] != "/tmp\n", "Recycled worker should start fresh"
+        
+        result = pool.run("a", "sleep 30", timeout=1)
+        assert "timed out" in result['error'], "Error should mention the timeout"
+        assert pool.run("a", "echo 'unterminated")['returncode'] == 2, "Syntax errors should not hang the worker"
+        assert pool.run("b", "true")['success'], "A new session should take over the idle worker slot"
+        assert pool.get_stats()['workers'] == 1, "Pool should cap its workers"
+        
+        token = tool_session.set("a")
+        try:
+            assert run_shell("echo pooled")['output'] == "pooled\n", "run_shell result shape should not change"
+        finally:
+            tool_session.reset(token)
+    finally:
+        pool.close()
+    
+    pool = ShellWorkerPool(max_workers=2)
+    try:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda _: pool.run("c", "sleep 0.2; echo c"), range(4)))
+        stats = pool.get_stats()
+        print(f"Concurrent runs for one session: {stats}")
+        assert stats['spawned'] == 1 and stats['workers'] == 1, "One session should get one worker"
+        assert all(result is None or result['output'] == "c\n" for result in results), \
+            "Calls that find the session busy should fall back to a one-shot process"
+    finally:
+        pool.close()
+    
+    print("✓ shell pool test passed!")
+
+
+def test_search_cache():
+    """Test search caching, TTL expiry, coalescing and the disk layer."""
+    print("\n" + "=" * 60)
+    print("Testing search cache")
+    print("=" * 60)
+    
+    calls = []
+    
+    def fetch(query, num_results):
+        calls.append(query)
+        time.sleep(0.2)
+        return {"success": True, "query": query, "results": [], "count": 0}
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "search.db")
+        cache = SearchCache(max_entries=2, ttl=60, path=path)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: cache.get_or_fetch("Python", 5, fetch), range(8)))
+        stats = cache.get_stats()
+        print(f"Stats: {stats}")
+        assert len(calls) == 1, "Concurrent identical searches should share one upstream call"
+        assert stats['misses'] == 1 and stats['coalesced'] + stats['hits'] == 7, "Counters should add up"
+        assert sum(not result['cached'] for result in results) == 1, "Only the fetching caller is uncached"
+        
+        result = cache.get_or_fetch("  python ", 5, fetch)
+        assert result['cached'] and result['query'] == "  python ", "Normalized queries should hit the cache"
+        assert not cache.get_or_fetch("python", 3, fetch)['cached'], "num_results is part of the key"
+        
+        cache.get_or_fetch("rust", 5, fetch)
+        assert cache.get_stats()['evictions'] == 1, "Memory layer should stay within max_entries"
+        
+        restarted = SearchCache(max_entries=2, ttl=60, path=path)
+        assert restarted.get_or_fetch("python", 5, fetch)['cached'], "Disk layer should survive a restart"
+        assert restarted.get_stats()['disk_hits'] == 1, "Hit should come from disk"
+        
+        expiring = SearchCache(ttl=0.1)
+        expiring.get_or_fetch("go", 5, fetch)
+        time.sleep(0.15)
+        assert not expiring.get_or_fetch("go", 5, fetch)['cached'], "Expired results should be refetched"
+        
+        failing = SearchCache()
+        failing.get_or_fetch("x", 5, lambda query, n: {"success": False, "query": query, "error": "down"})
+        assert failing.get_stats()['entries'] == 0, "Failed searches should not be cached"
+        
+        def fetch_failure(query, num_results):
+            time.sleep(0.2)
+            return {"success": False, "query": query, "error": "down"}
+        
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda _: failing.get_or_fetch("y", 5, fetch_failure), range(4)))
+        assert failing.get_stats()['coalesced'] > 0, "Followers should wait on the leader"
+        assert not any(result['cached'] for result in results), "A shared failure should not be marked cached"
+        
+        async def cancel_leader():
+            async def slow_fetch(query, num_results):
+                await asyncio.sleep(0.1)
+                return {"success": True, "query": query, "results": []}
+            
+            coalescing = SearchCache()
+            leader = asyncio.ensure_future(coalescing.aget_or_fetch("z", 5, slow_fetch))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(coalescing.aget_or_fetch("z", 5, slow_fetch))
+            await asyncio.sleep(0.05)
+            leader.cancel()
+            return await follower
+        
+        result = asyncio.run(cancel_leader())
+        assert result['success'] and not result['cached'], "A follower should fetch for itself if the leader is cancelled"
+        
+        pruned_path = os.path.join(tmpdir, "pruned.db")
+        bounded = SearchCache(ttl=60, path=pruned_path, max_disk_entries=2)
+        for query in ("a", "b", "c", "d"):
+            bounded.put(normalize_query(query, 5), {"success": True, "results": []})
+        assert bounded.prune() == 2, "Rows beyond max_disk_entries should be pruned"
+        assert SearchCache(path=pruned_path).get(normalize_query("d", 5)), "The newest rows should be kept"
+        
+        stale = SearchCache(ttl=0.05, path=pruned_path)
+        stale.put(normalize_query("e", 5), {"success": True, "results": []})
+        time.sleep(0.1)
+        reopened = SearchCache(path=pruned_path)
+        assert reopened.get_stats()['disk_pruned'] == 1, "Expired rows should be pruned on open"
+    
+    print("✓ search cache test passed!")
+
+
 def test_write_to_file():
     """Test the write_to_file tool."""
     print("\n" + "=" * 60)
@@ -106,9 +283,156 @@ def test_tool_descriptions():
         print(f"  Description: {descriptions[tool_name]['description']}")
         print(f"  Parameters: {descriptions[tool_name]['parameters']}")
     
+    assert descriptions["run_shell"]["description"] == "Execute shell commands and return the output"
+    assert descriptions["run_web_search"]["description"] == "Search the web and return relevant results"
+    assert descriptions["write_to_file"]["description"] == "Write content to a file"
+    assert not any("schema" in description for description in descriptions.values()), \
+        "Descriptions should keep their public shape"
+    assert not any("schema" in listed for listed in get_tool_list()), "/tools entries should keep their shape"
+    
     print("\n✓ Tool descriptions test passed!")
 
 
+def test_tool_registry():
+    """Test decorator-derived metadata and lazily loaded plugin tools."""
+    print("\n" + "=" * 60)
+    print("Testing tool registry and plugins")
+    print("=" * 60)
+    
+    def greet(name: str, times: Optional[int] = None) -> dict:
+        """
+        Greet someone.
+        
+        Args:
+            name: Who to greet
+            times: How many times
+        """
+        return {"success": True, "output": " ".join([f"Hello {name}"] * (times or 1))}
+    
+    spec = describe_tool(greet)
+    print(f"Derived: {spec}")
+    assert spec["description"] == "Greet someone", "Description should come from the docstring"
+    assert spec["parameters"] == "name (str), times (int, optional)", "Summary should come from the signature"
+    assert spec["schema"]["properties"]["name"] == {"type": "string", "description": "Who to greet"}
+    assert TOOL_DESCRIPTIONS["run_shell"]["parameters"] == "command (str), timeout (int, optional)", \
+        "Excluded parameters should stay hidden from the model"
+    
+    script = "import core.agent, core.tools; print(core.tools._plugins_loaded)"
+    output = subprocess.run([sys.executable, "-c", script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "False", "Importing the agent should not scan for plugins"
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        dist_info = os.path.join(tmpdir, "greeter_plugin-1.0.dist-info")
+        os.makedirs(dist_info)
+        with open(os.path.join(dist_info, "METADATA"), "w") as f:
+            f.write("Metadata-Version: 2.1\nName: greeter-plugin\nVersion: 1.0\n")
+        with open(os.path.join(dist_info, "entry_points.txt"), "w") as f:
+            f.write("[test_agent.tools]\ngreet = greeter_plugin:greet\n")
+        with open(os.path.join(tmpdir, "greeter_plugin.py"), "w") as f:
+            f.write(
+                "def greet(name: str) -> dict:\n"
+                "    \"\"\"Greet someone from a plugin.\"\"\"\n"
+                "    return {'success': True, 'output': f'Hello {name}'}\n"
+            )
+        cache_path = os.path.join(tmpdir, "cache", "tool_metadata.json")
+        sys.path.insert(0, tmpdir)
+        try:
+            assert load_plugins("test_agent.tools", cache_path) == ["greet"], "Plugin should be discovered"
+            assert TOOL_DESCRIPTIONS["greet"]["description"] == "Greet someone from a plugin"
+            assert os.path.exists(cache_path), "Plugin metadata should be cached"
+            
+            # A later start describes the plugin from the cache without importing it
+            unregister_tool("greet")
+            del sys.modules["greeter_plugin"]
+            load_plugins("test_agent.tools", cache_path)
+            assert isinstance(TOOLS["greet"], LazyTool), "Cached plugin should be registered lazily"
+            assert "greeter_plugin" not in sys.modules, "Plugin should not be imported before first use"
+            assert any(listed["name"] == "greet" for listed in get_tool_list()), "Plugin should be listed"
+            assert TOOLS["greet"](name="plugin")["output"] == "Hello plugin", "First call should load the plugin"
+            assert "greeter_plugin" in sys.modules
+        finally:
+            sys.path.remove(tmpdir)
+            sys.modules.pop("greeter_plugin", None)
+            unregister_tool("greet")
+    
+    print("✓ Tool registry test passed!")
+
+
+def test_write_engine():
+    """Test buffered appends, atomic full writes and bulk writes."""
+    print("\n" + "=" * 60)
+    print("Testing write engine")
+    print("=" * 60)
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        log = os.path.join(tmpdir, "logs", "run", "events.log")
+        engine = WriteEngine(flush_interval=60)
+        results = [engine.write(log, f"line {i}\n", "a") for i in range(3)]
+        assert all(result["buffered"] for result in results), "Appends should be buffered"
+        assert results[-1]["file_size"] == 21, "The reported size should include buffered appends"
+        assert not os.path.exists(log), "Nothing should reach the file before a flush"
+        engine.flush()
+        with open(log) as f:
+            assert f.read() == "line 0\nline 1\nline 2\n", "Appends should be written in order"
+        stats = engine.get_stats()
+        print(f"Stats: {stats}")
+        assert stats["appends"] == 3 and stats["files_flushed"] == 1, "Three appends should be one write"
+        
+        # A full write supersedes buffered appends and keeps the file's permissions
+        engine.write(log, "dropped\n", "a")
+        os.chmod(log, 0o600)
+        result = engine.write(log, "fresh\n", "w")
+        assert result["success"] and result["file_size"] == 6
+        with open(log) as f:
+            assert f.read() == "fresh\n", "The full write should replace the file"
+        assert os.stat(log).st_mode & 0o777 == 0o600, "Permissions should be kept"
+        assert os.listdir(os.path.dirname(log)) == ["events.log"], "No temporary files should be left"
+        assert engine.get_stats()["superseded"] == 1
+        
+        # A known directory removed behind the engine's back is created again
+        os.remove(log)
+        os.rmdir(os.path.dirname(log))
+        assert engine.write(log, "again\n", "w")["success"], "Removed directories should be recreated"
+        
+        # The buffer bound and the flush interval both write appends out
+        small = WriteEngine(max_buffer_bytes=8, flush_interval=60)
+        small.write(log, "0123456789", "a")
+        assert os.path.getsize(log) == 16, "A full buffer should be flushed straight away"
+        timed = WriteEngine(flush_interval=0.05)
+        timed.write(log, "tick\n", "a")
+        deadline = time.monotonic() + 5
+        while os.path.getsize(log) != 21 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert os.path.getsize(log) == 21, "The flusher should write appends after the interval"
+        timed.close()
+        
+        # Bulk writes, one bad entry failing on its own
+        first, second = os.path.join(tmpdir, "a.txt"), os.path.join(tmpdir, "nested", "b.txt")
+        result = write_files([
+            {"filepath": first, "content": "A"},
+            {"filepath": second, "content": "B"},
+            {"filepath": first}
+        ])
+        print(f"Bulk result: {result}")
+        assert result["count"] == 3 and not result["success"], "A bad entry should fail the batch"
+        assert result["results"][0]["success"] and result["results"][1]["success"]
+        assert open(second).read() == "B", "Bulk writes should create directories"
+        
+        # With the engine enabled, run_shell sees buffered appends
+        os.environ["WRITE_ENGINE_ENABLED"] = "true"
+        os.environ["WRITE_ENGINE_FLUSH_INTERVAL"] = "60"
+        try:
+            assert write_to_file(first, "B", "a")["buffered"], "write_to_file should go through the engine"
+            assert run_shell(f"cat {first}")["output"] == "AB", "Shell commands should see buffered appends"
+        finally:
+            os.environ.pop("WRITE_ENGINE_ENABLED")
+            os.environ.pop("WRITE_ENGINE_FLUSH_INTERVAL")
+            close_write_engine()
+    
+    print("✓ Write engine test passed!")
+
+
 def main():
     """Run all tests."""
     print("\n" + "=" * 60)
@@ -117,9 +441,14 @@ def main():
     
     try:
         test_run_shell()
+        test_run_shell_output_cap()
+        test_shell_pool()
         test_write_to_file()
+        test_write_engine()
         test_web_search()
+        test_search_cache()
         test_tool_descriptions()
+        test_tool_registry()
         
         print("\n" + "=" * 60)
         print("✓ All tests passed successfully!")